@@ -1,28 +1,47 @@
-from welly import Well, Project # Welly is used to organize the well data and project collection
-from striplog import Legend, Striplog
-import matplotlib.pyplot as plt
-from matplotlib import ticker
-import plotly.express as px # plotly is used as the main display functionality
-import matplotlib.pyplot as plt 
-
-from dash import Dash, callback_context # dash is used to update the plot and fields dynamically in a web browser
+from striplog import Legend
+
+from dash import Dash, callback_context, no_update # dash is used to update the plot and fields dynamically in a web browser
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 
 import flask
 from glob import glob
 
+import hashlib
 import json
 import numpy as np
-import pandas as pd
 from pathlib import Path
-import base64
+from urllib.parse import quote
 import os
-
+import uuid
+from datetime import datetime, timezone
+
+import autocorr
+import bulk_tops
+import curve_query
+import curve_stats
+import decimate
+import dtw
 import helper
+import lazy_project
+import lru
+import parallel_load
+import pick_store
+import render_queue
+import spatial
+import tops
+import xsection
+import xsection_data
+
+
+def well_curves(w):
+    """
+    Gets the curve names of a well, without the tops striplog kept next to them in w.data
+    """
+    return sorted(c for c in w.data.keys() if c != 'tops')
 
 
 def get_curves(p):
@@ -31,115 +50,12 @@ def get_curves(p):
     """
     curve_list = []
     for well in p:
-        curves = well.data.keys()
+        curves = well_curves(well)
         for c in curves:
             curve_list.append(c)
     return sorted(set(curve_list))
 
 
-def df_to_csvtxt(df, out_fields = ['top', 'Comp formation']):
-    """
-    This take a DataFram (df) for a well, and converts it into
-    as csv-like string to make a Striplog
-    """ 
-    header = 'top, Comp formation\n'
-    csv_txt = ''
-    csv_txt += csv_txt + header
-    for i, row in df.iterrows():
-        csv_txt = csv_txt + str(row['MD']) + ', ' + row['PICK'] + '\n'
-    return csv_txt
-
-
-def get_tops_df(project, tops_field='tops', columns=['UWI', 'PICK', 'MD']):
-    """
-    Returns a DataFrame of tops from a welly Project
-    """
-    tops_set = []
-    rows = []
-    for well in project:
-        for t in well.data[tops_field]:
-            row = [well.uwi, t.components[0]['formation'], t.top.middle]
-            tops_set.append(t.components[0]['formation'])
-            rows.append(row)
-    df = pd.DataFrame(rows, columns=columns)
-    return df
-
-
-def make_well_project(laspath='data/las/', stripath='data/tops/'):
-    """
-    Return a dictionary of wells and striplogs where the
-    key is the base filename
-
-    This assumes that the las file and tops files have the same name
-    """
-    wells = {}
-    lasfiles = glob(laspath + '*.LAS')
-    stripfiles = glob(stripath + '*.csv')
-    for fname, sname in zip(lasfiles, stripfiles):
-        name = Path(fname).stem
-        wells[name] = Well.from_las(fname)
-        wells[name].data['tops'] = Striplog.from_csv(sname)
-        proj = Project(list(wells.values()))
-    return proj
-
-
-def section_plot(p, legend, ymin=3000, ymax=5500, sorted_well_list=None):
-    
-    if sorted_well_list:
-        print('SORTED WELL LIST:', sorted_well_list)
-        print('LENGTH OF P before sorting', len(p))
-        p = sort_project(p, sorted_well_list)
-        for w in p:
-            print(w.uwi)
-        print('LENGTH or SORTED PROJ', len(p))
-
-    print("NUMBER OF AXES: ", len(p))
-    if len(p) == 1:
-        fig, ax = plt.subplots(ncols=1, figsize=(len(p)*2.5, 12))
-        ax =  plot_well(ax, p[0], legend=legend, depth_ticks=False)
-    else:
-        fig, axs  = plt.subplots(ncols=len(p), figsize=(len(p)*1.0, 10))
-        for i, w in enumerate(p):
-            print(i, w.uwi)
-            if i == 0:
-                axs[i] = plot_well(axs[i], w, legend=legend, depth_ticks=True)
-            else:
-                axs[i] = plot_well(axs[i], w, legend=legend)
-    plt.tight_layout()
-    return fig
-
-
-def setup_ax(ax, depth=False, major=100, minor=25):
-    """Set up common parameters for the Axes in the example."""
-    # only show the bottom spine
-    ax.yaxis.set_major_locator(ticker.NullLocator())
-    ax.spines.right.set_color('none')
-    ax.spines.left.set_color('grey')
-    ax.spines.top.set_color('none')
-    ax.xaxis.set_ticks_position('bottom')
-    ax.tick_params(which='major', width=1.00, length=5)
-    ax.tick_params(which='minor', width=0.75, length=2.5)
-    ax.yaxis.set_major_locator(ticker.MultipleLocator(major))
-    ax.yaxis.set_minor_locator(ticker.MultipleLocator(minor))
-    ax.patch.set_alpha(0.0)
-    ax.tick_params(axis='y', labelsize=5)
-    ax.set_ylim(ymax, ymin)
-    return 
-
-
-def plot_well(ax, w, legend, depth_ticks=False, ymin=3000, ymax=5500):
-    ax.set_title(w.header.uwi, fontsize=7, loc='center', fontweight='bold', 
-                rotation=rot_title(w.header.uwi))
-    plot_tops(ax, w.data['tops'], field='formation', ymin=ymin, ymax=ymax)
-    w.data['tops'].plot(ax=ax, legend=legend, alpha=0.5)
-    ax.plot(w.data['GR'] / 120, w.data['GR'].basis, c='k', lw=0.5)
-    ax.set_xlim(0, 175 / 120)
-    if depth_ticks == False:
-        ax.set_yticklabels([])
-    setup_ax(ax)
-    return ax
-
-
 def get_first_curve(curve_list):
     if 'GR' in curve_list:
         curve = 'GR'
@@ -148,58 +64,14 @@ def get_first_curve(curve_list):
     return curve
 
 
-def plot_tops(ax, striplog, ymin=0, ymax=1e6, legend=None, field=None, **kwargs):
-    """
-    Plotting, but only for tops (as opposed to intervals).
-    """
-    if field is None:
-        raise StriplogError('You must provide a field to plot.')
-
-    ys = [iv.top.z for iv in striplog]
-
-    try:
-        try:
-            ts = [getattr(iv.primary, field) for iv in striplog]
-        except:
-            ts = [iv.data.get(field) for iv in striplog]
-    except:
-        print('Could not find field')
-        # raise StriplogError('Could not retrieve field.')
-
-    for y, t in zip(ys, ts):
-        if (y > ymin) and (y < ymax):
-            ax.axhline(y, color='dimgrey', lw=2, zorder=0)
-            ax.text(0.1, y, t, 
-                    fontsize=5, color=(0.2,0.2,0.2,1), ha='left', va='center', 
-                    bbox=dict(facecolor='white',
-                              edgecolor='None', #edgecolor='lightgrey',
-                              boxstyle='round, pad=0.1',
-                              alpha=0.85))
-    return
-
-
-def rot_title(title, max_title_len=10):
-    if len(title) > max_title_len:
-        rotate = 90
-    else:
-        rotate = 0
-    return rotate
-
-
-def encode_xsection(p, legend, savefig=True):
-    """
-    Takes the project and saves a xsec PNG a disk and encodes it for dash
-    """
-    fig = section_plot(p, legend)
-    image_filename = 'cross_section.png' # replace with your own image 
-    if savefig:
-        fig.savefig(image_filename)
-    encoded_image = base64.b64encode(open(image_filename, 'rb').read())
-    return 'data:image/png;base64,{}'.format(encoded_image.decode())
-
-
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 # Create server variable with Flask server object for use with gunicorn
+# Run it with --preload (e.g. gunicorn --preload -w 4 app:server) so the well cache is
+# brought up to date once in the master, and the workers share the curves it maps.
+# Nothing is started at import that a fork would lose: the render threads, the panel worker processes
+# and the SQLite connection are started in each worker on first use.
+# With several workers the picks must be in the SQLite pick store (pick_store_path below),
+# the pick journal can only be used by one process
 server = app.server
 
 
@@ -214,35 +86,202 @@ stripfiles = glob(path2 + '*.csv')
 
 legend = Legend.from_csv(filename='data/Poseidon_data/tops_legend.csv') # direct link to specific data
 
-p = Project.from_las('data/Poseidon_data/las/*.LAS') # direct link to specific data
-well_uwi = [w.uwi for w in p] ##gets the well uwi data for use in the well-selector tool
-
-# Add striplogs to Project
+# Load the Project with striplogs attached. Only the LAS headers are read here,
+# curves are loaded the first time they are plotted (through the on-disk well cache)
+# and dropped again when they haven't been used and curve_budget is exceeded.
 # Striplog must have the same name as LAS file.
 # e.g. Torosa-1.LAS and Torosa-1.csv
-for w in p:
-    name = Path(w.fname).stem
-    strip = Striplog.from_csv(f'data/Poseidon_data/tops/{name}.csv')  # direct link to specific data
-    w.data['tops'] = strip
+curve_budget = 256 * 2**20 # bytes of curve data kept in memory per worker
+# Map the curves read-only from the well cache: one copy in the OS page cache for all workers,
+# only curves that aren't mapped count against curve_budget
+shared_curves = True
+
+# Or load the tops and well locations from a tops database (tab-delimited PICKS.TXT and WELLS.TXT)
+# e.g. tops_db = ('data/McMurray_data/las/', 'data/McMurray_data/PICKS.TXT', 'data/McMurray_data/WELLS.TXT')
+tops_db = None
+log_list = ['GR', 'DT'] # curves of the log plot
+# UWIs in order along a section, one per line: the wells Propagate All Tops goes through when no
+# section line is drawn on the map
+section_line_file = None
+ymin, ymax = 3000, 5500 # make dynamic later
+
+if shared_curves: # parse any new or changed LAS files into the well cache before it's mapped
+    parallel_load.warm_cache(tops_db[0] if tops_db else path, None if tops_db else path2)
+
+if tops_db:
+    p, surface_picks_df, _ = bulk_tops.load_project(*tops_db, max_bytes=curve_budget, mmap=shared_curves)
+    log_list = ['GR', 'ILD']
+    ymin, ymax = 150, 550
+    section_line_file = 'data/McMurray_data/AtoAprime.txt'
+else:
+    p = lazy_project.from_las(path, path2, max_bytes=curve_budget, mmap=shared_curves) # direct link to specific data
+    surface_picks_df = tops.project_tops_df(p)
+well_uwi = [w.uwi for w in p] ##gets the well uwi data for use in the well-selector tool
+well_uwi_set = set(well_uwi)
 
 
 well = p[0]  ##gets data from the first well in the Welly Project
 curve_list = get_curves(p) ##gets the column names for later use in the curve-selector tool
 curve = get_first_curve(curve_list)
-surface_picks_df = get_tops_df(p)
+
+# Picks live server-side in the pick store, the tops-storage div only holds a version token.
+# The SQLite store is shared by every gunicorn worker and keeps the picks through restarts.
+# Set pick_store_path to 'data/picks.jsonl' for the faster pick journal (single process only,
+# e.g. python app.py), or None to keep them in memory only. The tops files only seed an empty store.
+pick_store_path = 'data/picks.sqlite'
+picks = pick_store.open_store(pick_store_path)
+if len(picks) == 0:
+    picks.update_df(surface_picks_df)
+    picks.set_pick_ids(bulk_tops.pick_ids(surface_picks_df))
+    if hasattr(picks, 'compact'):
+        picks.compact() # start from a snapshot rather than one huge journal line
+
+# The project p (curves and load-time tops) is shared by every user and never modified after loading.
+# Each browser session picks in its own copy-on-write layer over the pick store until it commits.
+sessions = lru.LRUCache(1024, sizeof=lambda layer: 1)
+# Uncommitted picks of a session that made no edit for session_ttl seconds are dropped (e.g. a tab
+# closed without committing). Layers expire in the store rather than with the sessions cache, which
+# is per worker: another worker may still be serving the session
+session_ttl = 7 * 24 * 3600
+picks.expire_layers(session_ttl)
+
+
+def session_picks(session=None):
+    """
+    The picks as seen by one browser session: its layer over the shared pick store.
+    Without a session id, the shared picks themselves
+    """
+    if not session:
+        return picks
+
+    def new_layer():
+        picks.expire_layers(session_ttl) # a new session in this worker is a good time to tidy up
+        return picks.layer(session)
+
+    return sessions.get_or_compute(session, new_layer)
+
+# map of the well locations, to draw section lines on
+well_index = spatial.WellIndex.from_project(p)
+
+# Cross-section panels are cached per well and only redrawn when that well's picks change
+# The tops are taken from the session's picks, panels are shared by sessions that see the same picks
+# Every panel has the same GR scale, from the wells' curve statistics (worked out at ingest)
+# The panels of a new section are drawn by xsection_workers processes, 1 to draw them in the render thread
+xsection_workers = min(4, os.cpu_count())
+xsec = xsection.XSection(legend, ymin=ymin, ymax=ymax, gr_range=curve_stats.project_range(p, 'GR'),
+                         workers=xsection_workers)
+
+
+def render_xsection(key):
+    """
+    PNG of the cross-section for key = (session, tuple of UWIs, empty for all wells)
+    """
+    session, section = key
+    return xsec.png(p, list(section) or None, picks=session_picks(session))
+
+
+# The cross-section is drawn in the background. Edits made while it's drawing are coalesced
+# into one more render, and the page keeps showing the last good image in the meantime.
+renders = render_queue.RenderQueue(render_xsection, lambda key: session_picks(key[0]).version)
+xsection_timeout = 30 # seconds the first request of a section waits for it, then a 503 (the poll swaps the image in later)
+max_section_wells = 200 # longest section drawn, every list of wells is a render of its own
+
+
+def section_key(session, section_wells):
+    """
+    Render queue key of a section: the wells of section_wells that are in the project, in order,
+    at most max_section_wells of them
+    """
+    section = [uwi for uwi in section_wells or [] if isinstance(uwi, str) and uwi in well_uwi_set]
+    return session, tuple(section[:max_section_wells])
+
+
+def xsection_url(section_wells=None, version=None, session=None):
+    """
+    URL of the cross-section image rendered at a picks version (default the latest image).
+    section_wells is the list of UWIs to show, in order, default all wells
+    """
+    args = []
+    if version is not None:
+        args.append('v={}'.format(quote(str(version))))
+    if session:
+        args.append('session=' + quote(session))
+    if section_wells:
+        args.append('wells=' + quote(json.dumps(section_wells)))
+    return app.get_relative_path('/xsection.png' + ('?' + '&'.join(args) if args else ''))
+
+
+@server.route('/xsection.png')
+def serve_xsection():
+    """
+    The last good cross-section PNG from the render queue. Only the very
+    first request of a section waits for it to be drawn, for up to
+    xsection_timeout seconds. ETag and
+    Last-Modified come from the image so the browser gets a 304 when
+    nothing changed.
+    """
+    wells = flask.request.args.get('wells')
+    try:
+        section_wells = json.loads(wells) if wells else []
+    except ValueError:
+        flask.abort(400)
+    if not isinstance(section_wells, list):
+        flask.abort(400)
+    key = section_key(flask.request.args.get('session'), section_wells)
+    image = renders.wait(key, timeout=xsection_timeout)
+    if image is None: # still drawing, or the render failed
+        return flask.Response('Cross-section not ready', status=503, headers={'Retry-After': '5'})
+    version, png, rendered = image
+    etag = 'xsec-{}'.format(quote(str(version)))
+    if key[1]:
+        etag += '-' + hashlib.sha1(json.dumps(key[1]).encode()).hexdigest()[:10]
+    last_modified = datetime.fromtimestamp(int(rendered), tz=timezone.utc)
+    request = flask.request
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and request.if_modified_since is not None
+            and request.if_modified_since >= last_modified):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(png, mimetype='image/png')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True # always revalidate, the ETag makes that cheap
+    return response
+
+
+@server.route('/metrics')
+def serve_metrics():
+    """
+    Hit/miss counters of the in-memory caches, in Prometheus text format
+    """
+    caches = {'log_figures': helper.figure_cache,
+              'curve_pyramids': decimate.pyramids,
+              'depth_indexes': curve_query.indexes,
+              'curve_stats': curve_stats.computed,
+              'xsection_panels': xsec.panels,
+              'xsection_images': renders,
+              'sessions': sessions}
+    if hasattr(p, 'store'):
+        caches['curves'] = p.store.curves
+    return flask.Response(lru.metrics_text(caches), mimetype='text/plain; version=0.0.4')
+
+# columns of the curve by formation table (curve_stats.formation_stats)
+FORMATION_STATS_COLUMNS = ['formation', 'top', 'base', 'count', 'null_fraction', 'min', 'p10', 'p50', 'p90',
+                           'max', 'mean']
 
 #well dropdown selector
 well_dropdown_options = [{'label': k, 'value': k} for k in sorted(well_uwi)] ##list of wells to the dropdown
 #tops dropdown options
 """we need to have a stratigraphic column at some point"""
-tops_dropdown_options = [{'label': k, 'value': k} for k in list(surface_picks_df['PICK'].unique())] ##list of tops to the dropdown
+tops_dropdown_options = [{'label': k, 'value': k} for k in picks.pick_names()] ##list of tops to the dropdown
 ##well log curve dropdown options
 curve_dropdown_options = [{'label': k, 'value': k} for k in sorted(curve_list)] ##list of well log curves to the dropdown
 
 # draw the initial plot
 #plotting only GR and RD in a subplot
-ymin, ymax = 3000, 5500 # make dynamic later
-fig_well_1 = helper.make_log_plot(w=well, ymin=ymin)
+fig_well_1 = helper.make_log_plot(w=well, log_list=log_list, ymin=ymin)
+fig_well_1.update_layout(uirevision=well.uwi)
+picks_well_1 = helper.pick_shapes(picks.get_well(well.uwi))
 
 app.title = "SwellCorr"
 
@@ -263,7 +302,11 @@ controls = dbc.Card(
                     dbc.Label("Select a Pick to Edit"),
                     dcc.Dropdown(id='top-selector', 
                                  options=tops_dropdown_options, 
-                                 placeholder="Select a top to edit")
+                                 placeholder="Select a top to edit"),
+                    # proposes the selected pick in every other well by correlating the curve
+                    html.Button('Propagate Pick', id='propagate-button', className='btn-primary'),
+                    # carries all the tops well to well along the section by DTW alignment of the curve
+                    html.Button('Propagate All Tops', id='propagate-section-button', className='btn-primary')
                 ]
             ),
             dbc.FormGroup(
@@ -280,6 +323,18 @@ controls = dbc.Card(
 
                 ]
             ),
+            dbc.FormGroup(
+                [
+                    # picks stay private to this browser session until they are committed
+                    dbc.Label('Share My Picks'),
+                    dbc.Checklist(id='commit-overwrite',
+                                  options=[{'label': 'Overwrite picks changed by others', 'value': 'overwrite'}],
+                                  value=[]),
+                    html.Button('Commit Picks', id='commit-button', className='btn-primary'),
+                    html.Button('Discard Picks', id='discard-button', className='btn-primary'),
+                    html.Div(id='commit-status'),
+                ]
+            ),
             dbc.FormGroup(
                 [
                     dbc.Label("Write tops to file"),
@@ -298,46 +353,72 @@ controls = dbc.Card(
 
 
          
-app.layout = dbc.Container(
+layout = dbc.Container(
                 children=[
                     html.H1('🌊 SwellCorr well correlation 🌊'),
                     html.Hr(),
                     dbc.Row(
                         [
                             dbc.Col(controls, width=2),
-                            dbc.Col(dcc.Graph(id="well_plot", 
-                                              figure=fig_well_1,
+                            dbc.Col([dcc.Graph(id="well_plot", # figure comes from merge_figure
                             style={'height': 1200}),
+                                     # curve traces and pick lines of the log plot, merged in the browser
+                                     dcc.Store(id='log-traces', data=fig_well_1.to_dict()),
+                                     dcc.Store(id='pick-shapes', data=picks_well_1),
+                                    ],
                                     width=3),
                             dbc.Col([
                                 dash_table.DataTable(
                                         id='table',
                                         columns=[
                                             {"name": i, "id": i, "deletable": False, "selectable": False, "hideable": False}
-                                            for i in surface_picks_df.columns
+                                            for i in pick_store.COLUMNS
                                         ],
-                                        data=surface_picks_df.to_dict('records'),
+                                        data=picks.get_well(p[0].uwi).to_dict('records'),
                                         editable=True,
                                         sort_action='native',
                                         sort_mode='multi',
                                         filter_action='native',
                                         style_table={'overflowY': 'scroll', 'height': '300px', 'width': '90%'},
-                                        style_cell={'width': '{}%'.format(len(surface_picks_df.columns))},
+                                        style_cell={'width': '{}%'.format(len(pick_store.COLUMNS))},
+                                        ),
+
+                                    # statistics of the selected curve between the well's picks
+                                    dbc.Label('Curve by formation'),
+                                    dash_table.DataTable(
+                                        id='formation-stats',
+                                        columns=[{'name': c, 'id': c} for c in FORMATION_STATS_COLUMNS],
+                                        style_table={'overflowY': 'scroll', 'height': '250px', 'width': '90%'},
                                         ),
 
-                                    # hidden_div for storing tops data as json
-                                    html.Div(id='tops-storage', children=surface_picks_df.to_json(), 
+                                    # hidden_div for the pick store version token
+                                    html.Div(id='tops-storage', children=picks.token(), 
                                         style={'display': 'none'}
                                         ),
 
                                     html.Hr(),
                                     # html.H4('Striplog CSV Text:'),
                                     # html.Pre(id='striplog-txt', children='', style={'white-space': 'pre-wrap'}),            
-                                    html.Img(id='cross-section', src=encode_xsection(p, legend),
+                                    dbc.RadioItems(id='xsection-mode', inline=True, value='image',
+                                                   options=[{'label': 'Image', 'value': 'image'},
+                                                            {'label': 'Interactive', 'value': 'interactive'}]),
+                                    html.Img(id='cross-section', src=xsection_url(),
                                              style={'display': 'block',
                                                     'margin-left': 'auto',
                                                     'margin-right': 'auto',
                                                     }),
+                                    # polls the render queue while a newer cross-section is being drawn
+                                    dcc.Interval(id='xsection-poll', interval=500, disabled=True),
+                                    # the interactive section is drawn in the browser (xsection_figure in clientside.js)
+                                    # from the section's curves, sent once, and the picks of the edited wells
+                                    dcc.Graph(id='xsection-graph', style={'display': 'none', 'height': 1000}),
+                                    dcc.Store(id='xsection-curves'),
+                                    dcc.Store(id='xsection-tops'),
+                                    html.Hr(),
+                                    dbc.Label('Draw a section line on the map, wells within (km):'),
+                                    dbc.Input(id='section-width', type='number', value=5, min=0),
+                                    dcc.Graph(id='well-map', figure=helper.well_map(well_index)),
+                                    dcc.Store(id='section-wells'), # UWIs of the section, in order along the line
                                     html.Div(id='placeholder', style={'display': 'none'}),
                                 ], width=7)
                         ]),
@@ -351,34 +432,140 @@ app.layout = dbc.Container(
                     ], 
                 fluid=True
             )
-#write a callback to update the data table from the json in hidden div
+
+
+def serve_layout():
+    """
+    The page, with a new session id for each browser tab. The id is kept in the tab's
+    session storage, so a reload keeps the session's uncommitted picks
+    """
+    return html.Div([dcc.Store(id='session-id', storage_type='session', data=uuid.uuid4().hex),
+                     layout])
+
+
+app.layout = serve_layout
+
+#write a callback to update the data table from the pick store
 @app.callback(
     Output('table', 'data'),
-    [Input('tops-storage', 'children')]
+    [Input('tops-storage', 'children'),
+     Input('well-selector', 'value')],
+    [State('session-id', 'data')]
     )
-def update_data_table(surface_picks):
+def update_data_table(tops_token, active_well, session):
     '''
     TO DO
-    need to find a way to take edits from the data table and write back to json
+    need to find a way to take edits from the data table and write back to the pick store
     so that this can also be a way to edit the tops
     '''
-    surface_picks = pd.read_json(surface_picks).sort_values(['UWI','MD'], ascending = (True, True))
-    return surface_picks.to_dict('records')
+    return session_picks(session).get_well(active_well).to_dict('records')
 
 @app.callback(
-    Output('cross-section', 'src'),
-    [Input('tops-storage', 'children')],
-    [State('well-selector', 'value')])
-def update_cross_section(tops_storage, well_uwi):
+    Output('formation-stats', 'data'),
+    [Input('tops-storage', 'children'),
+     Input('well-selector', 'value'),
+     Input('curve-selector', 'value')],
+    [State('session-id', 'data')]
+    )
+def update_formation_stats(tops_token, active_well, curve, session):
+    """statistics of the selected curve per formation, between the session's picks of the well"""
+    w = p.get_well(active_well)
+    if w is None or curve not in well_curves(w):
+        return []
+    df = session_picks(session).get_well(active_well).dropna(subset=['MD'])
+    stats = curve_stats.formation_stats(w, curve, dict(zip(df['PICK'], df['MD'])))
+    return stats.reindex(columns=FORMATION_STATS_COLUMNS).round(2).to_dict('records')
+
+@app.callback(
+    [Output('cross-section', 'src'),
+     Output('xsection-poll', 'disabled')],
+    [Input('tops-storage', 'children'),
+     Input('section-wells', 'data'),
+     Input('xsection-poll', 'n_intervals'),
+     Input('xsection-mode', 'value')],
+    [State('well-selector', 'value'),
+     State('session-id', 'data')])
+def update_cross_section(tops_token, section_wells, n_intervals, mode, well_uwi, session):
+    """
+    Queue a render of the section after a pick edit and keep showing the last good
+    image. The poll swaps in the new image (served by serve_xsection) once it's drawn.
+    Nothing is rendered while the interactive section is shown
+    """
+    if mode == 'interactive':
+        return no_update, True
+    key = section_key(session, section_wells)
+    renders.submit(key) # no-op if it's up to date or already being drawn
+    image = renders.latest(key)
+    src = xsection_url(section_wells, image[0], session) if image else no_update
+    return src, renders.ready(key)
+
+
+@app.callback(
+    [Output('cross-section', 'style'),
+     Output('xsection-graph', 'style')],
+    [Input('xsection-mode', 'value')],
+    [State('cross-section', 'style'),
+     State('xsection-graph', 'style')])
+def toggle_xsection_view(mode, image_style, graph_style):
+    """show either the image or the interactive cross-section"""
+    interactive = mode == 'interactive'
+    return (dict(image_style or {}, display='none' if interactive else 'block'),
+            dict(graph_style or {}, display='block' if interactive else 'none'))
+
+
+@app.callback(
+    Output('xsection-curves', 'data'),
+    [Input('section-wells', 'data'),
+     Input('xsection-mode', 'value')])
+def update_xsection_curves(section_wells, mode):
+    """
+    The decimated GR of the section wells for the interactive section, sent once per section
     """
-    top_storage_json to striplogs to project. 
-    to return encoded str (image)
+    if mode != 'interactive':
+        return no_update
+    return xsection_data.section_curves(p, section_wells or well_uwi, ymin, ymax, xsec.gr_range)
+
+
+@app.callback(
+    Output('xsection-tops', 'data'),
+    [Input('tops-storage', 'children'),
+     Input('section-wells', 'data'),
+     Input('xsection-mode', 'value')],
+    [State('xsection-tops', 'data'),
+     State('session-id', 'data')])
+def update_xsection_tops(tops_token, section_wells, mode, sent, session):
     """
-    wells_tops = pd.read_json(tops_storage)
-    well_tops = wells_tops[wells_tops.UWI == well_uwi]
-    csv_txt = df_to_csvtxt(well_tops)
-    p.get_well(well_uwi).data['tops'] = Striplog.from_csv(text=csv_txt)
-    return encode_xsection(p, legend)
+    The picks of the section wells that changed since the last ones sent to the browser
+    """
+    if mode != 'interactive':
+        return no_update
+    delta = xsection_data.tops_delta(session_picks(session), section_wells or well_uwi,
+                                     (sent or {}).get('versions'))
+    return no_update if delta is None else delta
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='swellcorr', function_name='xsection_figure'),
+    Output('xsection-graph', 'figure'),
+    [Input('xsection-curves', 'data'),
+     Input('xsection-tops', 'data')],
+    [State('xsection-graph', 'figure')]
+    )
+
+
+@app.callback(
+    [Output('section-wells', 'data'),
+     Output('well-map', 'figure')],
+    [Input('well-map', 'relayoutData')],
+    [State('section-width', 'value')])
+def update_section_wells(relayout, width):
+    """wells near the section line drawn on the map, ordered along it"""
+    line = helper.section_line(relayout)
+    if line is None:
+        return no_update, no_update
+    section = well_index.along_line(*line, width=width or 0)
+    section_wells = list(section['UWI'])
+    return section_wells, helper.well_map(well_index, section_wells, line)
 
 
 @app.callback(
@@ -390,7 +577,7 @@ def well_update_changes_curves(well_uwi):
     def for updating curve list and curves
     """
     w = p.get_well(well_uwi)  # identifies and gets the correct welly.Well object based on well_uwi
-    curve_list = sorted(list(w.data))
+    curve_list = well_curves(w)
     curve = get_first_curve(curve_list)
     curve_dropdown_options = [{'label': k, 'value': k} for k in curve_list]  #creates dropdown list
     return curve_dropdown_options, curve  # returns the dropdown list options and the initial curve
@@ -398,23 +585,32 @@ def well_update_changes_curves(well_uwi):
 
 # update tops data when graph is clicked or new top is added
 @app.callback(
-    Output('tops-storage', 'children'),
+    [Output('tops-storage', 'children'),
+     Output('commit-status', 'children')],
     [Input('well_plot', 'clickData'),
-     Input('new-top-button', 'n_clicks')],
+     Input('new-top-button', 'n_clicks'),
+     Input('propagate-button', 'n_clicks'),
+     Input('propagate-section-button', 'n_clicks'),
+     Input('commit-button', 'n_clicks'),
+     Input('discard-button', 'n_clicks')],
     [State("top-selector", "value"),
-     State("tops-storage", "children"),
      State('new-top-name', 'value'),
      State('well-selector', 'value'),
-     State('top-selector', 'options')])
-def update_pick_storage(clickData, new_top_n_clicks, active_pick, surface_picks, new_top_name, active_well, tops_options):
-    """Update the json stored in tops-storage div based on y-value of click"""
+     State('top-selector', 'options'),
+     State('curve-selector', 'value'),
+     State('commit-overwrite', 'value'),
+     State('session-id', 'data'),
+     State('section-wells', 'data')])
+def update_pick_storage(clickData, new_top_n_clicks, propagate_n_clicks, section_n_clicks, commit_n_clicks,
+                        discard_n_clicks, active_pick, new_top_name, active_well, tops_options, active_curve,
+                        overwrite, session, section_wells):
+    """Update the session's picks based on y-value of click and return the new version token"""
     
     # Each element in the app can only be updated by one call back function.
     # So anytime we want to change the tops-storage it has to be inside of this function.
     # We need to use the dash.callback_context to determine which event triggered
     # the callback and determine which actions to take
     # https://dash.plotly.com/advanced-callbacks    
-    surface_picks_df = pd.read_json(surface_picks)
     
     # get callback context
     ctx = callback_context
@@ -423,52 +619,125 @@ def update_pick_storage(clickData, new_top_n_clicks, active_pick, surface_picks,
     else:
         event_elem_id = ctx.triggered[0]['prop_id'].split('.')[0]
 
+    picks = session_picks(session) # edits go to this session's layer
+
     # do the updating based on context
     if event_elem_id == "well_plot": # click was on the plot
         if active_pick:
             y = clickData['points'][0]['y']
 
-            # update the tops depth df
-            pick = {'UWI': active_well, 'PICK': active_pick, 'MD': y} 
-            surface_picks_df = surface_picks_df.append(pick, ignore_index=True).drop_duplicates(subset=['UWI', 'PICK'], keep='last')
+            # add or move the pick in the store
+            picks.set(active_well, active_pick, y)
     
     if event_elem_id == "new-top-button": # click was on the new top button
         options = [d['value'] for d in tops_options] # tops_options is list of dicts eg [{'label': pick, 'value': pick}]
         if not new_top_name in options:
-            pick = {'UWI': active_well, 'PICK': new_top_name, 'MD': np.nan} 
-            surface_picks_df = surface_picks_df.append(pick, ignore_index=True).drop_duplicates(subset=['UWI', 'PICK'], keep='last')
+            picks.set(active_well, new_top_name, np.nan)
+
+    if event_elem_id == "propagate-button" and active_pick: # auto-pick the top in the other wells
+        curve = active_curve or 'GR'
+        if curve not in well_curves(p.get_well(active_well)):
+            return no_update, 'Could not propagate {}: {} has no {} curve'.format(active_pick, active_well, curve)
+        try:
+            proposals = autocorr.propagate(p, picks, active_well, active_pick, curve=curve)
+        except (KeyError, ValueError) as e:
+            return no_update, 'Could not propagate {}: {}'.format(active_pick, e)
+        return picks.token(), 'Proposed {} in {} wells'.format(active_pick, len(proposals)) # many wells changed
+
+    if event_elem_id == "propagate-section-button": # fill in the missing tops along the section
+        # the tops are carried well to well, so the wells have to be in order along the section line
+        if not section_wells and section_line_file:
+            section_wells = dtw.read_section_line(section_line_file)
+        if not section_wells:
+            return no_update, 'Draw a section line on the map first'
+        proposals, errors = dtw.propagate_section(p, picks, section_wells, curve=active_curve or 'GR')
+        status = 'Proposed {} tops along the section'.format(len(proposals))
+        if errors:
+            status += ', skipped ' + '; '.join('{} ({})'.format(uwi, error) for uwi, error in errors.items())
+        return picks.token(), status
+
+    if event_elem_id == "commit-button" and session: # share the session's picks
+        changed = picks.changed()
+        try:
+            picks.commit(overwrite='overwrite' in (overwrite or []))
+        except pick_store.PickConflict as e:
+            return no_update, 'Not committed, picks changed by someone else in: {}'.format(', '.join(e.uwis))
+        return picks.token(), 'Committed picks of {} wells'.format(len(changed))
+
+    if event_elem_id == "discard-button" and session:
+        picks.discard()
+        return picks.token(), 'Discarded uncommitted picks'
+
+    return picks.token(active_well), no_update
+
+def zoom_window(relayout):
+    """
+    Depth window (top, base) of the log plot after a zoom or pan,
+    None if the plot is autoscaled
+    """
+    relayout = relayout or {}
+    if 'yaxis.range[0]' in relayout:
+        y = relayout['yaxis.range[0]'], relayout['yaxis.range[1]']
+    elif 'yaxis.range' in relayout:
+        y = relayout['yaxis.range']
+    else:
+        return None
+    return min(y), max(y)
 
-    return surface_picks_df.to_json() 
 
-# Update graph when tops storage changes
+# Rebuild the curve traces when the well or curve selection changes, or refine them after a zoom
 @app.callback(
-    Output("well_plot", "figure"),
-    [Input('tops-storage', 'children'),
-     Input('curve-selector', 'value')],
-     [State('well-selector', 'value')] ## With multiple wells the state of the well_uwi must be passed to select the right welly.Well
+    Output('log-traces', 'data'),
+    [Input('curve-selector', 'value'),
+     Input('well-selector', 'value'),
+     Input('well_plot', 'relayoutData')]
     )
-def update_figure(picks, curve, active_well):
-    """redraw the plot when the data in tops-storage is updated"""  
+def update_log_traces(curve, active_well, relayout):
+    """redraw the curves of the plot, decimated to the visible window"""
+    triggers = [t['prop_id'] for t in callback_context.triggered]
+    window = None
+    if triggers == ['well_plot.relayoutData']:
+        window = zoom_window(relayout)
+        if window is None:
+            return no_update # e.g. autosize, nothing to refine
+
     w = p.get_well(active_well) ##selects the correct welly.Well object
-    picks_df = pd.read_json(picks)
-    picks_selected = picks_df[picks_df['UWI'] == active_well.replace(' ', '-')]
-    
-    # regenerate figure with the new horizontal line
-    fig = helper.make_log_plot(w=w, ymin=ymin)# , resample=0.1) # resample needs a float to change basis
-    fig.update_layout(uirevision=active_well)
-    helper.update_picks_on_plot(fig, picks_selected)
-    
-    return fig
+    return helper.cached_log_plot(w=w, log_list=log_list, ymin=ymin, window=window)# , resample=0.1) # resample needs a float to change basis
+
+
+# Update only the pick lines when tops storage changes
+@app.callback(
+    Output('pick-shapes', 'data'),
+    [Input('tops-storage', 'children'),
+     Input('well-selector', 'value')],
+    [State('session-id', 'data')]
+    )
+def update_pick_shapes(tops_token, active_well, session):
+    """new shapes and annotations for the picks of the active well"""
+    changed_uwi = json.loads(tops_token)['uwi']
+    triggers = [t['prop_id'] for t in callback_context.triggered]
+    if triggers == ['tops-storage.children'] and changed_uwi not in (None, active_well):
+        return no_update # picks of another well changed
+    return helper.pick_shapes(session_picks(session).get_well(active_well))
+
+
+# the figure is put together in the browser, so a pick edit doesn't re-send the curves
+app.clientside_callback(
+    ClientsideFunction(namespace='swellcorr', function_name='merge_figure'),
+    Output('well_plot', 'figure'),
+    [Input('log-traces', 'data'),
+     Input('pick-shapes', 'data')]
+    )
 
 
 # update dropdown options when new pick is created
 @app.callback(
     Output("top-selector", "options"),
-    [Input('tops-storage', 'children')])
-def update_dropdown_options(surface_picks):
+    [Input('tops-storage', 'children')],
+    [State('session-id', 'data')])
+def update_dropdown_options(tops_token, session):
     """update the options available in the dropdown when a new top is added"""
-    surface_picks = pd.read_json(surface_picks)
-    tops_dropdown_options = [{'label': k, 'value': k} for k in list(surface_picks['PICK'].unique())]
+    tops_dropdown_options = [{'label': k, 'value': k} for k in session_picks(session).pick_names()]
     return tops_dropdown_options
 
 
@@ -476,19 +745,18 @@ def update_dropdown_options(surface_picks):
 @app.callback(
     Output('placeholder', 'children'),
     [Input('save-button', 'n_clicks')],
-    [State('tops-storage', 'children'),
-    State('input-save-path', 'value')])
-def save_picks(n_clicks, surface_picks, path):
+    [State('input-save-path', 'value'),
+     State('session-id', 'data')])
+def save_picks(n_clicks, path, session):
     """
-    Save out picks to a json file. 
-    TODO: I am sure there are better ways to handle saving out picks, but this is proof of concept
+    Export the session's picks to a json file. The picks themselves are already
+    saved edit by edit in the pick store's journal
     """
-    #picks_df = pd.read_json(surface_picks)
-
     if path:
         path_to_save = Path('.') / 'data' / 'updates' / path
+        path_to_save.parent.mkdir(parents=True, exist_ok=True)
         with open(path_to_save, 'w') as f:
-            json.dump(surface_picks, fp=f)
+            json.dump(session_picks(session).to_df().to_json(), fp=f)
 
     return
 
@@ -0,0 +1,96 @@
+// Clientside callbacks, loaded by Dash from the assets folder.
+
+// base64 little-endian float32 (xsection_data.encode_array) to a Float32Array
+function decodeFloat32(s) {
+    var bytes = atob(s);
+    var buffer = new Uint8Array(bytes.length);
+    for (var i = 0; i < bytes.length; i++) {
+        buffer[i] = bytes.charCodeAt(i);
+    }
+    return new Float32Array(buffer.buffer);
+}
+
+// decoded arrays of each well of the curves store, decoded once per store
+// update: redrawing after a pick edit hands Plotly.react the same arrays,
+// so it sees the traces as unchanged
+var decodedWells = new WeakMap();
+
+function decodeWell(well) {
+    if (!decodedWells.has(well)) {
+        decodedWells.set(well, {depth: decodeFloat32(well.depth), values: decodeFloat32(well.values)});
+    }
+    return decodedWells.get(well);
+}
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    swellcorr: {
+        // Put the pick lines (shapes and annotations) on the log traces
+        // figure. Pick edits only send the small pick-shapes store, the
+        // curve traces already in the browser are reused as they are.
+        merge_figure: function(traces, picks) {
+            if (!traces) {
+                return window.dash_clientside.no_update;
+            }
+            var layout = Object.assign({}, traces.layout, picks || {});
+            return Object.assign({}, traces, {layout: layout});
+        },
+
+        // The interactive cross-section, drawn from the curves store (sent
+        // once per section) and the tops store (the picks of the wells that
+        // changed). The picks sent so far are kept in the figure's
+        // layout.meta, so a pick edit only has to bring the edited well's.
+        xsection_figure: function(curves, tops, figure) {
+            if (!curves) {
+                return window.dash_clientside.no_update;
+            }
+            var known = Object.assign({},
+                (figure && figure.layout && figure.layout.meta && figure.layout.meta.tops) || {},
+                (tops && tops.tops) || {});
+            var n = Math.max(curves.wells.length, 1);
+            var gap = 0.15 / n;
+            var data = [], shapes = [], annotations = [];
+            var layout = {
+                yaxis: {range: [curves.ymax, curves.ymin], title: {text: 'MD'}},
+                showlegend: false,
+                margin: {l: 50, r: 10, t: 60, b: 10},
+                // keeps the zoom through pick edits, a new section starts afresh
+                uirevision: curves.wells.map(function(well) { return well.uwi; }).join(','),
+                meta: {tops: known}
+            };
+            var previous = null;
+            curves.wells.forEach(function(well, i) {
+                var axis = i === 0 ? '' : String(i + 1);
+                var x0 = i / n, x1 = (i + 1) / n - gap;
+                var arrays = decodeWell(well);
+                data.push({type: 'scattergl', mode: 'lines', x: arrays.values, y: arrays.depth,
+                           xaxis: 'x' + axis, yaxis: 'y', name: well.uwi,
+                           line: {color: 'black', width: 1}});
+                layout['xaxis' + axis] = {domain: [x0, x1], range: curves.range, side: 'top',
+                                          showticklabels: false, showgrid: false, zeroline: false,
+                                          title: {text: well.uwi, font: {size: 9}}};
+                var mine = {};
+                (known[well.uwi] || []).forEach(function(pick) {
+                    mine[pick[0]] = pick[1];
+                    shapes.push({type: 'line', xref: 'paper', yref: 'y', x0: x0, x1: x1,
+                                 y0: pick[1], y1: pick[1], line: {color: 'dimgrey', width: 2}});
+                    annotations.push({xref: 'paper', yref: 'y', x: x0, y: pick[1], text: pick[0],
+                                      showarrow: false, xanchor: 'left', yanchor: 'bottom',
+                                      font: {size: 8}});
+                });
+                // dotted lines between the same top in neighbouring wells
+                if (previous) {
+                    Object.keys(mine).forEach(function(name) {
+                        if (name in previous.picks) {
+                            shapes.push({type: 'line', xref: 'paper', yref: 'y',
+                                         x0: previous.x1, x1: x0, y0: previous.picks[name], y1: mine[name],
+                                         line: {color: 'grey', width: 1, dash: 'dot'}});
+                        }
+                    });
+                }
+                previous = {x1: x1, picks: mine};
+            });
+            layout.shapes = shapes;
+            layout.annotations = annotations;
+            return {data: data, layout: layout};
+        }
+    }
+});
@@ -0,0 +1,156 @@
+"""
+Automatic top propagation by cross-correlation of a log curve.
+
+Given a pick in a reference well, a window of the reference curve around
+the pick (the template) is slid along the same curve of every other well,
+over a search range around the depth where the top is expected there.
+All the wells are done in one batch: their search segments are resampled
+onto the template's step, stacked into a 2D array (wells x samples) and
+correlated against the template with FFTs along the depth axis. The best
+lag gives the proposed depth and its normalized correlation the confidence.
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import curve_query
+from pick_store import COLUMNS
+from resample import make_basis, resample_arrays
+
+
+def _fft_size(n):
+    return 1 << (int(n) - 1).bit_length()
+
+
+def _window_sums(a, m):
+    """
+    Sums of every run of m samples along the rows of a.
+    """
+    c = np.cumsum(np.pad(a, ((0, 0), (1, 0))), axis=1)
+    return c[:, m:] - c[:, :-m]
+
+
+def normalized_xcorr(template, segments):
+    """
+    Normalized cross-correlation of template (m samples) with every row of
+    segments (wells x n samples), for each lag 0..n-m. Returns an array of
+    shape (wells, n-m+1) with values in -1..1. Nulls count as the mean,
+    i.e. they add nothing to the correlation.
+    """
+    template = np.asarray(template, dtype=float)
+    segments = np.atleast_2d(np.asarray(segments, dtype=float))
+    m, n = len(template), segments.shape[1]
+
+    t = np.nan_to_num(template - np.nanmean(template))
+    t /= np.linalg.norm(t) or 1.0
+    with np.errstate(invalid='ignore'):
+        means = np.nanmean(segments, axis=1, keepdims=True)
+    x = np.nan_to_num(segments - means)
+
+    # t has zero mean, so sum(t * window) is the same as sum(t * (window - mean))
+    nfft = _fft_size(n)
+    num = np.fft.irfft(np.fft.rfft(x, nfft, axis=1) * np.conj(np.fft.rfft(t, nfft)), nfft, axis=1)
+    num = num[:, :n - m + 1]
+
+    s1, s2 = _window_sums(x, m), _window_sums(x**2, m)
+    norm = np.sqrt(np.maximum(s2 - s1**2 / m, 0))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norm > 1e-9, num / norm, 0.0)
+
+
+def expected_depths(table, ref_uwi, pick, ref_md, uwis):
+    """
+    Depth where pick is expected in each of uwis: ref_md shifted by the
+    median offset of the picks the well shares with the reference well
+    (other than pick itself), or ref_md if they share none.
+
+    table is a tops.TopsTable, e.g. PickStore.table().
+    """
+    # well x pick matrix of depths, straight from the table's codes
+    mds = np.full((len(table.uwis), len(table.names)), np.nan)
+    mds[table.data['uwi'], table.data['pick']] = table.data['md']
+    if pick in table.name_codes:
+        mds[:, table.name_codes[pick]] = np.nan
+    codes = np.array([table.uwi_codes.get(uwi, -1) for uwi in uwis], dtype=int)
+    if ref_uwi not in table.uwi_codes or not len(codes):
+        return np.full(len(uwis), float(ref_md))
+    diff = mds[np.maximum(codes, 0)] - mds[table.uwi_codes[ref_uwi]]
+    diff[codes < 0] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # wells sharing no picks
+        offsets = np.nanmedian(diff, axis=1) if diff.shape[1] else np.full(len(uwis), np.nan)
+    return ref_md + np.nan_to_num(offsets)
+
+
+def propagate(p, store, ref_uwi, pick, curve='GR', window=25.0, search=75.0,
+              step=None, overwrite=False, min_confidence=0.0):
+    """
+    Proposes pick in every other well of Project p by correlating curve
+    around the reference pick, and writes the proposals to the pick store.
+
+    Args:
+        p (Project): the wells.
+        store (PickStore): picks; the reference pick is read from it.
+        ref_uwi (str): UWI of the reference well.
+        pick (str): name of the pick to propagate.
+        curve (str): mnemonic of the curve to correlate.
+        window (float): half-length of the template around the pick.
+        search (float): how far above and below the expected depth to look.
+        step (float): sample step for the correlation, defaults to the
+            step of the reference curve.
+        overwrite (bool): replace picks made by hand too. By default only
+            new picks and earlier proposals are written.
+        min_confidence (float): proposals below this are not written.
+
+    Returns:
+        DataFrame: the proposals (UWI, PICK, MD, CONFIDENCE), all wells.
+    """
+    table = store.table()
+    ref_md = table.md(ref_uwi, pick)
+    if np.isnan(ref_md):
+        raise ValueError('{} has no depth for {}'.format(ref_uwi, pick))
+
+    c = p.get_well(ref_uwi).data[curve]
+    step = float(step or c.step or np.median(np.diff(c.basis)))
+    offsets = make_basis(-window, window, step)
+    depth, values = curve_query.window(p.get_well(ref_uwi), curve, ref_md - window, ref_md + window, margin=1)
+    template = resample_arrays(depth, values, ref_md + offsets) if len(depth) > 1 else offsets * np.nan
+    if np.isnan(template).mean() > 0.5:
+        raise ValueError('{} is mostly null around {} in {}'.format(curve, pick, ref_uwi))
+
+    wells = [w for w in p if w.uwi != ref_uwi and curve in w.data]
+    if not wells:
+        return pd.DataFrame(columns=COLUMNS)
+    uwis = [w.uwi for w in wells]
+    expected = expected_depths(table, ref_uwi, pick, ref_md, uwis)
+
+    # every well's segment on the same relative grid, so they stack into one array;
+    # only the samples around each search range are read
+    grid = make_basis(-search - window, search + window, step)
+    found = curve_query.query(p, uwis, [curve], expected + grid[0], expected + grid[-1], margin=1)
+    segments = np.full((len(wells), len(grid)), np.nan)
+    for i, uwi in enumerate(uwis):
+        depth, values = found[uwi][curve]
+        if len(depth) > 1:
+            segments[i] = resample_arrays(depth, values, expected[i] + grid)
+
+    m = len(template)
+    ncc = normalized_xcorr(template, segments)
+    # down-weight lags where the well's curve is mostly null
+    valid = _window_sums(np.isfinite(segments).astype(float), m) / m
+    score = np.clip(ncc, 0, None) * valid
+    best = np.argmax(score, axis=1)
+    rows = np.arange(len(wells))
+    proposals = pd.DataFrame({'UWI': uwis, 'PICK': pick,
+                              'MD': expected + grid[best] - offsets[0],
+                              'CONFIDENCE': score[rows, best]}, columns=COLUMNS)
+
+    write = proposals['CONFIDENCE'] >= min_confidence
+    if not overwrite:
+        rows = table.with_pick(pick)
+        manual = rows[~np.isnan(rows['md']) & np.isnan(rows['confidence'])]
+        write &= ~proposals['UWI'].isin([table.uwis[i] for i in manual['uwi']])
+    if write.any():
+        store.update_df(proposals[write])
+    return proposals
@@ -0,0 +1,92 @@
+"""
+LAS ingest speed: welly's Well.from_las against the streaming reader.
+
+    python benchmarks/bench_las_reader.py [las_path ...] [--repeat N]
+
+For each directory (default the bundled Poseidon and McMurray wells) it
+times, over every file:
+    welly       Well.from_las, what ingest used to go through
+    read_las    lazy_project.read_las, the whole well with the stream reader
+    data        las_reader.read_data, the data section only
+    GR range    las_reader.read_data of one curve over a third of the depths
+and checks that read_las gives the same curves as welly: same curve names,
+start, step, length and values.
+"""
+import argparse
+import sys
+import time
+import warnings
+from glob import glob
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+from welly import Well
+
+import las_reader
+import lazy_project
+
+
+def timed(func, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - t0) / repeat
+
+
+def same_values(w_fast, w_welly):
+    """
+    True if both wells have the same curves, with the same basis (start,
+    step, length) and values.
+    """
+    if set(w_fast.data) != set(w_welly.data):
+        return False
+    for mnem, curve in w_fast.data.items():
+        other = w_welly.data[mnem]
+        if len(curve) != len(other):
+            return False
+        if not np.isclose(curve.start, other.start) or not np.isclose(curve.step, other.step):
+            return False
+        if not np.allclose(np.asarray(curve), np.asarray(other), equal_nan=True):
+            return False
+    return True
+
+
+def bench(las_path, repeat=1):
+    files = sorted(glob(str(Path(las_path) / '*.LAS')))
+    totals = dict.fromkeys(['welly', 'read_las', 'data', 'GR range'], 0.0)
+    mb, ok = 0.0, True
+    for f in files:
+        mb += Path(f).stat().st_size / 2**20
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            w_welly, t = timed(lambda: Well.from_las(f), repeat)
+        totals['welly'] += t
+        w_fast, t = timed(lambda: lazy_project.read_las(f), repeat)
+        totals['read_las'] += t
+        header = las_reader.read_header(f)
+        data, t = timed(lambda: las_reader.read_data(f, header), repeat)
+        totals['data'] += t
+        depth = data[:, 0]
+        top, base = np.nanpercentile(depth, 33), np.nanpercentile(depth, 66)
+        curve = 'GR' if 'GR' in las_reader.curve_names(header) else las_reader.curve_names(header)[0]
+        _, t = timed(lambda: las_reader.read_data(f, header, curves=[curve], top=top, base=base), repeat)
+        totals['GR range'] += t
+        ok &= same_values(w_fast, w_welly)
+    return len(files), mb, totals, ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('las_paths', nargs='*', default=['data/Poseidon_data/las', 'data/McMurray_data/las'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:<28} {:>6} {:>7} {:>9} {:>9} {:>9} {:>9} {:>8} {:>6}'.format(
+        'directory', 'files', 'MB', 'welly s', 'read_las', 'data s', 'range s', 'speedup', 'same'))
+    for las_path in args.las_paths:
+        n, mb, t, ok = bench(las_path, args.repeat)
+        print('{:<28} {:>6} {:>7.1f} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>7.1f}x {:>6}'.format(
+            las_path, n, mb, t['welly'], t['read_las'], t['data'], t['GR range'],
+            t['welly'] / t['read_las'], str(ok)))
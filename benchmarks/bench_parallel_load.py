@@ -0,0 +1,47 @@
+"""
+Wells/sec of parallel_load.load_project against worker count.
+
+    python benchmarks/bench_parallel_load.py [las_path] [--repeat N]
+
+The well cache is bypassed so every run really parses the LAS files. Use
+--repeat to load the directory several times over in one run, which gives
+the pool enough work on small datasets like the bundled McMurray set.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import parallel_load
+
+
+def bench(las_path, workers, repeat=1):
+    pairs = parallel_load.pair_files(las_path) * repeat
+    jobs = [(lasfile, None, None) for lasfile, _ in pairs]
+    t0 = time.perf_counter()
+    if workers == 1:
+        results = [parallel_load._parse_pair(job) for job in jobs]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(parallel_load._parse_pair, jobs))
+    elapsed = time.perf_counter() - t0
+    errors = sum(error is not None for _, error in results)
+    return len(jobs), errors, elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('las_path', nargs='?', default='data/McMurray_data/las')
+    parser.add_argument('--repeat', type=int, default=4)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    counts = sorted({1, 2, 4, 8, 16, args.max_workers} & set(range(1, args.max_workers + 1)))
+    print('{:>8} {:>8} {:>8} {:>10} {:>8}'.format('workers', 'wells', 'errors', 'seconds', 'wells/s'))
+    for n in counts:
+        wells, errors, elapsed = bench(args.las_path, n, args.repeat)
+        print('{:>8} {:>8} {:>8} {:>10.2f} {:>8.1f}'.format(n, wells, errors, elapsed, wells / elapsed))
@@ -0,0 +1,71 @@
+"""
+Memory used by N worker processes that each read every curve of a project,
+with the curves read into each process or memory mapped from the well cache.
+
+    python benchmarks/bench_shared_curves.py [las_path] [--tops path] [--workers 1 2 4]
+
+Workers are forked from a parent that built the lazy project, like gunicorn
+--preload. Each reports how much its anonymous memory (Linux smaps_rollup,
+i.e. memory not backed by a file) grew while reading the curves. Mapped
+curves are pages of the cache files, held once in the OS page cache, so
+they shouldn't add to it however many workers read them.
+"""
+import argparse
+import multiprocessing
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+
+import lazy_project
+import parallel_load
+
+
+def anonymous_bytes():
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    return fields['Anonymous']
+
+
+def read_all(p, queue):
+    before = anonymous_bytes()
+    total = 0.0
+    for w in p:
+        for name in w.data:
+            if name != 'tops':
+                total += float(np.nansum(w.data[name]))  # touches every page
+    queue.put(anonymous_bytes() - before)
+
+
+def bench(las_path, tops_path, mmap, workers):
+    p = lazy_project.from_las(las_path, tops_path, max_bytes=2**40, mmap=mmap)
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=read_all, args=(p, queue)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    grown = [queue.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return sum(grown)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('las_path', nargs='?', default='data/Poseidon_data/las')
+    parser.add_argument('--tops', default=None)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    parallel_load.warm_cache(args.las_path, args.tops)
+    print('{:>8} {:>18} {:>18}'.format('workers', 'read MB (total)', 'mmap MB (total)'))
+    for n in args.workers:
+        read = bench(args.las_path, args.tops, False, n)
+        mapped = bench(args.las_path, args.tops, True, n)
+        print('{:>8} {:>18.1f} {:>18.1f}'.format(n, read / 2**20, mapped / 2**20))
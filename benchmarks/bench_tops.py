@@ -0,0 +1,106 @@
+"""
+Tops table <-> striplog conversion time against the number of picks.
+
+    python benchmarks/bench_tops.py [--sizes 1000 10000 100000] [--per-well 20] [--legacy-max 10000]
+
+Times tops.striplogs_from_df (tops table to one striplog per well) and
+tops.project_tops_df (striplogs back to a table) with 20 picks per well
+(--per-well; the old CSV text building is quadratic in that number),
+plus the same two steps the old way, through CSV text and
+Striplog.from_csv and a walk over the intervals, up to --legacy-max picks.
+The time per pick should stay flat as the number of picks grows.
+
+It then compares the memory per pick and the time of a one-well lookup of
+a tops.TopsTable with those of the DataFrame (a boolean mask on UWI).
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from striplog import Striplog
+from welly import Project, Well
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import tops
+
+
+def make_table(n, per_well=20, seed=0):
+    rng = np.random.default_rng(seed)
+    wells = np.arange(n) // per_well
+    return pd.DataFrame({'UWI': ['W-{}'.format(i) for i in wells],
+                         'PICK': ['top {}'.format(i) for i in rng.integers(0, 50, n)],
+                         'MD': np.round(rng.uniform(500, 5000, n), 1)})
+
+
+def legacy_csvtxt(df):
+    # the old app.df_to_csvtxt
+    csv_txt = ''
+    csv_txt += csv_txt + 'top, Comp formation\n'
+    for i, row in df.iterrows():
+        csv_txt = csv_txt + str(row['MD']) + ', ' + row['PICK'] + '\n'
+    return csv_txt
+
+
+def legacy_tops_df(project):
+    # the old app.get_tops_df
+    rows = []
+    for well in project:
+        for t in well.data['tops']:
+            rows.append([well.uwi, t.components[0]['formation'], t.top.middle])
+    return pd.DataFrame(rows, columns=['UWI', 'PICK', 'MD'])
+
+
+def as_project(striplogs):
+    wells = []
+    for uwi, striplog in striplogs.items():
+        w = Well({'header': {'uwi': uwi}})
+        w.data['tops'] = striplog
+        wells.append(w)
+    return Project(wells)
+
+
+def timed(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - t0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--per-well', type=int, default=20)
+    parser.add_argument('--legacy-max', type=int, default=10000)
+    args = parser.parse_args()
+
+    print('{:>8} {:>22} {:>22} {:>22} {:>22}'.format(
+        'picks', 'df->striplog us/pick', 'striplog->df us/pick', 'legacy df->strip', 'legacy strip->df'))
+    for n in args.sizes:
+        df = make_table(n, args.per_well)
+        striplogs, t_to = timed(tops.striplogs_from_df, df)
+        project = as_project(striplogs)
+        back, t_from = timed(tops.project_tops_df, project)
+        assert len(back) == n
+
+        legacy = ['-', '-']
+        if n <= args.legacy_max:
+            _, t_legacy_to = timed(lambda: {uwi: Striplog.from_csv(text=legacy_csvtxt(g))
+                                            for uwi, g in df.groupby('UWI', sort=False)})
+            _, t_legacy_from = timed(legacy_tops_df, project)
+            legacy = ['{:.1f}'.format(1e6 * t / n) for t in (t_legacy_to, t_legacy_from)]
+        print('{:>8} {:>22.1f} {:>22.1f} {:>22} {:>22}'.format(n, 1e6 * t_to / n, 1e6 * t_from / n, *legacy))
+
+    print()
+    print('{:>8} {:>16} {:>16} {:>16} {:>16}'.format(
+        'picks', 'df bytes/pick', 'table bytes/pick', 'df mask us', 'table view us'))
+    for n in args.sizes:
+        df = make_table(n, args.per_well)
+        table = tops.TopsTable(df)
+        uwi = df['UWI'].iloc[n // 2]
+        _, t_df = timed(lambda: [df[df['UWI'] == uwi] for _ in range(10)])
+        _, t_table = timed(lambda: [table.well(uwi) for _ in range(10)])
+        print('{:>8} {:>16.0f} {:>16.0f} {:>16.1f} {:>16.1f}'.format(
+            n, df.memory_usage(deep=True).sum() / n, table.nbytes / n, 1e5 * t_df, 1e5 * t_table))
@@ -0,0 +1,70 @@
+"""
+Cross-section render time against the number of panel worker processes.
+
+    python benchmarks/bench_xsection.py [--line path] [--workers 1 2 4] [--repeat N]
+
+Draws the section along a line file (default the McMurray A-A' line) from
+scratch with XSection, i.e. every panel drawn, with the panels drawn in
+this process (1) or across a pool of worker processes. The pool is
+started before timing, as it is in the app after the first section. Also
+checks that every worker count gives the same image as drawing in this
+process.
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+from striplog import Legend
+
+import bulk_tops
+import curve_stats
+import dtw
+import xsection
+
+
+def bench(p, legend, uwis, workers, repeat, ymin, ymax):
+    gr_range = curve_stats.project_range(p, 'GR')
+    xs = xsection.XSection(legend, ymin=ymin, ymax=ymax, gr_range=gr_range, workers=workers).start()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        xs.invalidate()
+        image = xs.image(p, uwis)
+    return image, (time.perf_counter() - t0) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--las', default='data/McMurray_data/las')
+    parser.add_argument('--picks', default='data/McMurray_data/PICKS.TXT')
+    parser.add_argument('--wells', default='data/McMurray_data/WELLS.TXT')
+    parser.add_argument('--line', default='data/McMurray_data/AtoAprime.txt')
+    parser.add_argument('--legend', default='data/Poseidon_data/tops_legend.csv')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count()}))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ymin', type=float, default=150)
+    parser.add_argument('--ymax', type=float, default=550)
+    args = parser.parse_args()
+
+    p, _, _ = bulk_tops.load_project(args.las, args.picks, args.wells)
+    legend = Legend.from_csv(filename=args.legend)
+    uwis = dtw.read_section_line(args.line)
+    missing = [uwi for uwi in uwis if p.get_well(uwi) is None]
+    if missing:
+        sys.exit('{} wells of {} have no LAS file in {}: {}'.format(
+            len(missing), args.line, args.las, ', '.join(missing)))
+
+    print('{} wells on {}, {} CPUs'.format(len(uwis), args.line, os.cpu_count()))
+    print('{:>8} {:>10} {:>10} {:>8} {:>6}'.format('workers', 'seconds', 'panels/s', 'speedup', 'same'))
+    reference, serial = None, None
+    for n in args.workers:
+        image, elapsed = bench(p, legend, uwis, n, args.repeat, args.ymin, args.ymax)
+        if reference is None:
+            reference, serial = image, elapsed
+        same = image.shape == reference.shape and bool(np.all(image == reference))
+        print('{:>8} {:>10.2f} {:>10.1f} {:>7.1f}x {:>6}'.format(
+            n, elapsed, len(uwis) / elapsed, serial / elapsed, str(same)))
@@ -0,0 +1,133 @@
+"""
+Bulk loader for tops databases like the McMurray PICKS.TXT and WELLS.TXT.
+
+PICKS.TXT (UWI, PICKID, PICK, MD, Quality) and WELLS.TXT (UWI, lat, long)
+are tab-delimited tables covering every well. They are read in one pass
+with pandas' C parser, their UWIs are normalized with one vectorized
+regex, and the picks go straight into the pick store (keeping PICKID and
+Quality) and into the wells' striplogs, with no CSV text in between.
+
+UWIs are normalized to the form used in PICKS.TXT, e.g.
+00/13-03-067-05W4/0. The LAS headers also use 00/03-32-080-07W400 (two
+digit event sequence), and the LAS files are named after the UWI with
+dashes, e.g. 00-13-03-067-05W4-0.LAS.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import lazy_project
+import tops
+import well_cache
+
+
+UWI_PATTERN = (r'^\s*(?P<le>\w{2})[/-](?P<lsd>\d{2})-(?P<sec>\d{2})-(?P<twp>\d{3})-(?P<rge>\d{2})'
+               r'W(?P<mer>\d)(?:[/-](?P<es1>\d)|(?P<es2>\d{2}))?\s*$')
+
+
+def normalize_uwis(uwis):
+    """
+    Normalizes a Series of DLS UWIs to LE/LS-SC-TWP-RGWM/ES. Values that
+    don't parse are returned unchanged.
+    """
+    uwis = pd.Series(uwis, dtype=object)
+    # each well has many picks: parse every distinct UWI once
+    codes, unique = pd.factorize(uwis)
+    unique = pd.Series(unique, dtype=object)
+    parts = unique.astype(str).str.extract(UWI_PATTERN)
+    es = parts['es1'].fillna(parts['es2']).fillna('0').str.lstrip('0').replace('', '0')
+    normal = (parts['le'] + '/' + parts['lsd'] + '-' + parts['sec'] + '-' + parts['twp'] + '-'
+              + parts['rge'] + 'W' + parts['mer'] + '/' + es)
+    normal = normal.fillna(unique).to_numpy()
+    return pd.Series(np.where(codes >= 0, normal[codes], uwis), index=uwis.index, dtype=object)
+
+
+def uwi_from_stem(stem):
+    """
+    UWI of a LAS file name, e.g. 00-13-03-067-05W4-0 -> 00/13-03-067-05W4/0.
+    """
+    return normalize_uwis([stem])[0]
+
+
+def read_picks(fname):
+    """
+    Reads a tab-delimited picks table into a DataFrame with the pick store
+    columns UWI, PICK, MD, QUALITY, plus PICKID.
+    """
+    df = pd.read_csv(fname, sep='\t', dtype={'UWI': str, 'PICK': str}, skipinitialspace=True)
+    df = df.rename(columns={'Quality': 'QUALITY'})
+    df['UWI'] = normalize_uwis(df['UWI'])
+    df['MD'] = pd.to_numeric(df['MD'], errors='coerce')
+    df['QUALITY'] = pd.to_numeric(df['QUALITY'], errors='coerce')
+    return df
+
+
+def read_wells(fname):
+    """
+    Reads a tab-delimited well locations table into UWI, LATITUDE, LONGITUDE.
+    """
+    df = pd.read_csv(fname, sep='\t', dtype={'UWI': str})
+    df = df.rename(columns={'lat': 'LATITUDE', 'long': 'LONGITUDE'})
+    df['UWI'] = normalize_uwis(df['UWI'])
+    return df.drop_duplicates('UWI')
+
+
+def pick_ids(picks):
+    """
+    {pick: PICKID} from a picks table, empty if it has no PICKID column.
+    """
+    if 'PICKID' not in picks:
+        return {}
+    ids = picks.dropna(subset=['PICKID']).drop_duplicates('PICK')
+    return dict(zip(ids['PICK'], ids['PICKID'].astype(np.int64)))
+
+
+def attach_tops(p, picks, field='formation'):
+    """
+    Replaces the tops striplog of every well of p that has picks.
+    """
+    wells = {w.uwi: w for w in p}  # Project.get_well is a linear search
+    for uwi, striplog in tops.striplogs_from_df(picks, field).items():
+        if uwi in wells:
+            wells[uwi].data['tops'] = striplog
+
+
+def attach_locations(p, wells):
+    """
+    Sets the latitude and longitude of every well of p in the wells table.
+    """
+    locations = wells.set_index('UWI')
+    for w in p:
+        if w.uwi in locations.index:
+            w.location.latitude = float(locations.at[w.uwi, 'LATITUDE'])
+            w.location.longitude = float(locations.at[w.uwi, 'LONGITUDE'])
+
+
+def load_project(las_path, picks_file, wells_file=None, store=None,
+                 max_bytes=lazy_project.DEFAULT_MAX_BYTES, cache_dir=well_cache.CACHE_DIR, mmap=False):
+    """
+    Returns a lazy Project of the LAS files in las_path, with the wells
+    named by their normalized UWI and tops and locations from the tables.
+    If a pick store is given the picks are added to it too.
+
+    Returns:
+        (Project, picks DataFrame, list of UWIs in the tables with no LAS file)
+    """
+    p = lazy_project.from_las(las_path, max_bytes=max_bytes, cache_dir=cache_dir, mmap=mmap)
+    for w in p:
+        w.header['uwi'] = uwi_from_stem(Path(w.fname).stem)
+
+    picks = read_picks(picks_file)
+    attach_tops(p, picks)
+    uwis = set(picks['UWI'])
+    if wells_file is not None:
+        wells = read_wells(wells_file)
+        attach_locations(p, wells)
+        uwis |= set(wells['UWI'])
+    missing = sorted(uwis - {w.uwi for w in p})
+
+    if store is not None:
+        store.update_df(picks)
+        store.set_pick_ids(pick_ids(picks))
+    return p, picks, missing
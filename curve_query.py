@@ -0,0 +1,141 @@
+"""
+Depth-range queries over curves.
+
+Plots used to take a whole curve (and welly builds its whole basis array on
+every .basis access) and then clip it with set_ylim. Here each curve gets a
+DepthIndex, built once and cached: for a regularly sampled curve it is just
+start, step and length, and the samples in a depth interval are found with
+arithmetic; for irregular depths it is the depth array, searched with a
+binary search. A query returns views of the samples in the interval, so a
+view only touches the data it displays. query() does many wells and curves
+at once, working out the bounds once for all the curves of a well that
+share a basis.
+"""
+import numpy as np
+
+from decimate import curve_key
+from lru import LRUCache
+
+
+class DepthIndex:
+    """
+    Index of the depths of a curve, increasing.
+
+    Args:
+        depth (ndarray): the depths, for irregular sampling.
+        start, step, n: a regular basis instead (step > 0).
+    """
+    def __init__(self, depth=None, start=None, step=None, n=None):
+        self.depth = None if depth is None else np.asarray(depth, dtype=float)
+        self.start, self.step, self.n = start, step, n
+        if self.depth is not None:
+            self.n = len(self.depth)
+
+    @classmethod
+    def of_curve(cls, curve):
+        """
+        Index of a welly Curve, without building its basis if it's regular.
+        """
+        step = float(curve.step) if curve.step else 0.0
+        if step > 0:
+            return cls(start=float(curve.start), step=step, n=len(curve))
+        return cls(depth=curve.basis)
+
+    @property
+    def regular(self):
+        return self.depth is None
+
+    @property
+    def nbytes(self):
+        return 0 if self.regular else self.depth.nbytes
+
+    @property
+    def top(self):
+        return self.start if self.regular else self.depth[0]
+
+    @property
+    def base(self):
+        return self.start + self.step * (self.n - 1) if self.regular else self.depth[-1]
+
+    def bounds(self, top=None, base=None, margin=0):
+        """
+        (i0, i1) such that samples i0:i1 are those with top <= depth <= base,
+        plus margin samples either side (e.g. so a line reaches the edge).
+        """
+        if self.regular:
+            i0 = 0 if top is None else int(np.ceil((top - self.start) / self.step - 1e-9))
+            i1 = self.n if base is None else int(np.floor((base - self.start) / self.step + 1e-9)) + 1
+        else:
+            i0 = 0 if top is None else int(np.searchsorted(self.depth, top, side='left'))
+            i1 = self.n if base is None else int(np.searchsorted(self.depth, base, side='right'))
+        i0, i1 = max(i0 - margin, 0), min(i1 + margin, self.n)
+        return i0, max(i1, i0)
+
+    def depths(self, i0, i1):
+        """
+        Depths of samples i0:i1.
+        """
+        if self.regular:
+            return self.start + self.step * np.arange(i0, i1)
+        return self.depth[i0:i1]
+
+
+# depth indexes of recently queried curves, 16 MB (regular curves take no room)
+indexes = LRUCache(16 * 2**20, sizeof=lambda index: max(index.nbytes, 64))
+
+
+def curve_index(w, mnemonic):
+    """
+    The cached DepthIndex of a well's curve.
+    """
+    c = w.data[mnemonic]
+    return indexes.get_or_compute(curve_key(w, mnemonic, c), lambda: DepthIndex.of_curve(c))
+
+
+def window(w, mnemonic, top=None, base=None, margin=0):
+    """
+    (depth, values) of a well's curve between top and base. The values are
+    a view of the curve, not a copy.
+    """
+    index = curve_index(w, mnemonic)
+    i0, i1 = index.bounds(top, base, margin)
+    return index.depths(i0, i1), np.asarray(w.data[mnemonic])[i0:i1]
+
+
+def query(p, uwis, mnemonics, top=None, base=None, margin=0):
+    """
+    Batched window() over many wells and curves.
+
+    Args:
+        p (Project): the wells.
+        uwis (list): wells to query.
+        mnemonics (list): curves to query; wells without one are skipped.
+        top, base (float or array): depth interval, either the same for
+            every well or one value per well of uwis.
+
+    Returns:
+        {uwi: {mnemonic: (depth, values)}}
+    """
+    wells = {w.uwi: w for w in p}  # Project.get_well is a linear search
+    tops = np.broadcast_to(np.array(np.nan if top is None else top, dtype=float), (len(uwis),))
+    bases = np.broadcast_to(np.array(np.nan if base is None else base, dtype=float), (len(uwis),))
+    result = {}
+    for uwi, t, b in zip(uwis, tops, bases):
+        w = wells.get(uwi)
+        if w is None:
+            continue
+        t, b = (None if np.isnan(t) else t), (None if np.isnan(b) else b)
+        found, shared = {}, {}
+        for mnemonic in mnemonics:
+            if mnemonic not in w.data:
+                continue
+            index = curve_index(w, mnemonic)
+            # curves on the same basis share the bounds and depths
+            basis = (index.start, index.step, index.n) if index.regular else id(index)
+            if basis not in shared:
+                i0, i1 = index.bounds(t, b, margin)
+                shared[basis] = (i0, i1, index.depths(i0, i1))
+            i0, i1, depth = shared[basis]
+            found[mnemonic] = (depth, np.asarray(w.data[mnemonic])[i0:i1])
+        result[uwi] = found
+    return result
@@ -0,0 +1,191 @@
+"""
+Per-curve statistics, computed once when a well is ingested.
+
+Plot ranges and normalization used to be hard-coded (GR / 120, x ranges of
+0-150) or recomputed over the whole curve every time. Here every curve
+gets a small dict of statistics when the well is written to the well cache
+(well_cache.save_well), stored in its meta.json next to the curve params:
+count, nulls and null fraction, min, max, mean, std, percentiles, a
+histogram, and the same statistics per formation, between the tops the
+well was loaded with. Lazy wells pick them up from meta.json, so reading
+them is a dict lookup. Curves that weren't ingested that way (cache from
+before this, resampled copies, other picks) are computed on first use and
+kept in an LRU cache.
+"""
+import numpy as np
+import pandas as pd
+
+from curve_query import DepthIndex
+from decimate import curve_key
+from lru import LRUCache
+from tops import tops_to_arrays
+
+
+PERCENTILES = [1, 5, 10, 25, 50, 75, 90, 95, 99]
+HIST_BINS = 64
+FORMATION_PERCENTILES = [10, 50, 90]
+
+
+def compute(values, percentiles=PERCENTILES, bins=HIST_BINS):
+    """
+    Statistics of a curve's values as a JSON-able dict. Percentile q is
+    stats['p<q>']; the histogram has bins equal bins from min to max.
+    """
+    values = np.asarray(values, dtype=float)
+    ok = values[np.isfinite(values)]
+    stats = {'count': int(len(ok)),
+             'nulls': int(len(values) - len(ok)),
+             'null_fraction': float(1 - len(ok) / len(values)) if len(values) else 1.0}
+    if not len(ok):
+        stats.update({k: None for k in ['min', 'max', 'mean', 'std']})
+        stats.update({'p{}'.format(q): None for q in percentiles})
+        stats['hist'] = None
+        return stats
+    lo, hi = ok.min(), ok.max()
+    stats.update(min=float(lo), max=float(hi), mean=float(ok.mean()), std=float(ok.std()))
+    stats.update(zip(['p{}'.format(q) for q in percentiles], np.percentile(ok, percentiles).tolist()))
+    counts, _ = np.histogram(ok, bins=bins, range=(lo, hi if hi > lo else lo + 1))
+    stats['hist'] = {'lo': float(lo), 'hi': float(hi), 'counts': counts.tolist()}
+    return stats
+
+
+def compute_formations(index, values, picks):
+    """
+    Statistics of a curve between consecutive tops.
+
+    Args:
+        index (DepthIndex): depths of the curve.
+        values (ndarray): the curve.
+        picks (dict): {name: md}.
+
+    Returns:
+        list of dicts (formation, top, base, count, null_fraction, min,
+        max, mean and percentiles), shallowest first. The last formation
+        goes down to the base of the curve.
+    """
+    picks = sorted((md, name) for name, md in picks.items() if md is not None and np.isfinite(md))
+    values = np.asarray(values)
+    rows = []
+    for k, (top, name) in enumerate(picks):
+        base = picks[k + 1][0] if k + 1 < len(picks) else index.base
+        i0, i1 = index.bounds(top, base)
+        if k + 1 < len(picks) and i1 > i0 and index.depths(i1 - 1, i1)[0] >= base:
+            i1 -= 1  # the sample at the next top belongs to the next formation
+        window = np.asarray(values[i0:i1], dtype=float)
+        ok = window[np.isfinite(window)]
+        row = {'formation': name, 'top': float(top), 'base': float(base), 'count': int(len(ok)),
+               'null_fraction': float(1 - len(ok) / len(window)) if len(window) else 1.0}
+        if len(ok):
+            row.update(min=float(ok.min()), max=float(ok.max()), mean=float(ok.mean()))
+            row.update(zip(['p{}'.format(q) for q in FORMATION_PERCENTILES],
+                           np.percentile(ok, FORMATION_PERCENTILES).tolist()))
+        rows.append(row)
+    return rows
+
+
+def payload_stats(payload):
+    """
+    Statistics of every curve of a well_cache payload, with the formations
+    between the payload's tops. This is what goes into meta.json.
+    """
+    picks = {}
+    if payload['tops'] is not None:
+        picks = dict(zip(payload['tops']['names'], payload['tops']['depths']))
+    stats = {}
+    for mnemonic, (values, params) in payload['curves'].items():
+        stats[mnemonic] = compute(values)
+        step = params.get('step')
+        if picks and step:
+            index = DepthIndex(start=float(params['start']), step=float(step), n=len(values))
+            stats[mnemonic]['formations'] = compute_formations(index, values, picks)
+    return stats
+
+
+# statistics of curves that weren't ingested with them, 4 MB
+computed = LRUCache(4 * 2**20, sizeof=lambda stats: 1024)
+formations = LRUCache(4 * 2**20, sizeof=lambda rows: 256 * (len(rows) + 1))
+
+
+def _ingested(w, mnemonic):
+    return (getattr(w.data, 'stats', None) or {}).get(mnemonic)
+
+
+def get(w, mnemonic):
+    """
+    Statistics of a well's curve (see compute), from ingest if the well
+    has them, else computed once and cached.
+    """
+    stats = _ingested(w, mnemonic)
+    if stats is not None:
+        return stats
+    return computed.get_or_compute(curve_key(w, mnemonic), lambda: compute(w.data[mnemonic]))
+
+
+def formation_stats(w, mnemonic, picks=None):
+    """
+    Statistics of a well's curve per formation, as a DataFrame.
+
+    Args:
+        picks (dict): {name: md} tops to split the curve at, e.g.
+            TopsTable.well_picks(uwi). Default the tops the well was
+            ingested with.
+    """
+    ingested = (_ingested(w, mnemonic) or {}).get('formations')
+    if ingested is not None and (picks is None or picks == {r['formation']: r['top'] for r in ingested}):
+        return pd.DataFrame(ingested)
+    if picks is None:
+        if w.data.get('tops') is None:
+            return pd.DataFrame()
+        depths, names = tops_to_arrays(w.data['tops'])
+        picks = dict(zip(names, depths.tolist()))
+    key = curve_key(w, mnemonic) + (tuple(sorted(picks.items())),)
+    rows = formations.get_or_compute(key, lambda: compute_formations(
+        DepthIndex.of_curve(w.data[mnemonic]), w.data[mnemonic], picks))
+    return pd.DataFrame(rows)
+
+
+def nice_range(lo, hi):
+    """
+    lo..hi widened to round numbers, e.g. (12.3, 141.7) -> (0, 150).
+    """
+    if lo is None or hi is None:
+        return None
+    span = hi - lo
+    if span <= 0:
+        return (lo - 1, hi + 1) if span == 0 else None
+    step = 10 ** np.floor(np.log10(span)) / 2
+    return float(np.floor(lo / step) * step), float(np.ceil(hi / step) * step)
+
+
+def display_range(w, mnemonic, lo=1, hi=99):
+    """
+    Plot range of a well's curve: its lo and hi percentiles, rounded out.
+    """
+    stats = get(w, mnemonic)
+    return nice_range(stats['p{}'.format(lo)], stats['p{}'.format(hi)])
+
+
+def project_range(p, mnemonic, lo=1, hi=99):
+    """
+    Common plot range of a curve over every well of p that has it, so a
+    section shows all the wells on the same scale: the median of the
+    wells' lo and hi percentiles, rounded out.
+    """
+    lows, highs = [], []
+    for w in p:
+        if mnemonic in w.data:
+            stats = get(w, mnemonic)
+            if stats['count']:
+                lows.append(stats['p{}'.format(lo)])
+                highs.append(stats['p{}'.format(hi)])
+    if not lows:
+        return None
+    return nice_range(float(np.median(lows)), float(np.median(highs)))
+
+
+def quartiles(w, mnemonic):
+    """
+    (p25, p50, p75) of a well's curve, e.g. for a robust z-score.
+    """
+    stats = get(w, mnemonic)
+    return stats['p25'], stats['p50'], stats['p75']
@@ -0,0 +1,121 @@
+"""
+Level-of-detail decimation of log curves for plotting.
+
+A log track is only ~1000 pixels tall, but a half-foot sampled curve has
+tens of thousands of samples. For each curve a min/max pyramid is built
+once: level L keeps, for every run of 2**L samples, the minimum and the
+maximum sample (and their depths). Plotting a depth window picks the
+coarsest level that still has about one bin per pixel, so peaks are never
+dropped and the number of points sent to the browser is bounded by the
+plot height, not by the sampling of the well.
+"""
+import numpy as np
+
+from lru import LRUCache
+
+
+class Pyramid:
+    """
+    Min/max pyramid of one curve.
+
+    Args:
+        depth (ndarray): the curve basis, increasing.
+        values (ndarray): curve values, NaN for nulls.
+    """
+    def __init__(self, depth, values):
+        depth = np.asarray(depth, dtype=float)
+        values = np.asarray(values, dtype=float)
+        # level 0 is the curve itself: min and max are the sample
+        self.levels = [(depth, depth, values, depth, values)]
+        while len(self.levels[-1][0]) > 2:
+            self.levels.append(self._coarsen(*self.levels[-1]))
+
+    @staticmethod
+    def _coarsen(start, dmin, vmin, dmax, vmax):
+        """
+        Merges neighbouring bins in pairs. Returns (bin start depth,
+        depth of min, min, depth of max, max).
+        """
+        n = len(start) // 2 * 2
+        odd = len(start) % 2
+
+        def merge(d, v, better):
+            d0, d1 = d[0:n:2], d[1:n:2]
+            v0, v1 = v[0:n:2], v[1:n:2]
+            # take the second of the pair where it's better or the first is null
+            take1 = better(v1, v0) | np.isnan(v0)
+            d_, v_ = np.where(take1, d1, d0), np.where(take1, v1, v0)
+            if odd:
+                d_, v_ = np.append(d_, d[-1]), np.append(v_, v[-1])
+            return d_, v_
+
+        dmin_, vmin_ = merge(dmin, vmin, np.less)
+        dmax_, vmax_ = merge(dmax, vmax, np.greater)
+        start_ = start[0:len(start):2]
+        return start_, dmin_, vmin_, dmax_, vmax_
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for level in self.levels[1:] for a in level) + 2 * self.levels[0][0].nbytes
+
+    def query(self, top=None, base=None, pixels=1000):
+        """
+        Returns (depth, values) for the window top..base with at most
+        about 2 * pixels points, in depth order.
+        """
+        depth = self.levels[0][0]
+        top = depth[0] if top is None else top
+        base = depth[-1] if base is None else base
+        i0, i1 = np.searchsorted(depth, [top, base])
+        n = max(i1 - i0, 1)
+
+        if n <= 2 * pixels:  # few enough samples: send them all
+            i0, i1 = max(i0 - 1, 0), min(i1 + 1, len(depth))
+            return depth[i0:i1], self.levels[0][2][i0:i1]
+
+        level = min(int(np.ceil(np.log2(n / pixels))), len(self.levels) - 1)
+        start, dmin, vmin, dmax, vmax = self.levels[level]
+        j0 = max((i0 >> level) - 1, 0)
+        j1 = min((i1 >> level) + 2, len(start))
+        dmin, vmin, dmax, vmax = dmin[j0:j1], vmin[j0:j1], dmax[j0:j1], vmax[j0:j1]
+
+        # two points per bin, min and max, in depth order
+        min_first = dmin <= dmax
+        d = np.empty(2 * len(dmin))
+        v = np.empty(2 * len(dmin))
+        d[0::2] = np.where(min_first, dmin, dmax)
+        d[1::2] = np.where(min_first, dmax, dmin)
+        v[0::2] = np.where(min_first, vmin, vmax)
+        v[1::2] = np.where(min_first, vmax, vmin)
+        return d, v
+
+
+def minmax_decimate(depth, values, pixels=1000):
+    """
+    One-off min/max decimation of a curve to about 2 * pixels points.
+    """
+    return Pyramid(depth, values).query(pixels=pixels)
+
+
+# pyramids of recently plotted curves, 64 MB
+pyramids = LRUCache(64 * 2**20)
+
+
+def curve_key(w, mnemonic, curve=None):
+    """
+    Cache key of a curve: changes if the curve is replaced, e.g. resampled.
+    """
+    c = w.data[mnemonic] if curve is None else curve
+    return (w.uwi, mnemonic, float(c.start), float(c.step), len(c))
+
+
+def curve_window(w, mnemonic, top=None, base=None, pixels=1000, curve=None):
+    """
+    Returns decimated (depth, values) of a well's curve for a depth window,
+    using the cached pyramid of the curve. Pass curve to plot a copy of
+    the well's curve instead, e.g. a resampled one.
+    """
+    c = w.data[mnemonic] if curve is None else curve
+    pyramid = pyramids.get_or_compute(curve_key(w, mnemonic, c),
+                                      lambda: Pyramid(c.basis, np.asarray(c)))
+    return pyramid.query(top, base, pixels)
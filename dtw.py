@@ -0,0 +1,358 @@
+"""
+Whole-well alignment by dynamic time warping (DTW).
+
+Two logs, resampled onto the same step, are aligned with a DTW constrained
+to a Sakoe-Chiba band around the diagonal and forced through the tops the
+two wells share (anchors). Only the band of the cost matrix is kept, an
+(n, 2 * band + 1) array instead of n x m, and each row of it is computed
+with vectorized NumPy (the in-row recurrence is a cumulative minimum), so
+10k-sample logs align in about a second.
+
+Along a section line each neighbouring pair of wells is aligned
+independently, across a process pool, and the alignments are cached by
+the pick versions of the two wells, so a pick edit only re-aligns the
+pairs the edited well is in. The alignments then carry every top from one
+well to the next along the line. A well that can't be aligned (no curve,
+no data) is reported and skipped, the tops start again from the next one.
+"""
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+import bulk_tops
+import curve_stats
+from lru import LRUCache
+from pick_store import COLUMNS
+from resample import make_basis, resample_arrays
+
+
+def standardize(values, quartiles=None):
+    """
+    Robust z-score (median and IQR), nulls set to 0 so they cost nothing.
+    quartiles (p25, p50, p75) of the whole curve, e.g. from curve_stats,
+    save working them out again.
+    """
+    values = np.asarray(values, dtype=float)
+    if np.isnan(values).all():
+        return np.zeros_like(values)
+    if quartiles is None or None in quartiles:
+        quartiles = np.nanpercentile(values, [25, 50, 75])
+    q1, median, q3 = quartiles
+    return np.nan_to_num((values - median) / ((q3 - q1) or 1.0))
+
+
+def _banded_dtw(a, b, band):
+    """
+    DTW of a (n samples) against b (m samples) within band samples of the
+    straight line from (0, 0) to (n-1, m-1). Returns the path as two index
+    arrays (i, j), from the start to the end of both logs.
+    """
+    n, m = len(a), len(b)
+    if n == 1 or m == 1:
+        steps = np.arange(max(n, m))
+        return np.minimum(steps, n - 1), np.minimum(steps, m - 1)
+    # the band has to be wider than the slope of the line to stay connected
+    band = max(int(band), int(np.ceil(max(m / n, n / m))) + 1)
+    width = 2 * band + 1
+    lo = np.rint(np.arange(n) * (m - 1) / (n - 1)).astype(int) - band  # first column of each row
+    k = np.arange(width)
+
+    D = np.full((n, width), np.inf)
+    for i in range(n):
+        j = lo[i] + k
+        inside = (j >= 0) & (j < m)
+        cost = np.where(inside, (a[i] - b[np.clip(j, 0, m - 1)])**2, np.inf)
+        if i == 0:
+            diag_up = np.where(j == 0, 0.0, np.inf)
+        else:
+            s = lo[i] - lo[i - 1]
+            prev = np.concatenate([[np.inf], D[i - 1], np.full(s + 1, np.inf)])
+            # prev[k + s + 1] is D[i-1, j], prev[k + s] is D[i-1, j-1]
+            diag_up = np.minimum(prev[k + s + 1], prev[k + s])
+        # D[i, j] = cost[j] + min(D[i-1, j-1], D[i-1, j], D[i, j-1]): the
+        # left-to-right term is a running minimum over the row's cumulative cost
+        E = cost + diag_up
+        S = np.cumsum(np.where(inside, cost, 0.0))
+        D[i] = np.where(inside, S + np.minimum.accumulate(E - S), np.inf)
+
+    # backtrack from the last sample of both logs
+    path = [(n - 1, m - 1)]
+    i, j = n - 1, m - 1
+    while i > 0 or j > 0:
+        steps = [(i - 1, j - 1), (i - 1, j), (i, j - 1)]
+        best = min(steps, key=lambda ij: _banded(D, lo, ij))
+        i, j = best
+        path.append(best)
+    path = np.array(path[::-1])
+    return path[:, 0], path[:, 1]
+
+
+def _banded(D, lo, ij):
+    i, j = ij
+    if i < 0 or j < 0:
+        return np.inf
+    k = j - lo[i]
+    return D[i, k] if 0 <= k < D.shape[1] else np.inf
+
+
+def dtw_path(a, b, band=100, anchors=None, quartiles=(None, None)):
+    """
+    Aligns log a to log b (same step). Returns the path as index arrays
+    (i, j), where a[i] is matched with b[j].
+
+    Args:
+        band (int): Sakoe-Chiba half-width, in samples.
+        anchors (list): (i, j) index pairs the path must go through, e.g.
+            shared tops; pairs that cross earlier ones are ignored.
+        quartiles: (p25, p50, p75) of a and of b for standardize, or None.
+    """
+    a, b = standardize(a, quartiles[0]), standardize(b, quartiles[1])
+    n, m = len(a), len(b)
+    points = [(0, 0)]
+    for i, j in sorted(anchors or []):
+        if points[-1][0] < i < n - 1 and points[-1][1] < j < m - 1:
+            points.append((int(i), int(j)))
+    points.append((n - 1, m - 1))
+
+    # a DTW between each pair of anchors, joined at the anchors
+    paths_i, paths_j = [], []
+    for (i0, j0), (i1, j1) in zip(points[:-1], points[1:]):
+        pi, pj = _banded_dtw(a[i0:i1 + 1], b[j0:j1 + 1], band)
+        skip = 1 if paths_i else 0  # the anchor ends the previous segment
+        paths_i.append(pi[skip:] + i0)
+        paths_j.append(pj[skip:] + j0)
+    return np.concatenate(paths_i), np.concatenate(paths_j)
+
+
+def path_similarity(a, b, path):
+    """
+    Correlation of the aligned samples of a and b, clipped to 0..1.
+    """
+    x, y = np.asarray(a, dtype=float)[path[0]], np.asarray(b, dtype=float)[path[1]]
+    ok = np.isfinite(x) & np.isfinite(y)
+    if ok.sum() < 3 or np.std(x[ok]) == 0 or np.std(y[ok]) == 0:
+        return 0.0
+    return float(np.clip(np.corrcoef(x[ok], y[ok])[0, 1], 0, 1))
+
+
+class Alignment:
+    """
+    DTW alignment of two wells: maps depths in well a to depths in well b.
+
+    Args:
+        depth_a, depth_b (ndarray): the regular bases the logs were aligned on.
+        path (tuple): index arrays (i, j) from dtw_path.
+        similarity (float): path_similarity of the aligned logs.
+    """
+    def __init__(self, depth_a, depth_b, path, similarity):
+        i, j = path
+        # mean matched index for every sample of a (the path covers all of them)
+        counts = np.bincount(i, minlength=len(depth_a))
+        self.j_of_i = np.bincount(i, weights=j, minlength=len(depth_a)) / np.maximum(counts, 1)
+        self.depth_a, self.depth_b = depth_a, depth_b
+        self.path = (i.astype(np.int32), j.astype(np.int32))
+        self.similarity = similarity
+
+    @property
+    def nbytes(self):
+        return self.j_of_i.nbytes + self.depth_a.nbytes + self.depth_b.nbytes + 2 * self.path[0].nbytes
+
+    def map_depths(self, md):
+        """
+        Depths in well b matching depths md in well a (NaN outside well a).
+        """
+        md = np.asarray(md, dtype=float)
+        i = (md - self.depth_a[0]) / (self.depth_a[1] - self.depth_a[0])
+        j = np.interp(i, np.arange(len(self.j_of_i)), self.j_of_i, left=np.nan, right=np.nan)
+        return self.depth_b[0] + j * (self.depth_b[1] - self.depth_b[0])
+
+
+def align_arrays(depth_a, values_a, depth_b, values_b, step, band=100, anchors=(),
+                 quartiles=(None, None)):
+    """
+    Worker: aligns two logs given as arrays. anchors are (md_a, md_b) depth
+    pairs, quartiles the curves' statistics (see dtw_path). Returns an
+    Alignment.
+    """
+    grid_a = make_basis(depth_a[0], depth_a[-1], step)
+    grid_b = make_basis(depth_b[0], depth_b[-1], step)
+    a = resample_arrays(depth_a, values_a, grid_a)
+    b = resample_arrays(depth_b, values_b, grid_b)
+    idx = [(int(round((md_a - grid_a[0]) / step)), int(round((md_b - grid_b[0]) / step)))
+           for md_a, md_b in anchors]
+    path = dtw_path(a, b, band=int(round(band / step)), anchors=idx, quartiles=quartiles)
+    return Alignment(grid_a, grid_b, path, path_similarity(a, b, path))
+
+
+def _align_job(args):
+    try:
+        return align_arrays(*args), None
+    except Exception as e:
+        return None, '{}: {}\n{}'.format(type(e).__name__, e, traceback.format_exc())
+
+
+# one pool per process, started on the first section with pairs to align:
+# a process forked after that (e.g. a gunicorn worker) starts its own
+_pool, _pool_key = None, None
+_pool_lock = Lock()
+
+
+def _align_jobs(jobs, workers):
+    """
+    (Alignment, None) or (None, error message) of each job, in order.
+    """
+    global _pool, _pool_key
+    if workers == 1 or len(jobs) < 2:
+        return [_align_job(job) for job in jobs]
+    with _pool_lock:
+        if _pool is None or _pool_key != (os.getpid(), workers):
+            if _pool is not None and _pool_key[0] == os.getpid():
+                _pool.shutdown(wait=False)
+            _pool, _pool_key = ProcessPoolExecutor(max_workers=workers), (os.getpid(), workers)
+        pool = _pool
+    try:
+        return list(pool.map(_align_job, jobs))
+    except BrokenProcessPool:
+        # a worker died: start a new pool next time, align these here
+        with _pool_lock:
+            _pool = None
+        return [_align_job(job) for job in jobs]
+
+
+def shared_tops(table, uwi_a, uwi_b):
+    """
+    (md_a, md_b) of the picks both wells have, in depth order, from a
+    tops.TopsTable.
+    """
+    a, b = table.well_picks(uwi_a), table.well_picks(uwi_b)
+    return sorted((a[pick], b[pick]) for pick in a.keys() & b.keys())
+
+
+# alignments of neighbouring wells, keyed by the pick versions of both wells
+alignments = LRUCache(128 * 2**20)
+
+
+def align_section(p, store, uwis, curve='GR', step=0.5, band=50.0, workers=None):
+    """
+    Aligns each pair of neighbouring wells along a section line.
+
+    Args:
+        p (Project): the wells.
+        store (PickStore): picks, used as anchors.
+        uwis (list): the wells in section order; wells not in p or
+            without the curve are skipped.
+        step (float): sample step the logs are aligned on.
+        band (float): Sakoe-Chiba half-width, in depth units.
+        workers (int): processes for the pairs that aren't cached,
+            default os.cpu_count(); 1 aligns in this process.
+
+    Returns:
+        (section, errors): section is a list of (uwi_a, uwi_b, Alignment),
+        one per neighbouring pair, with None for the pairs that couldn't be
+        aligned. errors is {uwi: message} of the wells skipped, and of the
+        second well of each pair that couldn't be aligned.
+    """
+    wells, errors = [], {}
+    for uwi in uwis:
+        w = p.get_well(uwi)
+        if w is None:
+            errors[uwi] = 'not in the project'
+        elif curve not in w.data:
+            errors[uwi] = 'no {} curve'.format(curve)
+        else:
+            wells.append(w)
+    table = store.table()
+
+    pairs, keys, jobs = [], [], {}
+    for wa, wb in zip(wells[:-1], wells[1:]):
+        key = (wa.uwi, wb.uwi, curve, step, band, store.well_version(wa.uwi), store.well_version(wb.uwi))
+        pairs.append((wa.uwi, wb.uwi))
+        keys.append(key)
+        if key not in alignments and key not in jobs:
+            try:
+                ca, cb = wa.data[curve], wb.data[curve]
+                jobs[key] = (np.asarray(ca.basis, dtype=float), np.asarray(ca, dtype=float),
+                             np.asarray(cb.basis, dtype=float), np.asarray(cb, dtype=float),
+                             step, band, shared_tops(table, wa.uwi, wb.uwi),
+                             (curve_stats.quartiles(wa, curve), curve_stats.quartiles(wb, curve)))
+            except Exception as e:
+                errors[wb.uwi] = 'could not align with {}: {}: {}'.format(wa.uwi, type(e).__name__, e)
+
+    results = _align_jobs(list(jobs.values()), workers or os.cpu_count())
+    for key, (alignment, error) in zip(jobs, results):
+        if error is not None:
+            errors[key[1]] = 'could not align with {}: {}'.format(key[0], error.splitlines()[0])
+            continue
+        # drop the alignment of this pair from before its picks changed
+        alignments.invalidate(lambda k: k[:5] == key[:5])
+        alignments.put(key, alignment)
+
+    return [(a, b, alignments.get(key)) for (a, b), key in zip(pairs, keys)], errors
+
+
+def propagate_section(p, store, uwis, curve='GR', overwrite=False, **kwargs):
+    """
+    Carries every top along a section line, well to well, through the DTW
+    alignments, and writes the tops missing in each well to the pick store.
+    A well's own picks are carried on from it instead of the proposals.
+    The confidence is the product of the similarities along the way.
+    After a well that couldn't be aligned the tops start again from the
+    next well's own picks.
+
+    Returns:
+        (proposals, errors): the proposals (UWI, PICK, MD, CONFIDENCE) as
+        a DataFrame, and the wells skipped as {uwi: message}, see
+        align_section.
+    """
+    section, errors = align_section(p, store, uwis, curve=curve, **kwargs)
+    if not section:
+        return pd.DataFrame(columns=COLUMNS), errors
+    table = store.table()
+
+    def picks_of(uwi):
+        mine = table.to_df(table.well(uwi)).dropna(subset=['MD'])[['PICK', 'MD', 'CONFIDENCE']]
+        return mine.fillna({'CONFIDENCE': 1.0})
+
+    carried = picks_of(section[0][0])
+    proposals = []
+    for uwi_a, uwi_b, alignment in section:
+        if alignment is None:
+            carried = picks_of(uwi_b)
+            continue
+        moved = carried.assign(MD=alignment.map_depths(carried['MD'].to_numpy()),
+                               CONFIDENCE=carried['CONFIDENCE'] * alignment.similarity)
+        moved = moved.dropna(subset=['MD'])
+        proposals.append(moved.assign(UWI=uwi_b))
+        # picks made in well b are carried on instead of the proposals
+        mine = picks_of(uwi_b)
+        carried = pd.concat([mine, moved[~moved['PICK'].isin(mine['PICK'])]])
+
+    if not proposals:
+        return pd.DataFrame(columns=COLUMNS), errors
+    proposals = pd.concat(proposals).reindex(columns=COLUMNS).reset_index(drop=True)
+    existing = table.to_df().dropna(subset=['MD'])
+    if not overwrite:
+        existing = existing[existing['CONFIDENCE'].isna()]  # only hand picks are protected
+    else:
+        existing = existing.iloc[:0]
+    keep = ~pd.MultiIndex.from_frame(proposals[['UWI', 'PICK']]).isin(
+        pd.MultiIndex.from_frame(existing[['UWI', 'PICK']]))
+    if keep.any():
+        store.update_df(proposals[keep])
+    return proposals, errors
+
+
+def read_section_line(fname):
+    """
+    Well identifiers of a section line file, one per line, in order.
+    DLS UWIs are normalized like the project's (see bulk_tops.normalize_uwis),
+    e.g. 00/06-25-082-15W400 -> 00/06-25-082-15W4/0.
+    """
+    with open(fname) as f:
+        uwis = [line.strip() for line in f if line.strip()]
+    return list(bulk_tops.normalize_uwis(uwis))
@@ -3,33 +3,57 @@ from plotly.subplots import make_subplots
 import plotly.graph_objs as go
 from welly import Well,Curve
 
+import curve_query
+import curve_stats
+import decimate
+from resample import resample_curves
+from lru import LRUCache
+
 
 def make_log_plot(w, log_list=['GR','DT'], 
                   ymin=None, ymax=None, 
-                  resample=None): # curve names need to be dynamic later
+                  resample=None,
+                  window=None, pixels=1200): # curve names need to be dynamic later
     '''
     create a composite log of GR and Resistivity
+
+    The curves are decimated to about one min/max pair per pixel of the
+    plot height (pixels) over the visible depth window (window=(top, base),
+    default ymin..ymax), with half a window of margin above and below so
+    small pans don't show blank track.
     TO DO:
     - need to pass the curve names and colors
     - colors should be dynamic
     - linear vs. log should be dynamic
+
+    The x ranges come from the curves' statistics (1st to 99th percentile,
+    rounded), computed when the well was ingested.
     '''
     
-    w_ymin = w.data[log_list[0]].basis[0]
-    w_ymax = w.data[log_list[0]].basis[-1]
+    index = curve_query.curve_index(w, log_list[0]) # no need to build the whole basis for its ends
+    w_ymin, w_ymax = index.top, index.base
     
     if ymin is None: ymin = w_ymin
     if ymax is None: ymax = w_ymax
-    if resample:         
-        for log in log_list:
-            try:
-                w.data[log] = w.data[log].to_basis(step=resample)
-            except:
-                print('Resampling did not occur: ', resample, ' keeping original step.')
+    curves = {log: w.data[log] for log in log_list}
+    if resample:
+        # resampled copies, the curves in the project stay as they are
+        try:
+            curves = resample_curves(w, log_list, step=resample)
+        except Exception as e:
+            print('Resampling did not occur: ', resample, ' keeping original step.', e)
+
+
+    range1 = curve_stats.display_range(w, log_list[0]) or (0, 150)
+    range2 = curve_stats.display_range(w, log_list[1]) or (40, 140)
 
+    top, base = window or (ymin, ymax)
+    pad = (base - top) / 2
+    depth1, values1 = decimate.curve_window(w, log_list[0], top - pad, base + pad, pixels, curve=curves[log_list[0]])
+    depth2, values2 = decimate.curve_window(w, log_list[1], top - pad, base + pad, pixels, curve=curves[log_list[1]])
 
-    track1 = go.Scatter(x=w.data[log_list[0]].values, y=w.data[log_list[0]].basis, name=log_list[0], line=dict(color='black'))
-    track2 = go.Scatter(x=w.data[log_list[1]].values, y=w.data[log_list[1]].basis, name=log_list[1], line=dict(color='red'),
+    track1 = go.Scatter(x=values1, y=depth1, name=log_list[0], line=dict(color='black'))
+    track2 = go.Scatter(x=values2, y=depth2, name=log_list[1], line=dict(color='red'),
                         xaxis='x2')
 
     data = [track1, track2]
@@ -37,7 +61,7 @@ def make_log_plot(w, log_list=['GR','DT'],
     layout = go.Layout(
         xaxis=dict(
             domain=[0, 0.45], #to keep some gap between tracks. try padding the margins instead
-            range=[0,150], # need to be range values later
+            range=list(range1),
             #type='linear', # change to variable later
             position=1,
             title=log_list[0], #this is the axis title, need to figure out how to turn on the subplot title
@@ -48,7 +72,7 @@ def make_log_plot(w, log_list=['GR','DT'],
             ),
         xaxis2=dict(
             domain=[0.55, 1],
-            range=[140,40],
+            range=list(range2)[::-1], # reversed, like a sonic track
             type='linear', # change to variable later
             position=1,
             title=log_list[1] 
@@ -61,7 +85,7 @@ def make_log_plot(w, log_list=['GR','DT'],
         
         )
     fig = go.Figure(data=data, layout=layout, layout_title_text=w.name)
-    fig.update_yaxes(range=(ymax,ymin)) # reversed for MD assumption
+    fig.update_yaxes(range=(base,top)) # reversed for MD assumption
     fig.layout.xaxis.fixedrange = True
     fig.layout.xaxis2.fixedrange = True #added this line also to control zoom on the second track
    
@@ -69,11 +93,40 @@ def make_log_plot(w, log_list=['GR','DT'],
     return fig
 
 
-def update_picks_on_plot(fig, surface_picks):
-    """Draw horizontal lines on a figure at the depths of the values in the
-       surface picks dictionary"""
+# log figures (as dicts, ready for dash) of recently viewed wells
+figure_cache = LRUCache(64, sizeof=lambda fig: 1)
+
+
+def log_plot_key(w, log_list, ymin, ymax, resample, window, pixels):
+    """
+    Cache key of a log figure. It includes the start, step and length of
+    each curve, so a figure is rebuilt if the curve data is replaced.
+    """
+    curves = tuple(decimate.curve_key(w, log) for log in log_list)
+    return (w.uwi, tuple(log_list), ymin, ymax, resample, window, pixels, curves)
+
+
+def cached_log_plot(w, log_list=['GR','DT'], ymin=None, ymax=None,
+                    resample=None, window=None, pixels=1200):
+    """
+    make_log_plot as a figure dict, memoized in figure_cache so going back
+    to a well, or to a zoom window, doesn't rebuild the figure.
+    """
+    key = log_plot_key(w, log_list, ymin, ymax, resample, window, pixels)
+
+    def build():
+        fig = make_log_plot(w, log_list=log_list, ymin=ymin, ymax=ymax,
+                            resample=resample, window=window, pixels=pixels)
+        fig.update_layout(uirevision=w.uwi)
+        return fig.to_dict()
 
-    fig.update_layout(
+    return figure_cache.get_or_compute(key, build)
+
+
+def pick_shapes(surface_picks):
+    """Horizontal lines and labels at the depths of the values in the
+       surface picks dictionary, as layout shapes and annotations"""
+    return dict(
         shapes=[
             dict(
                 type="line",
@@ -100,9 +153,48 @@ def update_picks_on_plot(fig, surface_picks):
             for md, top_name in zip(surface_picks['MD'], surface_picks['PICK']) if not np.isnan(md)
         ]
     )
+
+
+def update_picks_on_plot(fig, surface_picks):
+    """Draw horizontal lines on a figure at the depths of the values in the
+       surface picks dictionary"""
+
+    fig.update_layout(**pick_shapes(surface_picks))
     return
 
 
+def well_map(index, section_wells=None, line=None):
+    """
+    Map of the wells of a spatial.WellIndex. Drag on it to draw a section
+    line; the current line (lats, lons) and its wells are highlighted.
+    """
+    selected = np.isin(index.uwis, section_wells or [])
+    fig = go.Figure(go.Scatter(x=index.lon, y=index.lat, text=list(index.uwis),
+                               mode='markers', hoverinfo='text',
+                               marker=dict(color=np.where(selected, 'red', 'black').tolist(), size=7)))
+    fig.update_layout(dragmode='drawline', template='plotly_white', height=400,
+                      margin=dict(l=40, r=10, t=10, b=30), uirevision='map',
+                      newshape=dict(line=dict(color='red', width=2)))
+    if line is not None:
+        fig.add_shape(type='line', x0=line[1][0], y0=line[0][0], x1=line[1][1], y1=line[0][1],
+                      line=dict(color='red', width=2))
+    # about the same scale east-west and north-south
+    fig.update_yaxes(scaleanchor='x', scaleratio=1 / max(np.cos(np.radians(index.lat0)), 0.1))
+    return fig
+
+
+def section_line(relayout):
+    """
+    (lats, lons) of the last line drawn on the well map, from its
+    relayoutData, or None.
+    """
+    lines = [s for s in (relayout or {}).get('shapes', []) if s.get('type') == 'line']
+    if not lines:
+        return None
+    line = lines[-1]
+    return [line['y0'], line['y1']], [line['x0'], line['x1']]
+
+
 def surface_pick_to_striplog(surface_picks):
     """
     Generate a striplog csv
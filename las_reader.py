@@ -0,0 +1,262 @@
+"""
+Small LAS 2.0 reader for the app.
+
+welly/lasio parse the whole file to build a Well. Most of the time the app
+only needs the ~W and ~C headers (well names, curve lists), so the header is
+read on its own here and the ~A data section is only read when a curve is
+actually requested.
+
+The data section is streamed in chunks of a few MB. Each chunk is cut at a
+line end and parsed with NumPy's C float parser in one call, the tokens of
+an incomplete sample (wrapped files) are carried over to the next chunk,
+and the samples go into a preallocated array. A depth range or a subset of
+curves only keeps what was asked for. In unwrapped files (one sample per
+line) the start of a depth range is found by bisecting the file, and
+reading stops once the depths are past the range, so big files needn't be
+parsed or held whole.
+"""
+import os
+import warnings
+
+import numpy as np
+
+
+CHUNK_BYTES = 4 * 2**20
+
+
+def parse_header_line(line):
+    """
+    Splits a LAS header line 'MNEM.UNIT  VALUE : DESCRIPTION' into
+    (mnemonic, unit, value, description).
+    """
+    mnem, _, rest = line.partition('.')
+    unit = ''
+    if rest and not rest[0].isspace():  # the unit runs from the dot to the first space
+        unit, _, rest = rest.partition(' ')
+    value, _, descr = rest.rpartition(':')
+    return mnem.strip(), unit.strip(), value.strip(), descr.strip()
+
+
+def read_header(fname):
+    """
+    Reads the header sections of a LAS file, stopping at ~A.
+
+    Returns a dict with:
+        'version', 'well', 'params': {mnemonic: (unit, value, description)}
+        'curves': list of (mnemonic, unit, description), index curve first
+        'wrap': bool, 'null': float
+        'data_offset': byte offset of the first data line
+    """
+    sections = {'v': {}, 'w': {}, 'p': {}}
+    curves = []
+    section = None
+    with open(fname, 'rb') as f:
+        while True:
+            raw = f.readline()
+            if not raw:
+                raise ValueError('No ~A section in {}'.format(fname))
+            line = raw.decode('latin-1').strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('~'):
+                section = line[1].lower()
+                if section == 'a':
+                    data_offset = f.tell()
+                    break
+                continue
+            if section == 'c':
+                mnem, unit, _, descr = parse_header_line(line)
+                curves.append((mnem, unit, descr))
+            elif section in sections:
+                mnem, unit, value, descr = parse_header_line(line)
+                sections[section][mnem.upper()] = (unit, value, descr)
+
+    version, well = sections['v'], sections['w']
+    wrap = version.get('WRAP', ('', 'NO', ''))[1].upper().startswith('Y')
+    try:
+        null = float(well.get('NULL', ('', '-999.25', ''))[1])
+    except ValueError:
+        null = -999.25
+    return {'version': version,
+            'well': well,
+            'params': sections['p'],
+            'curves': curves,
+            'wrap': wrap,
+            'null': null,
+            'data_offset': data_offset}
+
+
+def header_value(header, mnemonic, default=''):
+    """
+    Returns the value of a ~W (or ~P) item, or default.
+    """
+    for section in ('well', 'params'):
+        if mnemonic in header[section]:
+            return header[section][mnemonic][1] or default
+    return default
+
+
+def curve_names(header):
+    """
+    Returns the curve mnemonics of a LAS header, without the index curve.
+    """
+    return [c[0] for c in header['curves'][1:]]
+
+
+def parse_values(text):
+    """
+    Parses whitespace separated numbers (bytes) into a float array.
+    """
+    with warnings.catch_warnings():
+        # fromstring stops at something that isn't a number: numpy 1.x only
+        # warns (made an error here), numpy 2.x raises a ValueError without the value
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            return np.fromstring(text, sep=' ')
+        except (DeprecationWarning, ValueError):
+            return np.array(text.split(), dtype=float)  # raises, naming the bad value
+
+
+def _line_depth(f, offset):
+    """
+    (offset, depth) of the first whole line at or after offset, depth None at the end.
+    """
+    f.seek(offset)
+    if offset:
+        f.readline()  # the rest of the line offset falls in
+    while True:
+        start = f.tell()
+        line = f.readline()
+        if not line:
+            return start, None
+        values = line.split()
+        if values:
+            try:
+                return start, float(values[0])
+            except ValueError:
+                pass
+
+
+def _seek_depth(fname, header, top, chunk_bytes):
+    """
+    Byte offset of a line at or a little before the first sample at depth
+    top, by bisection. Only for unwrapped files, where a line is a sample.
+    """
+    start = header['data_offset']
+    with open(fname, 'rb') as f:
+        _, first = _line_depth(f, start)
+        if first is None:
+            return start
+        lo, hi = start, os.path.getsize(fname)
+        while hi - lo > chunk_bytes:
+            mid = (lo + hi) // 2
+            line_start, depth = _line_depth(f, mid)
+            # before the range if depth hasn't reached top yet, whichever way the index runs
+            if depth is not None and (depth < top if depth >= first else False):
+                lo = line_start
+            else:
+                hi = mid
+        return lo
+
+
+def _samples(fname, header, chunk_bytes, offset=None):
+    """
+    Yields (samples x all curves array, bytes read so far) for each chunk of
+    the ~A section, from offset (a line start) if given. Splitting on
+    whitespace and reshaping handles wrapped files too: a sample split
+    across chunks is carried over.
+    """
+    ncurves = len(header['curves'])
+    carry = np.zeros(0)
+    with open(fname, 'rb') as f:
+        start = header['data_offset'] if offset is None else offset
+        f.seek(start)
+        rest = b''
+        while True:
+            chunk = f.read(chunk_bytes)
+            text = rest + chunk
+            if chunk:
+                # cut after the last line end, so no number is split in two
+                cut = text.rfind(b'\n') + 1
+                if cut == 0:
+                    rest = text
+                    continue
+                text, rest = text[:cut], text[cut:]
+            values = parse_values(text)
+            if carry.size:
+                values = np.concatenate([carry, values])
+            whole = values.size - values.size % ncurves
+            carry = values[whole:]
+            yield values[:whole].reshape(-1, ncurves), f.tell() - len(rest) - start
+            if not chunk:
+                return
+
+
+def iter_data(fname, header=None, curves=None, top=None, base=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Streams the ~A section as 2D blocks (samples x [index, curves...]),
+    NULLs as NaN.
+
+    Args:
+        curves (list): mnemonics to keep, default all. The index (depth)
+            is always the first column.
+        top, base (float): only samples with top <= depth <= base. Reading
+            stops once the depths have gone past the range.
+        chunk_bytes (int): bytes of the file parsed at a time.
+
+    Yields:
+        (block, bytes of the data section parsed so far)
+    """
+    if header is None:
+        header = read_header(fname)
+    names = [c[0] for c in header['curves']]
+    columns = list(range(len(names))) if curves is None else [0] + [names.index(m) for m in curves]
+    offset = None
+    if top is not None and not header['wrap']:
+        offset = _seek_depth(fname, header, top, chunk_bytes)
+    top = -np.inf if top is None else top
+    base = np.inf if base is None else base
+    first = None
+    for block, done in _samples(fname, header, chunk_bytes, offset):
+        if not len(block):
+            continue
+        depth = block[:, 0]
+        if first is None:
+            first = depth[0]
+        keep = (depth >= top) & (depth <= base)
+        block = block[keep][:, columns] if not keep.all() else block[:, columns]
+        block[block == header['null']] = np.nan
+        yield block, done
+        # the index runs one way, so once it's past the range nothing further is in it
+        if (depth[-1] >= first and depth[-1] > base) or (depth[-1] < first and depth[-1] < top):
+            return
+
+
+def read_data(fname, header=None, curves=None, top=None, base=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Reads the ~A section into a 2D array (samples x [index, curves...]),
+    NULLs as NaN. Takes the same curves, top and base as iter_data; by
+    default all the curves of the whole file.
+    """
+    if header is None:
+        header = read_header(fname)
+    size = max(os.path.getsize(fname) - header['data_offset'], 1)
+    out, n = None, 0
+    for block, done in iter_data(fname, header, curves, top, base, chunk_bytes):
+        if out is None:
+            if top is None and base is None:
+                # room for the whole file at the density of the first chunk, plus a little
+                rows = int(size * max(len(block), 1) / max(done, 1) * 1.05) + 1
+            else:
+                rows = 2 * len(block) + 1  # a range is usually a small part of the file
+            out = np.empty((rows, block.shape[1]))
+        if n + len(block) > len(out):
+            out = np.resize(out, (2 * (n + len(block)), out.shape[1]))
+        out[n:n + len(block)] = block
+        n += len(block)
+    if out is None:
+        width = len(header['curves']) if curves is None else len(curves) + 1
+        return np.empty((0, width))
+    # don't hold on to a much bigger buffer than needed, e.g. after a depth range
+    return out[:n] if n > 0.9 * len(out) else out[:n].copy()
+
@@ -0,0 +1,248 @@
+"""
+Lazy, on-demand curve loading for a welly Project.
+
+Only the LAS headers (~W and ~C) and the tops are read when the project is
+built, which is enough for well_uwi, get_curves and the dropdowns. Each
+well's data dict is a LazyCurves mapping: a curve is read the first time
+it's asked for, and kept in a CurveStore that evicts the least recently
+used curves once a memory budget is reached.
+
+Curves come from the well cache (well_cache.py) when it's up to date,
+otherwise the LAS data section is parsed once and written to the cache.
+
+With mmap=True the curves are read-only memory maps of the cache files.
+Every gunicorn worker then shares the same physical pages, so adding
+workers doesn't add copies of the curve data; only private memory (e.g.
+curves not mapped from the cache) counts against the memory budget.
+"""
+import mmap
+from collections.abc import MutableMapping
+from glob import glob
+from pathlib import Path
+
+import numpy as np
+from striplog import Striplog
+from welly import Curve, Project, Well
+from welly.header import Header
+from welly.location import Location
+
+import las_reader
+import well_cache
+from lru import LRUCache
+from tops import striplog_from_tops
+
+
+DEFAULT_MAX_BYTES = 256 * 2**20
+
+# welly attribute: LAS ~W mnemonic, same mapping as welly.fields
+HEADER_FIELDS = {'name': 'WELL', 'uwi': 'UWI', 'field': 'FLD', 'company': 'COMP',
+                 'license': 'LIC', 'api': 'API'}
+LOCATION_FIELDS = {'location': 'LOC', 'country': 'CTRY', 'province': 'PROV',
+                   'state': 'STAT', 'county': 'CNTY', 'latitude': 'LATI',
+                   'longitude': 'LONG', 'datum': 'GDAT', 'x': 'XCOORD', 'y': 'YCOORD'}
+
+
+def make_curve(depth, values, params):
+    """
+    Builds a welly Curve from a depth array and values, regularising the
+    basis the way welly does for irregular sampling.
+    """
+    if depth[0] > depth[-1]:
+        depth, values = depth[::-1], values[::-1]
+    d = np.diff(depth)
+    step = np.nanmedian(d)
+    if not np.allclose(d, step):
+        basis = np.arange(depth[0], depth[-1] + 1e-5, step)
+        values = np.interp(basis, depth, values)
+    params = dict(params, start=float(depth[0]), step=float(step))
+    return Curve(values, params=params)
+
+
+def curve_params(header, mnemonic):
+    """
+    Welly Curve params for one curve of a LAS header.
+    """
+    units = {c[0]: c[1] for c in header['curves']}
+    descr = {c[0]: c[2] for c in header['curves']}
+    return {'mnemonic': mnemonic,
+            'units': units[mnemonic],
+            'description': descr[mnemonic],
+            'null': header['null'],
+            'run': None,
+            'service_company': las_reader.header_value(header, 'SRVC'),
+            'date': las_reader.header_value(header, 'DATE'),
+            'code': '',
+            'basis_units': header['curves'][0][1].upper()}
+
+
+def private_nbytes(curve):
+    """
+    Bytes of a curve held in this process's own memory: 0 for a curve
+    mapped from the well cache, whose pages are shared between processes.
+    """
+    base = curve
+    while base is not None:
+        if isinstance(base, (np.memmap, mmap.mmap)):
+            return 0
+        base = getattr(base, 'base', None)
+    return curve.nbytes
+
+
+class CurveStore:
+    """
+    Reads curves on demand and keeps the most recently used ones in memory.
+
+    Args:
+        max_bytes (int): memory budget for curve data.
+        cache_dir (str): the well cache directory.
+        mmap (bool): map the curves from the cache files instead of
+            reading them into this process.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=well_cache.CACHE_DIR, mmap=False):
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+        self.curves = LRUCache(max_bytes, sizeof=private_nbytes)
+
+    def get(self, lasfile, topsfile, mnemonic):
+        key = (lasfile, mnemonic)
+        curve = self.curves.get(key)
+        if curve is None:
+            curve = self._read(lasfile, topsfile, mnemonic)
+            # shared by every session and thread: read-only, so nothing can change it in place
+            curve.flags.writeable = False
+            curve = self.curves.put(key, curve)
+        return curve
+
+    def _read(self, lasfile, topsfile, mnemonic):
+        meta = well_cache.read_meta(lasfile, topsfile, self.cache_dir)
+        if meta is None:
+            # Not cached yet: parse the data section once and cache every curve,
+            # so the next curve of this well is a cheap .npy read.
+            w = read_las(lasfile, topsfile)
+            well_cache.save_well(w, lasfile, topsfile, self.cache_dir)
+            if not self.mmap:
+                return w.data[mnemonic]
+            meta = well_cache.read_meta(lasfile, topsfile, self.cache_dir)
+        return well_cache.load_curve(lasfile, mnemonic, meta, self.cache_dir,
+                                     mmap_mode='r' if self.mmap else None)
+
+
+class LazyCurves(MutableMapping):
+    """
+    Stand-in for Well.data. The curve names are known from the header;
+    the data is fetched from the CurveStore when a curve is accessed.
+    Anything assigned (tops, resampled curves) is held as usual.
+    stats are the curve statistics from the well cache (see curve_stats).
+    """
+    def __init__(self, store, lasfile, topsfile, names, stats=None):
+        self.store = store
+        self.lasfile = lasfile
+        self.topsfile = topsfile
+        self.names = list(names)
+        self.stats = dict(stats or {})
+        self._items = {}
+
+    def __getitem__(self, key):
+        if key in self._items:
+            return self._items[key]
+        if key not in self.names:
+            raise KeyError(key)
+        return self.store.get(self.lasfile, self.topsfile, key)
+
+    def __contains__(self, key):
+        # without this, Mapping's `in` would load the curve
+        return key in self._items or key in self.names
+
+    def __setitem__(self, key, value):
+        self.stats.pop(key, None)  # they were of the curve this replaces
+        self._items[key] = value
+
+    def __delitem__(self, key):
+        self.stats.pop(key, None)
+        if key in self._items:
+            del self._items[key]
+        elif key in self.names:
+            self.names.remove(key)
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from self.names
+        yield from (k for k in self._items if k not in self.names)
+
+    def __len__(self):
+        return len(self.names) + len([k for k in self._items if k not in self.names])
+
+
+def read_well(lasfile, topsfile=None):
+    """
+    Returns a Well with header and location from the LAS header only, and
+    an empty data dict. The parsed LAS header is kept as w.header_las.
+    """
+    header = las_reader.read_header(lasfile)
+    w = Well({'header': Header({k: las_reader.header_value(header, m)
+                                for k, m in HEADER_FIELDS.items()}),
+              'location': Location({k: las_reader.header_value(header, m)
+                                    for k, m in LOCATION_FIELDS.items()}),
+              'fname': lasfile})
+    w.header_las = header
+    if topsfile is not None:
+        w.data['tops'] = Striplog.from_csv(topsfile)
+    return w
+
+
+def read_las(lasfile, topsfile=None, curves=None, top=None, base=None):
+    """
+    Returns a Well with its curves read by the streaming reader in
+    las_reader, much faster than Well.from_las. curves, top and base
+    read only some curves, or only a depth range (see las_reader.iter_data).
+    """
+    w = read_well(lasfile, topsfile)
+    names = las_reader.curve_names(w.header_las) if curves is None else list(curves)
+    data = las_reader.read_data(lasfile, w.header_las, curves=names, top=top, base=base)
+    if len(data) > 1:
+        for i, mnem in enumerate(names, start=1):
+            w.data[mnem] = make_curve(data[:, 0], data[:, i], curve_params(w.header_las, mnem))
+    return w
+
+
+def lazy_well(lasfile, topsfile, store):
+    """
+    Returns a Well whose curves are loaded on demand from store.
+    """
+    meta = well_cache.read_meta(lasfile, topsfile, store.cache_dir)
+    if meta is not None:
+        # cached: header, curve names and tops without touching the LAS file
+        names = list(meta['curves'])
+        stats = meta.get('stats')
+        w = Well({'header': Header(meta['header']),
+                  'location': Location(meta['location']),
+                  'fname': lasfile})
+        if meta['tops'] is not None:
+            tops = striplog_from_tops(meta['tops']['depths'], meta['tops']['names'])
+        else:
+            tops = None
+    else:
+        w = read_well(lasfile, topsfile)
+        names = las_reader.curve_names(w.header_las)
+        stats = None
+        tops = w.data.get('tops')
+    w.data = LazyCurves(store, lasfile, topsfile, names, stats)
+    if tops is not None:
+        w.data['tops'] = tops
+    return w
+
+
+def from_las(las_path, tops_path=None, max_bytes=DEFAULT_MAX_BYTES,
+             cache_dir=well_cache.CACHE_DIR, mmap=False):
+    """
+    Returns a welly Project of every LAS file in las_path whose curves are
+    read on first use, within a memory budget of max_bytes. With mmap the
+    curves are memory mapped from the well cache (see CurveStore).
+    """
+    store = CurveStore(max_bytes, cache_dir, mmap)
+    lasfiles = sorted(glob(str(Path(las_path) / '*.LAS')))
+    wells = [lazy_well(f, well_cache.tops_file_for(f, tops_path), store) for f in lasfiles]
+    p = Project(wells)
+    p.store = store
+    return p
@@ -0,0 +1,118 @@
+"""
+A small least-recently-used cache with a size budget.
+
+Used wherever the app keeps derived data around (curves read on demand,
+rendered figures, resampled curves...). Entries are evicted oldest-first
+once the total size goes over max_size.
+"""
+from collections import OrderedDict
+from threading import RLock
+
+
+def nbytes(value):
+    """
+    Default size of an entry: its numpy nbytes, else 1 (i.e. count entries).
+    """
+    return getattr(value, 'nbytes', 1)
+
+
+class LRUCache:
+    """
+    Least-recently-used mapping bounded by the total size of its values.
+
+    Args:
+        max_size (int): budget, in the units returned by sizeof.
+        sizeof (callable): size of one value, defaults to its nbytes.
+    """
+    def __init__(self, max_size, sizeof=nbytes):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, _ = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self.pop(key)
+            size = self.sizeof(value)
+            self._data[key] = (value, size)
+            self.size += size
+            # always keep the newest entry, even if it's bigger than the budget
+            while self.size > self.max_size and len(self._data) > 1:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+        return value
+
+    def get_or_compute(self, key, func):
+        """
+        Returns the cached value for key, computing and storing it on a miss.
+        """
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = self.put(key, func())
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, size = self._data.pop(key)
+            self.size -= size
+            return value
+
+    def invalidate(self, match):
+        """
+        Drops every entry whose key satisfies match(key).
+        """
+        with self._lock:
+            for key in [k for k in self._data if match(k)]:
+                self.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Returns the counters as a dict, e.g. for a metrics endpoint.
+        """
+        return {'entries': len(self._data), 'size': self.size, 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def metrics_text(caches, prefix='swellcorr_cache'):
+    """
+    Prometheus text format for the counters of named caches, {name: LRUCache}.
+    """
+    lines = []
+    for stat in ('hits', 'misses', 'evictions', 'entries', 'size'):
+        kind = 'counter' if stat in ('hits', 'misses', 'evictions') else 'gauge'
+        lines.append('# TYPE {}_{} {}'.format(prefix, stat, kind))
+        for name, cache in caches.items():
+            lines.append('{}_{}{{cache="{}"}} {}'.format(prefix, stat, name, cache.stats()[stat]))
+    return '\n'.join(lines) + '\n'
+
+
+_missing = object()
@@ -0,0 +1,135 @@
+"""
+Parallel LAS and tops ingestion.
+
+Parsing LAS files is CPU bound, so large well directories are parsed across
+a process pool, each file with the streaming reader (lazy_project.read_las).
+Workers send back plain arrays (well_cache.to_payload) and the Project is
+assembled in the parent, in sorted file name order whatever order the
+workers finish in. A file that fails to load is reported and
+skipped instead of stopping the whole load.
+
+warm_cache only brings the well cache up to date, without sending the
+curves back, e.g. once in the gunicorn master before the workers memory map
+the cache (lazy_project.from_las(..., mmap=True)).
+
+Run as a script to warm the well cache for a directory:
+
+    python parallel_load.py data/McMurray_data/las [--tops data/.../tops] [--workers 8]
+"""
+import argparse
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from pathlib import Path
+
+from welly import Project
+
+import lazy_project
+import well_cache
+
+
+def pair_files(las_path, tops_path=None):
+    """
+    Returns a sorted list of (lasfile, topsfile) pairs, matching tops to
+    LAS files by file name (e.g. Torosa-1.LAS and Torosa-1.csv). topsfile
+    is None when a well has no tops file.
+    """
+    lasfiles = sorted(glob(str(Path(las_path) / '*.LAS')))
+    return [(f, well_cache.tops_file_for(f, tops_path)) for f in lasfiles]
+
+
+def parse_well(lasfile, topsfile=None, cache_dir=None):
+    """
+    Worker: returns (payload, error) for one well. Reads from and writes
+    to the well cache if cache_dir is given.
+    """
+    try:
+        if cache_dir is not None:
+            payload = well_cache.load_payload(lasfile, topsfile, cache_dir)
+            if payload is not None:
+                return payload, None
+        w = lazy_project.read_las(lasfile, topsfile)
+        payload = well_cache.to_payload(w)
+        if cache_dir is not None:
+            well_cache.save_well(w, lasfile, topsfile, cache_dir, payload=payload)
+        return payload, None
+    except Exception as e:
+        return None, '{}: {}\n{}'.format(type(e).__name__, e, traceback.format_exc())
+
+
+def _parse_pair(args):
+    return parse_well(*args)
+
+
+def _cache_pair(args):
+    _, error = parse_well(*args)
+    return error
+
+
+def warm_cache(las_path, tops_path=None, workers=None, cache_dir=well_cache.CACHE_DIR):
+    """
+    Parses the wells of las_path that aren't in the well cache, or whose
+    files changed, across a process pool and writes them to the cache.
+
+    Returns:
+        (number of wells parsed, errors as {lasfile: message})
+    """
+    jobs = [(lasfile, topsfile, cache_dir) for lasfile, topsfile in pair_files(las_path, tops_path)
+            if well_cache.read_meta(lasfile, topsfile, cache_dir) is None]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(jobs) < 2:
+        results = [_cache_pair(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            results = list(pool.map(_cache_pair, jobs))
+    errors = {job[0]: error for job, error in zip(jobs, results) if error is not None}
+    for lasfile, error in errors.items():
+        print('Could not load {}: {}'.format(lasfile, error.splitlines()[0]))
+    return len(jobs), errors
+
+
+def load_project(las_path, tops_path=None, workers=None, cache_dir=well_cache.CACHE_DIR,
+                 chunksize=1):
+    """
+    Loads every LAS file in las_path, with tops from tops_path, across a
+    process pool.
+
+    Args:
+        workers (int): number of processes, default os.cpu_count().
+            workers=1 parses in this process.
+        cache_dir (str): well cache directory, None to always parse.
+
+    Returns:
+        (Project, errors) where errors is a dict of {lasfile: message}
+        for the files that could not be loaded.
+    """
+    pairs = pair_files(las_path, tops_path)
+    jobs = [(lasfile, topsfile, cache_dir) for lasfile, topsfile in pairs]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(jobs) < 2:
+        results = [_parse_pair(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # map() yields in submission order, so the Project order is deterministic
+            results = list(pool.map(_parse_pair, jobs, chunksize=chunksize))
+
+    wells, errors = [], {}
+    for (lasfile, _), (payload, error) in zip(pairs, results):
+        if error is not None:
+            errors[lasfile] = error
+            print('Could not load {}: {}'.format(lasfile, error.splitlines()[0]))
+            continue
+        wells.append(well_cache.from_payload(payload, lasfile))
+    return Project(wells), errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parse LAS files in parallel into the well cache.')
+    parser.add_argument('las_path')
+    parser.add_argument('--tops', default=None, help='directory of tops CSVs')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache', default=well_cache.CACHE_DIR)
+    args = parser.parse_args()
+    parsed, errors = warm_cache(args.las_path, args.tops, args.workers, args.cache)
+    print('Parsed {} wells, {} errors'.format(parsed, len(errors)))
@@ -0,0 +1,846 @@
+"""
+Server-side store of surface picks, indexed by (UWI, PICK).
+
+Callbacks used to pass every pick around as JSON in the hidden tops-storage
+div and re-parse it on each click. The picks now live here and the div only
+carries a small version token naming the well that changed; each callback
+queries just the well it needs.
+
+PickStore keeps the picks in memory in the worker process. SQLitePickStore
+keeps them in an SQLite file, so several gunicorn workers share the same
+picks (and they survive a restart). JournalPickStore keeps them in memory
+too, but appends every edit to a JSON-lines journal as it happens, so a
+restart (or a crashed worker) replays the journal and loses nothing.
+
+Each pick has a CONFIDENCE: null for a pick made by hand, 0..1 for a pick
+proposed automatically (see autocorr.py), and a QUALITY grade as given by
+the interpreter in tops databases (e.g. the McMurray PICKS.TXT). A pick
+name can have a PICKID, its code in the stratigraphic column; pick names
+are listed in PICKID order.
+
+Several interpreters can pick on the same store at once: each session
+edits its own copy-on-write PickLayer (store.layer(session)), which reads
+through to the shared picks for every well it hasn't touched. Commits
+are checked against the version each edited well had when the session
+first touched it, so a commit never silently overwrites someone else's
+picks.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import time
+from threading import RLock
+
+import numpy as np
+import pandas as pd
+
+from tops import TopsTable
+
+
+COLUMNS = ['UWI', 'PICK', 'MD', 'CONFIDENCE', 'QUALITY']
+
+
+class PickConflict(ValueError):
+    """
+    A session's picks can't be committed: other sessions changed the same
+    wells since it started editing them. The wells are in .uwis.
+    """
+    def __init__(self, uwis):
+        super().__init__('picks changed by another session in {}'.format(', '.join(uwis)))
+        self.uwis = uwis
+
+
+def _to_df(rows):
+    return pd.DataFrame(rows, columns=COLUMNS).astype({'MD': float, 'CONFIDENCE': float, 'QUALITY': float})
+
+
+def _float(x):
+    return None if x is None or np.isnan(x) else float(x)
+
+
+def _column(df, name, null=None):
+    """
+    A numeric column of df as a list of floats, with nulls (or the whole
+    column, if df doesn't have it) as null.
+    """
+    if name not in df:
+        return [null] * len(df)
+    values = pd.to_numeric(df[name], errors='coerce')
+    return values.astype(object).where(values.notna(), null).tolist()
+
+
+class PickStore:
+    """
+    In-process pick store: {uwi: {pick: (md, confidence, quality)}} plus
+    the pick names with their PICKID, and a version counter per well.
+    """
+    def __init__(self):
+        self._wells = {}
+        self._names = {}
+        self._versions = {}
+        self.version = 0
+        self.modified = time.time()
+        self._layers = {}
+        self._edit = 0  # last layer edit of any session, never reused
+        self._lock = RLock()
+
+    @classmethod
+    def from_df(cls, df, **kwargs):
+        store = cls(**kwargs)
+        store.update_df(df)
+        return store
+
+    def update_df(self, df):
+        """
+        Adds every row of a DataFrame with UWI, PICK and MD columns (and
+        optionally CONFIDENCE and QUALITY), bumping each well's version once.
+        """
+        rows = zip(df['UWI'], df['PICK'], _column(df, 'MD', np.nan),
+                   _column(df, 'CONFIDENCE'), _column(df, 'QUALITY'))
+        with self._lock:
+            changed = {}
+            for uwi, pick, *values in rows:
+                self._wells.setdefault(uwi, {})[pick] = tuple(values)
+                changed[uwi] = None
+            for pick in dict.fromkeys(df['PICK']):
+                self._names.setdefault(pick, None)
+            return self._bump(*changed)
+
+    def set(self, uwi, pick, md, confidence=None, quality=None):
+        """
+        Adds or moves a pick. confidence is None for a manual pick.
+        Returns the new version.
+        """
+        with self._lock:
+            self._wells.setdefault(uwi, {})[pick] = (float(md), _float(confidence), _float(quality))
+            self._names.setdefault(pick, None)
+            return self._bump(uwi)
+
+    def set_pick_ids(self, pick_ids):
+        """
+        Sets the PICKID of pick names, {pick: pickid}.
+        """
+        with self._lock:
+            for pick, pickid in pick_ids.items():
+                self._names[pick] = int(pickid)
+
+    def pick_ids(self):
+        return {pick: pickid for pick, pickid in self._names.items() if pickid is not None}
+
+    def delete(self, uwi, pick):
+        with self._lock:
+            if self._wells.get(uwi, {}).pop(pick, None) is not None:
+                return self._bump(uwi)
+            return self.version
+
+    def _bump(self, *uwis):
+        # one version for everything changed together
+        self.version += 1
+        self.modified = time.time()
+        for uwi in uwis:
+            self._versions[uwi] = self.version
+        return self.version
+
+    def well_version(self, uwi):
+        """
+        Version of the last change to this well's picks (0 if never changed).
+        """
+        return self._versions.get(uwi, 0)
+
+    def well_versions(self):
+        """
+        Returns {uwi: version} for every well that has picks.
+        """
+        return {uwi: self._versions.get(uwi, 0) for uwi in self._wells}
+
+    def get_well(self, uwi):
+        """
+        Returns the picks of one well as a DataFrame (COLUMNS), by depth.
+        """
+        picks = self._wells.get(uwi, {})
+        df = _to_df([(uwi, pick) + values for pick, values in picks.items()])
+        return df.sort_values('MD', kind='stable').reset_index(drop=True)
+
+    def pick_names(self):
+        """
+        Pick names by PICKID, then those without one in the order first seen.
+        """
+        order = {pick: i for i, pick in enumerate(self._names)}
+        return sorted(self._names, key=lambda pick: (self._names[pick] is None, self._names[pick] or 0, order[pick]))
+
+    def uwis(self):
+        return list(self._wells)
+
+    def to_df(self):
+        """
+        Returns all picks as one DataFrame, sorted by UWI and MD.
+        """
+        rows = [(uwi, pick) + values for uwi, picks in self._wells.items()
+                for pick, values in picks.items()]
+        return _to_df(rows).sort_values(['UWI', 'MD'], kind='stable').reset_index(drop=True)
+
+    def __len__(self):
+        return sum(len(picks) for picks in self._wells.values())
+
+    def table(self):
+        """
+        All picks as a compact tops.TopsTable, rebuilt only after a change.
+        """
+        version = self.version
+        cached = getattr(self, '_table', None)
+        if cached is None or cached[0] != version:
+            cached = self._table = (version, TopsTable(self.to_df()))
+        return cached[1]
+
+    def token(self, uwi=None):
+        """
+        The small JSON token callbacks pass around instead of the picks.
+        """
+        return json.dumps({'version': self.version, 'uwi': uwi})
+
+    def layer(self, session):
+        """
+        The copy-on-write view of the picks for one session.
+        """
+        return PickLayer(self, session)
+
+    # Layer storage, used by PickLayer. A layer holds the picks its session
+    # changed ({uwi: {pick: values, or None if deleted}}), and for each of
+    # those wells the store version it was based on and the number of its last
+    # edit, and the time of its last edit. Edit numbers count up over all sessions
+    # and are never reused, so a well picked again after a discard or commit
+    # never gets a version it had before.
+
+    def _layer(self, session):
+        return self._layers.get(session, {'wells': {}, 'base': {}, 'edits': {}})
+
+    def _layer_wells(self, session):
+        """
+        {uwi: (base version, edit)} of the wells a session changed.
+        """
+        layer = self._layer(session)
+        return {uwi: (layer['base'][uwi], layer['edits'][uwi]) for uwi in layer['wells']}
+
+    def _layer_picks(self, session, uwi):
+        return dict(self._layer(session)['wells'].get(uwi, {}))
+
+    def _layer_write(self, session, rows):
+        """
+        Writes (uwi, pick, values or None) rows to a session's layer.
+        """
+        with self._lock:
+            layer = self._layers.setdefault(session, {'wells': {}, 'base': {}, 'edits': {}})
+            self._edit += 1
+            edit = self._edit
+            for uwi, pick, values in rows:
+                if uwi not in layer['wells']:
+                    layer['base'][uwi] = self.well_version(uwi)
+                layer['wells'].setdefault(uwi, {})[pick] = values
+                layer['edits'][uwi] = edit
+                if values is not None:
+                    self._names.setdefault(pick, None)
+            layer['touched'] = time.time()
+
+    def _layer_drop(self, session):
+        with self._lock:
+            self._layers.pop(session, None)
+
+    def _layer_touched(self):
+        """
+        {session: time of its last edit} of every layer.
+        """
+        with self._lock:
+            return {session: layer.get('touched', self.modified) for session, layer in self._layers.items()}
+
+    def expire_layers(self, max_age):
+        """
+        Drops the layers of sessions that haven't edited for max_age seconds,
+        e.g. of browser tabs closed without committing or discarding.
+        Returns the sessions dropped.
+        """
+        cutoff = time.time() - max_age
+        expired = [session for session, touched in self._layer_touched().items() if touched < cutoff]
+        for session in expired:
+            self._layer_drop(session)
+        return expired
+
+    def _layer_commit(self, session, overwrite=False):
+        """
+        Applies a session's layer to the store in one version and drops it.
+        """
+        with self._lock:
+            layer = self._layer(session)
+            conflicts = [uwi for uwi, base in layer['base'].items() if self.well_version(uwi) != base]
+            if conflicts and not overwrite:
+                raise PickConflict(conflicts)
+            if not layer['wells']:
+                return self.version
+            for uwi, picks in layer['wells'].items():
+                well = self._wells.setdefault(uwi, {})
+                for pick, values in picks.items():
+                    if values is None:
+                        well.pop(pick, None)
+                    else:
+                        well[pick] = values
+            self._layers.pop(session, None)
+            return self._bump(*layer['wells'])
+
+
+class SQLitePickStore(PickStore):
+    """
+    Pick store backed by an SQLite file, shared by every process that opens it.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS picks (
+            uwi TEXT NOT NULL,
+            pick TEXT NOT NULL,
+            md REAL,
+            confidence REAL,
+            quality REAL,
+            PRIMARY KEY (uwi, pick)
+        );
+        CREATE TABLE IF NOT EXISTS pick_names (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            pick TEXT UNIQUE NOT NULL,
+            pickid INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS versions (
+            uwi TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            modified REAL
+        );
+        CREATE TABLE IF NOT EXISTS layer_picks (
+            session TEXT NOT NULL,
+            uwi TEXT NOT NULL,
+            pick TEXT NOT NULL,
+            md REAL,
+            confidence REAL,
+            quality REAL,
+            deleted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (session, uwi, pick)
+        );
+        CREATE TABLE IF NOT EXISTS layer_wells (
+            session TEXT NOT NULL,
+            uwi TEXT NOT NULL,
+            base_version INTEGER NOT NULL,
+            edit INTEGER NOT NULL,
+            touched REAL,
+            PRIMARY KEY (session, uwi)
+        );
+        CREATE TABLE IF NOT EXISTS layer_edits (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            edit INTEGER NOT NULL
+        );
+    """
+
+    ADDED_COLUMNS = [('picks', 'confidence', 'REAL'), ('picks', 'quality', 'REAL'),
+                     ('pick_names', 'pickid', 'INTEGER'), ('layer_wells', 'touched', 'REAL')]
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = RLock()
+        self._conn = None
+        self._pid = None
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+            # files written before these columns existed
+            for table, column, kind in self.ADDED_COLUMNS:
+                if column not in [r[1] for r in conn.execute('PRAGMA table_info({})'.format(table))]:
+                    conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table, column, kind))
+            # layers from before edit times were kept count from now
+            conn.execute('UPDATE layer_wells SET touched = ? WHERE touched IS NULL', (time.time(),))
+            # and edit numbers were counted per session: carry on above all of them
+            conn.execute('INSERT OR IGNORE INTO layer_edits (id, edit) SELECT 0, COALESCE(MAX(edit), 0) '
+                         'FROM layer_wells')
+
+    def _connect(self):
+        # one connection per process: connections must not cross a fork
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._pid = os.getpid()
+        return self._conn
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._connect().execute(sql, args).fetchall()
+
+    INSERT = 'INSERT OR REPLACE INTO picks (uwi, pick, md, confidence, quality) VALUES (?, ?, ?, ?, ?)'
+    SELECT = 'SELECT uwi, pick, md, confidence, quality FROM picks'
+
+    def set(self, uwi, pick, md, confidence=None, quality=None):
+        with self._lock, self._connect() as conn:
+            conn.execute(self.INSERT, (uwi, pick, _float(md), _float(confidence), _float(quality)))
+            conn.execute('INSERT OR IGNORE INTO pick_names (pick) VALUES (?)', (pick,))
+            return self._bump(conn, uwi)
+
+    def update_df(self, df):
+        rows = list(zip(df['UWI'], df['PICK'], _column(df, 'MD'),
+                        _column(df, 'CONFIDENCE'), _column(df, 'QUALITY')))
+        with self._lock, self._connect() as conn:
+            conn.executemany(self.INSERT, rows)
+            conn.executemany('INSERT OR IGNORE INTO pick_names (pick) VALUES (?)',
+                             [(pick,) for pick in dict.fromkeys(df['PICK'])])
+            self._bump(conn, *dict.fromkeys(df['UWI']))
+        return self.version
+
+    def delete(self, uwi, pick):
+        with self._lock, self._connect() as conn:
+            cur = conn.execute('DELETE FROM picks WHERE uwi = ? AND pick = ?', (uwi, pick))
+            if cur.rowcount:
+                return self._bump(conn, uwi)
+        return self.version
+
+    def _bump(self, conn, *uwis):
+        # the empty UWI row holds the version of the whole store; this runs
+        # inside the write transaction so concurrent workers can't reuse a version
+        now = time.time()
+        conn.execute("INSERT INTO versions (uwi, version, modified) VALUES ('', 1, ?) "
+                     "ON CONFLICT(uwi) DO UPDATE SET version = version + 1, modified = ?", (now, now))
+        version = conn.execute("SELECT version FROM versions WHERE uwi = ''").fetchone()[0]
+        conn.executemany('INSERT OR REPLACE INTO versions (uwi, version, modified) VALUES (?, ?, ?)',
+                         [(uwi, version, now) for uwi in uwis])
+        return version
+
+    @property
+    def version(self):
+        rows = self._query("SELECT version FROM versions WHERE uwi = ''")
+        return rows[0][0] if rows else 0
+
+    @property
+    def modified(self):
+        rows = self._query("SELECT modified FROM versions WHERE uwi = ''")
+        return rows[0][0] if rows else os.path.getmtime(self.path)
+
+    def well_version(self, uwi):
+        rows = self._query('SELECT version FROM versions WHERE uwi = ?', (uwi,))
+        return rows[0][0] if rows else 0
+
+    def well_versions(self):
+        return dict(self._query("SELECT p.uwi, COALESCE(v.version, 0) FROM "
+                                "(SELECT DISTINCT uwi FROM picks) p LEFT JOIN versions v ON p.uwi = v.uwi"))
+
+    def get_well(self, uwi):
+        rows = self._query(self.SELECT + ' WHERE uwi = ? ORDER BY md IS NULL, md', (uwi,))
+        return _to_df(rows)
+
+    def set_pick_ids(self, pick_ids):
+        with self._lock, self._connect() as conn:
+            conn.executemany('INSERT OR IGNORE INTO pick_names (pick) VALUES (?)', [(pick,) for pick in pick_ids])
+            conn.executemany('UPDATE pick_names SET pickid = ? WHERE pick = ?',
+                             [(int(pickid), pick) for pick, pickid in pick_ids.items()])
+
+    def pick_ids(self):
+        return dict(self._query('SELECT pick, pickid FROM pick_names WHERE pickid IS NOT NULL'))
+
+    def pick_names(self):
+        return [r[0] for r in self._query('SELECT pick FROM pick_names ORDER BY pickid IS NULL, pickid, seq')]
+
+    def uwis(self):
+        return [r[0] for r in self._query('SELECT DISTINCT uwi FROM picks')]
+
+    def to_df(self):
+        return _to_df(self._query(self.SELECT + ' ORDER BY uwi, md IS NULL, md'))
+
+    def __len__(self):
+        return self._query('SELECT COUNT(*) FROM picks')[0][0]
+
+    def _layer_wells(self, session):
+        rows = self._query('SELECT uwi, base_version, edit FROM layer_wells WHERE session = ?', (session,))
+        return {uwi: (base, edit) for uwi, base, edit in rows}
+
+    def _layer_picks(self, session, uwi):
+        rows = self._query('SELECT pick, md, confidence, quality, deleted FROM layer_picks '
+                           'WHERE session = ? AND uwi = ?', (session, uwi))
+        return {pick: None if deleted else (_float(md), conf, quality)
+                for pick, md, conf, quality, deleted in rows}
+
+    def _layer_write(self, session, rows):
+        rows = [(session, uwi, pick) + ((None,) * 3 + (1,) if values is None
+                                        else tuple(_float(v) for v in values) + (0,))
+                for uwi, pick, values in rows]
+        uwis = list(dict.fromkeys(r[1] for r in rows))
+        with self._lock, self._connect() as conn:
+            # counted in the write transaction, like _bump, so workers can't reuse a number
+            conn.execute('UPDATE layer_edits SET edit = edit + 1 WHERE id = 0')
+            edit = conn.execute('SELECT edit FROM layer_edits WHERE id = 0').fetchone()[0]
+            versions = dict(conn.execute('SELECT uwi, version FROM versions WHERE uwi IN ({})'.format(
+                ', '.join('?' * len(uwis))), uwis)) if uwis else {}
+            # the base version is kept from the first edit of the well
+            conn.executemany('INSERT INTO layer_wells (session, uwi, base_version, edit) VALUES (?, ?, ?, ?) '
+                             'ON CONFLICT(session, uwi) DO UPDATE SET edit = excluded.edit',
+                             [(session, uwi, versions.get(uwi, 0), edit) for uwi in uwis])
+            conn.executemany('INSERT OR REPLACE INTO layer_picks (session, uwi, pick, md, confidence, '
+                             'quality, deleted) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.executemany('INSERT OR IGNORE INTO pick_names (pick) VALUES (?)',
+                             [(r[2],) for r in rows if not r[-1]])
+            conn.execute('UPDATE layer_wells SET touched = ? WHERE session = ?', (time.time(), session))
+
+    def _layer_drop(self, session):
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM layer_picks WHERE session = ?', (session,))
+            conn.execute('DELETE FROM layer_wells WHERE session = ?', (session,))
+
+    def _layer_touched(self):
+        return dict(self._query('SELECT session, MAX(touched) FROM layer_wells GROUP BY session'))
+
+    def expire_layers(self, max_age):
+        stale = 'SELECT session FROM layer_wells GROUP BY session HAVING MAX(touched) < ?'
+        with self._lock, self._connect() as conn:
+            # one transaction, so a worker's edit can't land between finding and dropping a layer
+            conn.execute('BEGIN IMMEDIATE')
+            cutoff = time.time() - max_age
+            expired = [row[0] for row in conn.execute(stale, (cutoff,))]
+            conn.execute('DELETE FROM layer_picks WHERE session IN ({})'.format(stale), (cutoff,))
+            conn.execute('DELETE FROM layer_wells WHERE session IN ({})'.format(stale), (cutoff,))
+            return expired
+
+    def _layer_commit(self, session, overwrite=False):
+        with self._lock, self._connect() as conn:
+            # take the write lock before checking, so no other worker commits in between
+            conn.execute('BEGIN IMMEDIATE')
+            wells = conn.execute('SELECT l.uwi, l.base_version, COALESCE(v.version, 0) FROM layer_wells l '
+                                 'LEFT JOIN versions v ON l.uwi = v.uwi WHERE l.session = ?',
+                                 (session,)).fetchall()
+            conflicts = [uwi for uwi, base, version in wells if version != base]
+            if conflicts and not overwrite:
+                raise PickConflict(conflicts)
+            if not wells:
+                return self.version
+            conn.execute('INSERT OR REPLACE INTO picks (uwi, pick, md, confidence, quality) '
+                         'SELECT uwi, pick, md, confidence, quality FROM layer_picks '
+                         'WHERE session = ? AND NOT deleted', (session,))
+            conn.execute('DELETE FROM picks WHERE (uwi, pick) IN (SELECT uwi, pick FROM layer_picks '
+                         'WHERE session = ? AND deleted)', (session,))
+            conn.execute('DELETE FROM layer_picks WHERE session = ?', (session,))
+            conn.execute('DELETE FROM layer_wells WHERE session = ?', (session,))
+            return self._bump(conn, *[uwi for uwi, _, _ in wells])
+
+
+class PickLayer(PickStore):
+    """
+    One session's copy-on-write view of a pick store, with the same
+    interface. Reads come from the store except for the wells the session
+    changed; writes only go to the session's layer until commit().
+
+    Versions of a well the session hasn't changed are the store's, so
+    sessions share everything cached by version (cross-section panels,
+    DTW alignments) until they diverge.
+
+    Args:
+        store (PickStore): the shared picks.
+        session (str): the session id.
+    """
+    def __init__(self, store, session):
+        self.store = store
+        self.session = session
+
+    def _version(self, base, edit):
+        return base if edit is None else '{}:{}:{}'.format(base, self.session, edit)
+
+    @property
+    def version(self):
+        edits = [edit for _, edit in self.store._layer_wells(self.session).values()]
+        return self._version(self.store.version, max(edits) if edits else None)
+
+    @property
+    def modified(self):
+        return self.store.modified
+
+    def well_version(self, uwi):
+        _, edit = self.store._layer_wells(self.session).get(uwi, (None, None))
+        return self._version(self.store.well_version(uwi), edit)
+
+    def well_versions(self):
+        return {uwi: self.well_version(uwi) for uwi in self.uwis()}
+
+    def changed(self):
+        """
+        UWIs of the wells changed in this session and not committed yet.
+        """
+        return list(self.store._layer_wells(self.session))
+
+    def _merged(self, uwi, df):
+        picks = self.store._layer_picks(self.session, uwi)
+        rows = [row for row in df.itertuples(index=False) if row.PICK not in picks]
+        rows += [(uwi, pick) + values for pick, values in picks.items() if values is not None]
+        return _to_df(rows).sort_values('MD', kind='stable').reset_index(drop=True)
+
+    def get_well(self, uwi):
+        df = self.store.get_well(uwi)
+        if uwi not in self.store._layer_wells(self.session):
+            return df
+        return self._merged(uwi, df)
+
+    def to_df(self):
+        df = self.store.to_df()
+        changed = self.changed()
+        if not changed:
+            return df
+        wells = [self._merged(uwi, df[df['UWI'] == uwi]) for uwi in changed]
+        df = pd.concat([df[~df['UWI'].isin(changed)]] + wells, ignore_index=True)
+        return df.sort_values(['UWI', 'MD'], kind='stable').reset_index(drop=True)
+
+    def __len__(self):
+        return len(self.to_df())
+
+    def table(self):
+        if not self.changed():
+            return self.store.table()
+        return super().table()
+
+    def uwis(self):
+        return list(dict.fromkeys(self.store.uwis() + self.changed()))
+
+    def pick_names(self):
+        return self.store.pick_names()
+
+    def pick_ids(self):
+        return self.store.pick_ids()
+
+    def set_pick_ids(self, pick_ids):
+        # the stratigraphic column is shared, not per session
+        self.store.set_pick_ids(pick_ids)
+
+    def set(self, uwi, pick, md, confidence=None, quality=None):
+        self.store._layer_write(self.session, [(uwi, pick, (float(md), _float(confidence), _float(quality)))])
+        return self.version
+
+    def update_df(self, df):
+        rows = zip(df['UWI'], df['PICK'], _column(df, 'MD', np.nan),
+                   _column(df, 'CONFIDENCE'), _column(df, 'QUALITY'))
+        self.store._layer_write(self.session, [(uwi, pick, tuple(values)) for uwi, pick, *values in rows])
+        return self.version
+
+    def delete(self, uwi, pick):
+        self.store._layer_write(self.session, [(uwi, pick, None)])
+        return self.version
+
+    def commit(self, overwrite=False):
+        """
+        Writes the session's picks to the store, as one new store version.
+        Raises PickConflict if another session changed one of the wells
+        since this session first edited it, unless overwrite.
+        """
+        return self.store._layer_commit(self.session, overwrite)
+
+    def discard(self):
+        """
+        Drops the session's changes.
+        """
+        self.store._layer_drop(self.session)
+
+
+class JournalPickStore(PickStore):
+    """
+    In-memory pick store made durable by an append-only journal.
+
+    Every edit (picks, pick ids, session layers and commits) is appended to
+    path as one JSON line and flushed, so saving costs O(edit) instead of
+    rewriting all picks. Every compact_every edits the whole state is
+    written to a snapshot (path + '.snapshot') and the journal starts over.
+    Opening the store loads the snapshot and replays the journal after it,
+    which restores the exact state, versions included. A torn last line
+    from a crash is dropped.
+
+    The journal belongs to one process: to share picks between gunicorn
+    workers use SQLitePickStore, whose WAL journals each edit the same way.
+    The store takes an exclusive lock on the journal, so opening it from a
+    second process fails, and so does an edit from a process forked after
+    it was opened (e.g. gunicorn --preload workers).
+
+    Args:
+        path (str): the journal file.
+        compact_every (int): edits between snapshots, 0 to only compact
+            when compact() is called.
+        fsync (bool): also fsync each edit, so it survives a power cut and
+            not just a crash of the process.
+    """
+    def __init__(self, path, compact_every=10000, fsync=False):
+        super().__init__()
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self._seq = 0  # number of the last journal entry
+        self._entries = 0  # entries since the snapshot
+        self._journal = open(self.path, 'a')
+        try:
+            fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._journal.close()
+            raise RuntimeError('{} is in use by another process: use SQLitePickStore to share '
+                               'picks between processes'.format(path))
+        self._pid = os.getpid()
+        self._replaying = True
+        self._restore()
+        self._replaying = False
+
+    # each edit runs as usual, then is journaled
+
+    def update_df(self, df):
+        rows = list(zip(df['UWI'], df['PICK'], _column(df, 'MD'), _column(df, 'CONFIDENCE'), _column(df, 'QUALITY')))
+        with self._lock:
+            version = super().update_df(df)
+            self._append('put', rows=rows)
+            return version
+
+    def set(self, uwi, pick, md, confidence=None, quality=None):
+        with self._lock:
+            version = super().set(uwi, pick, md, confidence, quality)
+            self._append('put', rows=[(uwi, pick, _float(md), _float(confidence), _float(quality))])
+            return version
+
+    def delete(self, uwi, pick):
+        with self._lock:
+            before = self.version
+            version = super().delete(uwi, pick)
+            if version != before:
+                self._append('del', uwi=uwi, pick=pick)
+            return version
+
+    def set_pick_ids(self, pick_ids):
+        with self._lock:
+            super().set_pick_ids(pick_ids)
+            self._append('ids', ids={pick: int(pickid) for pick, pickid in pick_ids.items()})
+
+    def _layer_write(self, session, rows):
+        rows = list(rows)
+        with self._lock:
+            super()._layer_write(session, rows)
+            self._append('layer', session=session, rows=rows, touched=self._layers[session]['touched'])
+
+    def _layer_drop(self, session):
+        with self._lock:
+            super()._layer_drop(session)
+            self._append('drop', session=session)
+
+    def _layer_commit(self, session, overwrite=False):
+        with self._lock:
+            version = super()._layer_commit(session, overwrite)
+            # only commits that went through are journaled, so replay can't conflict
+            self._append('commit', session=session)
+            return version
+
+    def _append(self, op, **entry):
+        if self._replaying:
+            return
+        self._check_owner()
+        self._seq += 1
+        entry.update(op=op, n=self._seq, t=self.modified)
+        self._journal.write(json.dumps(entry) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._entries += 1
+        if self.compact_every and self._entries >= self.compact_every:
+            self.compact()
+
+    def _check_owner(self):
+        if os.getpid() != self._pid:
+            # a forked copy of the store would write over the other processes' edits
+            raise RuntimeError('{} belongs to process {}: use SQLitePickStore to share '
+                               'picks between processes'.format(self.path, self._pid))
+
+    def _apply(self, entry):
+        op = entry['op']
+        if op == 'put' and len(entry['rows']) == 1:  # a click: skip the DataFrame
+            uwi, pick, md, confidence, quality = entry['rows'][0]
+            self.set(uwi, pick, np.nan if md is None else md, confidence, quality)
+        elif op == 'put':
+            self.update_df(pd.DataFrame(entry['rows'], columns=COLUMNS))
+        elif op == 'del':
+            self.delete(entry['uwi'], entry['pick'])
+        elif op == 'ids':
+            self.set_pick_ids(entry['ids'])
+        elif op == 'layer':
+            self._layer_write(entry['session'], [(uwi, pick, None if values is None else tuple(values))
+                                                 for uwi, pick, values in entry['rows']])
+            self._layers[entry['session']]['touched'] = entry.get('touched', entry['t'])
+        elif op == 'drop':
+            self._layer_drop(entry['session'])
+        elif op == 'commit':
+            self._layer_commit(entry['session'], overwrite=True)
+        self.modified = entry['t']
+
+    def compact(self):
+        """
+        Writes the whole state to the snapshot and empties the journal.
+        """
+        self._check_owner()
+        with self._lock:
+            state = {'n': self._seq, 'version': self.version, 'modified': self.modified,
+                     # by column, which parses much faster than a list per pick
+                     'picks': dict(zip(COLUMNS, map(list, zip(*[(uwi, pick) + values
+                                                                 for uwi, picks in self._wells.items()
+                                                                 for pick, values in picks.items()])))),
+                     'names': list(self._names.items()),
+                     'versions': self._versions,
+                     'edit': self._edit,
+                     'layers': {session: {'wells': layer['wells'], 'base': layer['base'], 'edits': layer['edits'],
+                                          'touched': layer.get('touched', self.modified)}
+                                for session, layer in self._layers.items()}}
+            # write then rename, so there is always one whole snapshot
+            tmp = '{}.tmp{}'.format(self.snapshot_path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.snapshot_path)
+            # a crash before this truncation is harmless: entries up to n are skipped on replay
+            # (truncated in place, closing the file would drop the lock)
+            self._journal.truncate(0)
+            self._entries = 0
+
+    def _restore(self):
+        n = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                state = json.load(f)
+            n = self._seq = state['n']
+            columns = [state['picks'].get(column, []) for column in COLUMNS]
+            for uwi, pick, *values in zip(*columns):
+                self._wells.setdefault(uwi, {})[pick] = tuple(values)
+            self._names = dict(state['names'])
+            self._versions = state['versions']
+            self._layers = {session: {'wells': {uwi: {pick: None if values is None else tuple(values)
+                                                      for pick, values in picks.items()}
+                                                for uwi, picks in layer['wells'].items()},
+                                      'base': layer['base'], 'edits': layer['edits'],
+                                      'touched': layer.get('touched', state['modified'])}
+                            for session, layer in state['layers'].items()}
+            # snapshots from before the edit count was kept counted edits per session
+            self._edit = state.get('edit', max([max(layer['edits'].values(), default=0)
+                                                for layer in self._layers.values()], default=0))
+            self.version, self.modified = state['version'], state['modified']
+        if not os.path.exists(self.path):
+            return
+
+        good = 0  # bytes of whole entries
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn write at the end of the journal
+                good += len(line)
+                self._entries += 1
+                if entry['n'] > n:
+                    self._apply(entry)
+                    self._seq = entry['n']
+        if good < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good)
+
+
+def open_store(path=None):
+    """
+    Returns an in-memory PickStore if path is None, a JournalPickStore for
+    a .jsonl journal, else an SQLitePickStore.
+    """
+    if path is None:
+        return PickStore()
+    if str(path).endswith('.jsonl'):
+        return JournalPickStore(path)
+    return SQLitePickStore(path)
@@ -0,0 +1,123 @@
+"""
+Background rendering with a coalescing job queue.
+
+Renders run on a small thread pool instead of inside the Dash callback or
+the Flask request. There is at most one job per key (e.g. per list of
+section wells): asking again while the key is being rendered doesn't queue
+another job, the running job just goes round once more if the picks changed
+while it was drawing. So a burst of pick edits costs one extra render, not
+one per click, and the last good image is served until the new one is done.
+The render threads are started on the first job, and again in a process
+forked after that (e.g. a gunicorn worker), which doesn't have the parent's.
+"""
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+
+from lru import LRUCache
+
+
+class RenderQueue:
+    """
+    Renders images in the background and keeps the last good one per key.
+
+    Args:
+        render (callable): render(key) returns the image bytes for key.
+        version (callable): version(key) returns the current version of
+            the inputs of key (e.g. the pick store version). An image is up
+            to date when it was rendered at the current version.
+        workers (int): render threads.
+        max_bytes (int): memory budget for the finished images.
+    """
+    def __init__(self, render, version, workers=1, max_bytes=64 * 2**20):
+        self.render = render
+        self.version = version
+        self.images = LRUCache(max_bytes, sizeof=lambda image: len(image[1]))
+        self.renders = 0
+        self.coalesced = 0
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._pid_lock = Lock()
+        self._running = set()
+        self._cond = Condition()
+
+    def _check_pid(self):
+        """
+        Starts over in a forked process: the parent's render threads don't
+        exist here, so its executor would never run a job and its running
+        keys would never finish.
+        """
+        if self._pid == os.getpid():
+            return
+        with self._pid_lock:
+            if self._pid != os.getpid():
+                self._cond = Condition()
+                self._running = set()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='render')
+                self._pid = os.getpid()
+
+    def latest(self, key):
+        """
+        The last good image of key as (version, bytes, time rendered), or None.
+        """
+        return self.images.get(key)
+
+    def ready(self, key):
+        """
+        True if the image of key is up to date.
+        """
+        image = self.images.get(key)
+        return image is not None and image[0] == self.version(key)
+
+    def submit(self, key):
+        """
+        Asks for key to be rendered at the current version, without waiting.
+        Does nothing if the image is up to date or a render of key is running.
+        """
+        self._check_pid()
+        with self._cond:
+            if key in self._running:
+                self.coalesced += 1
+                return
+            if self.ready(key):
+                return
+            self._running.add(key)
+        self._executor.submit(self._run, key)
+
+    def wait(self, key, timeout=None):
+        """
+        Blocks until key has an image (rendering it if needed) and returns
+        latest(key), or None after timeout seconds.
+        """
+        self.submit(key)
+        with self._cond:
+            self._cond.wait_for(lambda: key in self.images or key not in self._running, timeout)
+        return self.latest(key)
+
+    def _run(self, key):
+        try:
+            while True:
+                version = self.version(key)
+                # the render sees at least this version, so the image is tagged with it
+                self.images.put(key, (version, self.render(key), time.time()))
+                self.renders += 1
+                with self._cond:
+                    self._cond.notify_all()
+                if self.version(key) == version:
+                    break
+                # picks changed while drawing: one more go picks up all of them
+        except Exception:
+            print('Could not render', key)
+            traceback.print_exc()
+        finally:
+            with self._cond:
+                self._running.discard(key)
+                self._cond.notify_all()
+
+    def stats(self):
+        stats = self.images.stats()
+        stats.update(renders=self.renders, coalesced=self.coalesced, running=len(self._running))
+        return stats
@@ -0,0 +1,105 @@
+"""
+Resampling of well curves onto a new depth basis.
+
+Curve.to_basis() returns a new curve, but make_log_plot used to write the
+result back into w.data, which degraded the shared Project for every later
+request. Here the original curves are never touched: resampled copies are
+made with vectorized linear interpolation and cached per (well, curve,
+step). All the curves of a well that share a basis are resampled in one
+batch, finding the interpolation indices and weights once.
+"""
+import numpy as np
+from welly import Curve
+
+from lru import LRUCache
+
+
+# resampled curves, 128 MB
+resampled = LRUCache(128 * 2**20)
+
+
+def make_basis(top, base, step):
+    """
+    Regular basis from top to base (inclusive, if it falls on a step).
+    """
+    n = int(np.floor((base - top) / step + 1e-9)) + 1
+    return top + step * np.arange(n)
+
+
+def interp_weights(depth, new_depth):
+    """
+    Indices and weights to linearly interpolate samples at depth onto
+    new_depth. Points outside depth get index -1.
+    """
+    i = np.searchsorted(depth, new_depth, side='right')
+    i = np.clip(i, 1, len(depth) - 1)
+    d0, d1 = depth[i - 1], depth[i]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(d1 > d0, (new_depth - d0) / (d1 - d0), 0.0)
+    outside = (new_depth < depth[0]) | (new_depth > depth[-1])
+    i[outside] = -1
+    return i, t
+
+
+def interpolate(values, i, t):
+    """
+    Applies interp_weights to values, 1D (samples) or 2D (samples x curves).
+    A null on either side of a new sample gives a null, so gaps are not
+    bridged, and samples outside the original basis are null too.
+    """
+    values = np.asarray(values, dtype=float)
+    idx = np.where(i < 0, 1, i)
+    if values.ndim == 2:
+        t = t[:, None]
+    out = values[idx - 1] * (1 - t) + values[idx] * t
+    out[i < 0] = np.nan
+    return out
+
+
+def resample_arrays(depth, values, new_depth):
+    """
+    Resamples one curve (or a 2D stack of curves on the same depth).
+    """
+    i, t = interp_weights(np.asarray(depth, dtype=float), new_depth)
+    return interpolate(values, i, t)
+
+
+def basis_key(c):
+    return (float(c.start), float(c.step), len(c))
+
+
+def resample_curves(w, mnemonics, step, basis=None):
+    """
+    Returns {mnemonic: resampled Curve} for curves of well w.
+
+    Curves are resampled onto basis, or onto a common basis with the given
+    step spanning all of them. Results are cached; the curves in w.data are
+    left as they are.
+    """
+    curves = {m: w.data[m] for m in mnemonics}
+    if basis is None:
+        top = min(c.start for c in curves.values())
+        base = max(c.stop for c in curves.values())
+        basis = make_basis(top, base, step)
+    basis_id = (float(basis[0]), float(basis[-1]), len(basis))
+
+    result, todo = {}, {}
+    for m, c in curves.items():
+        key = (w.uwi, m, basis_key(c), basis_id)
+        cached = resampled.get(key)
+        if cached is not None:
+            result[m] = cached
+        else:
+            # group the curves to do by their original basis
+            todo.setdefault(basis_key(c), []).append(m)
+
+    for group in todo.values():
+        c0 = curves[group[0]]
+        stack = np.column_stack([np.asarray(curves[m], dtype=float) for m in group])
+        new_values = resample_arrays(c0.basis, stack, basis)
+        for j, m in enumerate(group):
+            c = curves[m]
+            params = {k: v for k, v in vars(c).items() if k not in ('start', 'step')}
+            new = Curve(new_values[:, j], basis=basis, params=params)
+            result[m] = resampled.put((w.uwi, m, basis_key(c), basis_id), new)
+    return result
@@ -0,0 +1,203 @@
+"""
+Spatial index over well surface locations.
+
+Well locations (latitude, longitude) are projected to kilometres on a
+plane tangent at the middle of the field, which is plenty accurate at the
+scale of a field, and bucketed into a uniform grid: the wells are sorted
+by grid cell so the wells of a row of cells are one slice, found by binary
+search. Queries only look at the cells around the query, so nearest,
+radius, polygon and section line queries don't scan every well.
+"""
+import numpy as np
+import pandas as pd
+
+
+EARTH_RADIUS = 6371.0  # km
+
+
+def parse_degrees(value):
+    """
+    Decimal degrees from a number or a D/M/S string as found in LAS headers,
+    e.g. '-13/41/53.98'. NaN if there is no location.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        parts = [float(v) for v in str(value).strip().split('/')]
+    except ValueError:
+        return np.nan
+    if not 1 <= len(parts) <= 3:
+        return np.nan
+    sign = -1 if str(value).strip().startswith('-') else 1
+    return sign * sum(abs(v) / 60**i for i, v in enumerate(parts))
+
+
+def point_in_polygon(x, y, px, py):
+    """
+    Even-odd rule test of points (x, y) against the polygon (px, py),
+    vectorized over the points.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    inside = np.zeros(x.shape, dtype=bool)
+    for x0, y0, x1, y1 in zip(px, py, np.roll(px, -1), np.roll(py, -1)):
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+        inside ^= crosses & (x < x_cross)
+    return inside
+
+
+class WellIndex:
+    """
+    Grid index of well locations.
+
+    Args:
+        uwis (list): well identifiers.
+        lat, lon (array): locations in degrees (see parse_degrees);
+            wells with a missing location are left out.
+        cell (float): grid cell size in km, by default about one well per cell.
+    """
+    def __init__(self, uwis, lat, lon, cell=None):
+        lat = np.array([parse_degrees(v) for v in lat])
+        lon = np.array([parse_degrees(v) for v in lon])
+        ok = np.isfinite(lat) & np.isfinite(lon)
+        self.uwis = np.asarray(uwis, dtype=object)[ok]
+        self.lat, self.lon = lat[ok], lon[ok]
+        self.lat0 = float(np.mean(self.lat)) if ok.any() else 0.0
+        self.lon0 = float(np.mean(self.lon)) if ok.any() else 0.0
+        self.x, self.y = self.to_xy(self.lat, self.lon)
+
+        n = len(self.uwis)
+        if n:
+            self.x0, self.y0 = self.x.min(), self.y.min()
+            area = max(np.ptp(self.x) * np.ptp(self.y), 1e-6)
+            self.cell = float(cell or max(np.sqrt(area / n), 1e-3))
+        else:
+            self.x0 = self.y0 = 0.0
+            self.cell = float(cell or 1.0)
+        ix, iy = self._cells(self.x, self.y)
+        self.ny = int(iy.max()) + 1 if n else 1
+        keys = ix * self.ny + iy
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    @classmethod
+    def from_project(cls, p, **kwargs):
+        return cls([w.uwi for w in p],
+                   [getattr(w.location, 'latitude', None) for w in p],
+                   [getattr(w.location, 'longitude', None) for w in p], **kwargs)
+
+    @classmethod
+    def from_table(cls, df, **kwargs):
+        """
+        From a table with UWI, LATITUDE and LONGITUDE (bulk_tops.read_wells).
+        """
+        return cls(df['UWI'], df['LATITUDE'], df['LONGITUDE'], **kwargs)
+
+    def __len__(self):
+        return len(self.uwis)
+
+    def to_xy(self, lat, lon):
+        """
+        Projects degrees to km east and north of the middle of the field.
+        """
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        x = np.radians(lon - self.lon0) * EARTH_RADIUS * np.cos(np.radians(self.lat0))
+        y = np.radians(lat - self.lat0) * EARTH_RADIUS
+        return x, y
+
+    def _cells(self, x, y):
+        ix = np.floor((np.asarray(x) - self.x0) / self.cell).astype(np.int64)
+        iy = np.floor((np.asarray(y) - self.y0) / self.cell).astype(np.int64)
+        return ix, iy
+
+    def _box(self, xmin, xmax, ymin, ymax):
+        """
+        Indices of the wells in the grid cells overlapping a box (in km).
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        (ix0, ix1), (iy0, iy1) = self._cells([xmin, xmax], [ymin, ymax])
+        ix0, iy0 = max(ix0, 0), max(iy0, 0)
+        ix1, iy1 = min(ix1, self.keys[-1] // self.ny), min(iy1, self.ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            return np.zeros(0, dtype=np.int64)
+        # each column of cells is one contiguous run of keys
+        columns = np.arange(ix0, ix1 + 1) * self.ny
+        starts = np.searchsorted(self.keys, columns + iy0, side='left')
+        stops = np.searchsorted(self.keys, columns + iy1, side='right')
+        return np.concatenate([self.order[a:b] for a, b in zip(starts, stops)])
+
+    def _result(self, idx, distance):
+        order = np.argsort(distance, kind='stable')
+        return pd.DataFrame({'UWI': self.uwis[idx][order], 'DISTANCE': distance[order]})
+
+    def radius(self, lat, lon, r):
+        """
+        Wells within r km of a point, nearest first, as a DataFrame (UWI, DISTANCE).
+        """
+        x, y = self.to_xy(lat, lon)
+        idx = self._box(x - r, x + r, y - r, y + r)
+        d = np.hypot(self.x[idx] - x, self.y[idx] - y)
+        keep = d <= r
+        return self._result(idx[keep], d[keep])
+
+    def nearest(self, lat, lon, k=1):
+        """
+        The k wells nearest to a point, as a DataFrame (UWI, DISTANCE).
+        """
+        k = min(k, len(self))
+        x, y = self.to_xy(lat, lon)
+        # no well is further than the far corner of the field
+        farthest = np.hypot(max(abs(x - self.x.min()), abs(x - self.x.max())),
+                            max(abs(y - self.y.min()), abs(y - self.y.max()))) if k else 0
+        r = self.cell
+        while True:
+            # everything within r is found, so the k nearest are final once k are inside r
+            found = self.radius(lat, lon, min(r, farthest))
+            if len(found) >= k or r >= farthest:
+                return found.iloc[:k].reset_index(drop=True)
+            r *= 2
+
+    def polygon(self, lats, lons):
+        """
+        UWIs of the wells inside a polygon given by its vertices.
+        """
+        px, py = self.to_xy(lats, lons)
+        idx = self._box(px.min(), px.max(), py.min(), py.max())
+        inside = point_in_polygon(self.x[idx], self.y[idx], px, py)
+        return list(self.uwis[np.sort(idx[inside])])
+
+    def along_line(self, lats, lons, width):
+        """
+        Wells within width km of a section line (a polyline given by its
+        vertices), ordered along the line.
+
+        Returns:
+            DataFrame: UWI, ALONG (km from the start of the line, of the
+            nearest point of the line) and OFFSET (km from the line).
+        """
+        px, py = self.to_xy(lats, lons)
+        idx = self._box(px.min() - width, px.max() + width, py.min() - width, py.max() + width)
+        x, y = self.x[idx][:, None], self.y[idx][:, None]
+
+        # distance of every candidate to every segment, vectorized
+        x0, y0, x1, y1 = px[:-1], py[:-1], px[1:], py[1:]
+        dx, dy = x1 - x0, y1 - y0
+        length = np.hypot(dx, dy)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.clip(((x - x0) * dx + (y - y0) * dy) / length**2, 0, 1)
+        t = np.nan_to_num(t)
+        offset = np.hypot(x - (x0 + t * dx), y - (y0 + t * dy))
+        along = np.concatenate([[0], np.cumsum(length)[:-1]]) + t * length
+
+        seg = np.argmin(offset, axis=1)
+        rows = np.arange(len(idx))
+        offset, along = offset[rows, seg], along[rows, seg]
+        keep = offset <= width
+        order = np.argsort(along[keep], kind='stable')
+        return pd.DataFrame({'UWI': self.uwis[idx][keep][order],
+                             'ALONG': along[keep][order],
+                             'OFFSET': offset[keep][order]})
@@ -0,0 +1,32 @@
+import pytest
+
+import pick_store
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'journal'])
+def store(request, tmp_path):
+    path = {'memory': None, 'sqlite': tmp_path / 'picks.sqlite', 'journal': tmp_path / 'picks.jsonl'}
+    store = pick_store.open_store(None if request.param == 'memory' else str(path[request.param]))
+    store.set('w1', 'Top A', 100)
+    return store
+
+
+def test_layer_version_changes_after_discard(store):
+    layer = store.layer('s1')
+    layer.set('w1', 'Top A', 110)
+    seen = {layer.version, layer.well_version('w1')}
+    layer.discard()
+    layer.set('w1', 'Top A', 120)
+    assert layer.version not in seen
+    assert layer.well_version('w1') not in seen
+    assert layer.get_well('w1')['MD'].tolist() == [120]
+
+
+def test_layer_version_changes_after_commit(store):
+    layer = store.layer('s1')
+    layer.set('w1', 'Top A', 110)
+    seen = {layer.well_version('w1')}
+    layer.commit()
+    seen.add(layer.well_version('w1'))
+    layer.set('w1', 'Top A', 120)
+    assert layer.well_version('w1') not in seen
@@ -0,0 +1,177 @@
+"""
+Conversions between tops tables (DataFrames of UWI, PICK, MD) and the
+tops striplogs attached to wells, without going through CSV text.
+
+The app used to write each well's picks to a CSV string row by row and
+parse it back with Striplog.from_csv, and to walk every interval of every
+striplog to build the tops table. Here the depths and names are taken and
+given as arrays: tops are sorted with NumPy, each base is the next top
+(like Striplog.from_csv), and the tops table of a project is built from
+per-well arrays in one concatenation.
+"""
+import numpy as np
+import pandas as pd
+from striplog import Component, Interval, Striplog
+
+
+def tops_to_arrays(striplog, field='formation'):
+    """
+    Returns (depths, names) arrays from a tops striplog.
+    """
+    if striplog is None:
+        return np.zeros(0), []
+    depths = np.array([iv.top.z for iv in striplog], dtype=float)
+    names = [iv.components[0][field] if iv.components else '' for iv in striplog]
+    return depths, names
+
+
+def striplog_from_tops(depths, names, field='formation'):
+    """
+    Builds a tops striplog straight from depth and name arrays, the same
+    way Striplog.from_csv does it (each base is the next top).
+    """
+    order = np.argsort(depths, kind='stable')
+    depths = np.asarray(depths, dtype=float)[order]
+    names = [names[i] for i in order]
+    bases = np.append(depths[1:], depths[-1] + 1) if len(depths) else depths
+    intervals = [Interval(top=float(top), base=float(base),
+                          components=[Component({field: name})])
+                 for top, base, name in zip(depths.tolist(), bases.tolist(), names)]
+    return Striplog(intervals) if intervals else None
+
+
+def striplog_from_df(df, field='formation'):
+    """
+    Tops striplog of one well's picks (a DataFrame with PICK and MD).
+    Picks without a depth are left out. None if there are no picks.
+    """
+    df = df[df['MD'].notna()]
+    return striplog_from_tops(df['MD'].to_numpy(dtype=float), df['PICK'].tolist(), field)
+
+
+def striplogs_from_df(df, field='formation'):
+    """
+    {uwi: tops striplog} for every well in a tops table.
+    """
+    df = df[df['MD'].notna()]
+    return {uwi: striplog_from_tops(group['MD'].to_numpy(dtype=float), group['PICK'].tolist(), field)
+            for uwi, group in df.groupby('UWI', sort=False)}
+
+
+def project_tops_df(p, tops_field='tops', field='formation'):
+    """
+    Tops table (UWI, PICK, MD) of every well in a Project, in well order.
+    """
+    uwis, names, depths = [], [], []
+    for w in p:
+        d, n = tops_to_arrays(w.data.get(tops_field), field)
+        uwis.append(np.full(len(d), w.uwi, dtype=object))
+        names.extend(n)
+        depths.append(d)
+    if not depths:
+        return pd.DataFrame(columns=['UWI', 'PICK', 'MD'])
+    return pd.DataFrame({'UWI': np.concatenate(uwis),
+                         'PICK': np.array(names, dtype=object),
+                         'MD': np.concatenate(depths)})
+
+
+class TopsTable:
+    """
+    Compact, read-only table of picks in one NumPy structured array.
+
+    UWIs and pick names are interned: each row stores their integer codes,
+    with the depth, quality and confidence, about 24 bytes per pick instead
+    of a DataFrame row of Python objects or an Interval per pick. Rows are
+    sorted by well and depth, with offsets marking where each well starts,
+    so a well's picks are a slice (a view, no copy) and a depth range in a
+    well is a binary search.
+
+    Args:
+        df (DataFrame): UWI, PICK and MD, optionally QUALITY and CONFIDENCE.
+    """
+    dtype = np.dtype([('uwi', np.int32), ('pick', np.int32), ('md', np.float64),
+                      ('quality', np.float32), ('confidence', np.float32)])
+
+    def __init__(self, df):
+        uwi_codes, self.uwis = pd.factorize(df['UWI'], sort=True)
+        pick_codes, self.names = pd.factorize(df['PICK'])
+        self.uwis, self.names = list(self.uwis), list(self.names)
+        self.uwi_codes = {uwi: i for i, uwi in enumerate(self.uwis)}
+        self.name_codes = {name: i for i, name in enumerate(self.names)}
+
+        data = np.empty(len(df), dtype=self.dtype)
+        data['uwi'] = uwi_codes
+        data['pick'] = pick_codes
+        data['md'] = pd.to_numeric(df['MD'], errors='coerce')
+        for column in ('quality', 'confidence'):
+            data[column] = pd.to_numeric(df[column.upper()], errors='coerce') if column.upper() in df else np.nan
+        # by well, then depth, picks without a depth last
+        self.data = data[np.lexsort((data['md'], data['uwi']))]
+        self.offsets = np.searchsorted(self.data['uwi'], np.arange(len(self.uwis) + 1))
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.offsets.nbytes
+
+    def well(self, uwi):
+        """
+        The rows of one well, by depth: a view of the table.
+        """
+        i = self.uwi_codes.get(uwi)
+        if i is None:
+            return self.data[:0]
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def depth_range(self, uwi, top=-np.inf, base=np.inf):
+        """
+        The rows of one well with top <= MD <= base.
+        """
+        rows = self.well(uwi)
+        i0 = np.searchsorted(rows['md'], top, side='left')
+        i1 = np.searchsorted(rows['md'], base, side='right')
+        return rows[i0:i1]
+
+    def md(self, uwi, pick):
+        """
+        Depth of a pick in a well, NaN if the well doesn't have it.
+        """
+        rows = self.well(uwi)
+        code = self.name_codes.get(pick, -1)
+        hit = rows['md'][rows['pick'] == code]
+        return float(hit[0]) if len(hit) else np.nan
+
+    def with_pick(self, pick):
+        """
+        Rows of every well for one pick name.
+        """
+        return self.data[self.data['pick'] == self.name_codes.get(pick, -1)]
+
+    def well_picks(self, uwi):
+        """
+        {pick: md} of one well, picks with a depth only.
+        """
+        rows = self.well(uwi)
+        rows = rows[~np.isnan(rows['md'])]
+        return dict(zip([self.names[c] for c in rows['pick']], rows['md'].tolist()))
+
+    def to_df(self, rows=None):
+        """
+        Rows (default the whole table) as a DataFrame like the pick store's.
+        """
+        rows = self.data if rows is None else rows
+        return pd.DataFrame({'UWI': np.array(self.uwis, dtype=object)[rows['uwi']],
+                             'PICK': np.array(self.names, dtype=object)[rows['pick']],
+                             'MD': rows['md'],
+                             'CONFIDENCE': rows['confidence'].astype(float),
+                             'QUALITY': rows['quality'].astype(float)})
+
+    def striplog(self, uwi, field='formation'):
+        """
+        Tops striplog of one well.
+        """
+        rows = self.well(uwi)
+        rows = rows[~np.isnan(rows['md'])]
+        return striplog_from_tops(rows['md'], [self.names[c] for c in rows['pick']], field)
@@ -0,0 +1,217 @@
+"""
+Persistent on-disk cache of parsed wells.
+
+Parsing ASCII LAS files is by far the slowest part of starting the app, and
+every gunicorn worker used to do it again. Here each well is parsed once and
+written to its own directory in the cache:
+
+    <cache_dir>/<stem>-<hash>/
+        meta.json      header, location, curve params, curve statistics
+                       (curve_stats.py), tops and source keys
+        <MNEMONIC>.npy one float array per curve
+
+A well is re-parsed only when its LAS or tops file changed (path, mtime
+and size are stored as the key).
+
+Curves can be loaded as read-only memory maps of the .npy files: the pages
+live in the OS page cache, shared by every process that maps them.
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+from striplog import Striplog
+from welly import Curve, Well
+from welly.header import Header
+from welly.location import Location
+
+import curve_stats
+from tops import striplog_from_tops, tops_to_arrays
+
+
+CACHE_DIR = 'data/.cache'
+CACHE_VERSION = 1
+
+
+def file_key(fname):
+    """
+    Returns the cache key for a file: absolute path, mtime and size.
+    """
+    if fname is None:
+        return None
+    st = os.stat(fname)
+    return {'path': os.path.abspath(fname), 'mtime': st.st_mtime_ns, 'size': st.st_size}
+
+
+def well_cache_dir(lasfile, cache_dir=CACHE_DIR):
+    """
+    Directory holding the cached copy of a LAS file. The hash of the full
+    path keeps wells with the same file name in different folders apart.
+    """
+    digest = hashlib.sha1(os.path.abspath(lasfile).encode()).hexdigest()[:10]
+    return Path(cache_dir) / '{}-{}'.format(Path(lasfile).stem, digest)
+
+
+def _jsonable(v):
+    """
+    Converts numpy scalars so curve params can go into meta.json.
+    """
+    if isinstance(v, np.generic):
+        return v.item()
+    if isinstance(v, (str, int, float, bool)) or v is None:
+        return v
+    return str(v)
+
+
+def to_payload(w):
+    """
+    Returns a well as plain arrays and dicts: header, location, curves as
+    {mnemonic: (values, params)} and tops as depth/name lists. Unlike a
+    Well this pickles cleanly (Curve loses its params when pickled), so it
+    is also what worker processes send back.
+    """
+    curves = {}
+    for mnemonic, curve in w.data.items():
+        if isinstance(curve, Curve):
+            params = {k: _jsonable(v) for k, v in vars(curve).items()}
+            curves[mnemonic] = (np.asarray(curve, dtype=np.float64), params)
+
+    tops = None
+    if isinstance(w.data.get('tops'), Striplog):
+        depths, names = tops_to_arrays(w.data['tops'])
+        tops = {'depths': depths.tolist(), 'names': names}
+
+    location = {k: _jsonable(v) for k, v in vars(w.location).items()
+                if k not in ('crs', 'position', 'deviation')}
+    return {'header': {k: _jsonable(v) for k, v in vars(w.header).items()},
+            'location': location,
+            'curves': curves,
+            'tops': tops}
+
+
+def from_payload(payload, fname=None):
+    """
+    Rebuilds a welly Well from to_payload() output.
+    """
+    data = {m: Curve(values, params=params) for m, (values, params) in payload['curves'].items()}
+    if payload['tops'] is not None:
+        data['tops'] = striplog_from_tops(payload['tops']['depths'], payload['tops']['names'])
+    return Well({'header': Header(payload['header']),
+                 'location': Location(payload['location']),
+                 'data': data,
+                 'fname': fname})
+
+
+def _tmp_path(path):
+    """
+    A temporary name next to path, unique to this process and thread.
+    """
+    return path.with_name('{}.tmp{}-{}'.format(path.name, os.getpid(), threading.get_ident()))
+
+
+def save_well(w, lasfile, topsfile=None, cache_dir=CACHE_DIR, payload=None):
+    """
+    Writes a parsed well (and its tops, if any) to the cache, with the
+    statistics of its curves.
+    """
+    if payload is None:
+        payload = to_payload(w)
+    wdir = well_cache_dir(lasfile, cache_dir)
+    wdir.mkdir(parents=True, exist_ok=True)
+
+    # each file is written then renamed: a process that has the old file mapped keeps
+    # reading it (truncating it under the mapping would crash the reader with SIGBUS),
+    # and two processes caching the same well at once can't interleave their writes
+    for mnemonic, (values, _) in payload['curves'].items():
+        path = wdir / '{}.npy'.format(mnemonic)
+        tmp = _tmp_path(path)
+        with open(tmp, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp, path)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'las': file_key(lasfile),
+        'tops_file': file_key(topsfile),
+        'header': payload['header'],
+        'location': payload['location'],
+        'curves': {m: params for m, (_, params) in payload['curves'].items()},
+        'stats': curve_stats.payload_stats(payload),
+        'tops': payload['tops'],
+    }
+    # last, so a worker never reads a meta.json whose curves aren't written yet
+    tmp = _tmp_path(wdir / 'meta.json')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, wdir / 'meta.json')
+    return wdir
+
+
+def read_meta(lasfile, topsfile=None, cache_dir=CACHE_DIR):
+    """
+    Returns the cached meta.json for a LAS file, or None if there is no
+    entry or the LAS or tops file changed since it was written.
+    """
+    meta_file = well_cache_dir(lasfile, cache_dir) / 'meta.json'
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    if meta['las'] != file_key(lasfile) or meta['tops_file'] != file_key(topsfile):
+        return None
+    return meta
+
+
+def curve_view(data, params):
+    """
+    A welly Curve over data without copying it (Curve(data) always copies,
+    which would turn a memory map into private memory).
+    """
+    curve = data.view(Curve)
+    for k, v in params.items():
+        setattr(curve, k, v)
+    return curve
+
+
+def load_curve(lasfile, mnemonic, meta, cache_dir=CACHE_DIR, mmap_mode=None):
+    """
+    Returns one cached curve as a welly Curve, memory mapped if mmap_mode
+    is given (e.g. 'r').
+    """
+    path = well_cache_dir(lasfile, cache_dir) / '{}.npy'.format(mnemonic)
+    data = np.load(path, mmap_mode=mmap_mode)
+    return curve_view(data, meta['curves'][mnemonic])
+
+
+def load_payload(lasfile, topsfile=None, cache_dir=CACHE_DIR, mmap_mode=None):
+    """
+    Returns the cached well as a to_payload() dict, or None if it must be re-parsed.
+    """
+    meta = read_meta(lasfile, topsfile, cache_dir)
+    if meta is None:
+        return None
+    wdir = well_cache_dir(lasfile, cache_dir)
+    curves = {m: (np.load(wdir / '{}.npy'.format(m), mmap_mode=mmap_mode), params)
+              for m, params in meta['curves'].items()}
+    return {'header': meta['header'],
+            'location': meta['location'],
+            'curves': curves,
+            'tops': meta['tops']}
+
+
+def tops_file_for(lasfile, tops_path):
+    """
+    Returns the tops CSV with the same name as the LAS file, or None.
+    e.g. Torosa-1.LAS and Torosa-1.csv
+    """
+    if tops_path is None:
+        return None
+    fname = Path(tops_path) / '{}.csv'.format(Path(lasfile).stem)
+    return str(fname) if fname.exists() else None
+
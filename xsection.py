@@ -0,0 +1,305 @@
+"""
+Matplotlib cross-section of the wells in a Project: one panel per well with
+the GR curve and the tops striplog.
+
+XSection renders each well panel to its own raster, cached by well and
+tops version, and stitches them together, so a pick change only redraws
+the panel of that one well.
+The panels of a new section can be drawn in parallel, in worker processes.
+XSection can take the tops from a pick store (or a session's PickLayer)
+instead of the wells' striplogs, so the shared Project is never modified.
+"""
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+import matplotlib.image
+import numpy as np
+from matplotlib import ticker
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from striplog.striplog import StriplogError
+from welly import Project
+
+import curve_query
+import curve_stats
+import tops
+from lru import LRUCache
+
+
+def sort_project(p, sorted_well_list):
+    """
+    Returns a Project with the wells in the order of sorted_well_list (UWIs),
+    leaving out wells that aren't in the list.
+    """
+    wells = [p.get_well(uwi) for uwi in sorted_well_list]
+    return Project([w for w in wells if w is not None])
+
+
+def setup_ax(ax, depth=False, major=100, minor=25, ymin=3000, ymax=5500):
+    """Set up common parameters for the Axes in the example."""
+    # only show the bottom spine
+    ax.yaxis.set_major_locator(ticker.NullLocator())
+    ax.spines.right.set_color('none')
+    ax.spines.left.set_color('grey')
+    ax.spines.top.set_color('none')
+    ax.xaxis.set_ticks_position('bottom')
+    ax.tick_params(which='major', width=1.00, length=5)
+    ax.tick_params(which='minor', width=0.75, length=2.5)
+    ax.yaxis.set_major_locator(ticker.MultipleLocator(major))
+    ax.yaxis.set_minor_locator(ticker.MultipleLocator(minor))
+    ax.patch.set_alpha(0.0)
+    ax.tick_params(axis='y', labelsize=5)
+    ax.set_ylim(ymax, ymin)
+    return
+
+
+def plot_panel(ax, title, depth, gr, striplog, legend, depth_ticks=False, ymin=3000, ymax=5500,
+               gr_range=None):
+    """
+    One well panel from plain arrays: the GR samples (depth, gr) and the
+    tops striplog (or None), so it can run where there is no Well. gr_range
+    is the GR value range across the curve track (the left 120/175 of the
+    panel, the rest is for the tops labels).
+    """
+    ax.set_title(title, fontsize=7, loc='center', fontweight='bold',
+                rotation=rot_title(title))
+    if striplog is not None:
+        plot_tops(ax, striplog, field='formation', ymin=ymin, ymax=ymax)
+        striplog.plot(ax=ax, legend=legend, alpha=0.5)
+    lo, hi = gr_range or (0, 120)
+    ax.plot((gr - lo) / (hi - lo), depth, c='k', lw=0.5)
+    ax.set_xlim(0, 175 / 120)
+    if depth_ticks == False:
+        ax.set_yticklabels([])
+    setup_ax(ax, ymin=ymin, ymax=ymax)
+    return ax
+
+
+def plot_tops(ax, striplog, ymin=0, ymax=1e6, legend=None, field=None, **kwargs):
+    """
+    Plotting, but only for tops (as opposed to intervals).
+    """
+    if field is None:
+        raise StriplogError('You must provide a field to plot.')
+
+    ys = [iv.top.z for iv in striplog]
+
+    try:
+        try:
+            ts = [getattr(iv.primary, field) for iv in striplog]
+        except:
+            ts = [iv.data.get(field) for iv in striplog]
+    except:
+        print('Could not find field')
+        # raise StriplogError('Could not retrieve field.')
+
+    for y, t in zip(ys, ts):
+        if (y > ymin) and (y < ymax):
+            ax.axhline(y, color='dimgrey', lw=2, zorder=0)
+            ax.text(0.1, y, t,
+                    fontsize=5, color=(0.2,0.2,0.2,1), ha='left', va='center',
+                    bbox=dict(facecolor='white',
+                              edgecolor='None', #edgecolor='lightgrey',
+                              boxstyle='round, pad=0.1',
+                              alpha=0.85))
+    return
+
+
+def rot_title(title, max_title_len=10):
+    if len(title) > max_title_len:
+        rotate = 90
+    else:
+        rotate = 0
+    return rotate
+
+
+def encode_png(img, compress_level=1):
+    """
+    Encodes an RGBA array as PNG bytes in memory.
+    """
+    buf = io.BytesIO()
+    matplotlib.image.imsave(buf, img, format='png', pil_kwargs={'compress_level': compress_level})
+    return buf.getvalue()
+
+
+def tops_signature(w):
+    """
+    Default tops version of a well: the tops themselves, as a hashable tuple.
+    """
+    return tuple((iv.top.z, iv.primary.formation if iv.primary else None) for iv in w.data['tops'])
+
+
+def draw_panel(layout, title, depth, gr, tops_arrays, depth_ticks=False):
+    """
+    Draws one well panel on its own Agg canvas and returns it as an RGBA
+    uint8 array. Everything comes in as plain data that pickles, so this
+    can run in a worker process: layout is XSection.layout(), tops_arrays
+    (depths, names) as from tops.tops_to_arrays, or None.
+    """
+    width = layout['panel_width'] + (layout['label_width'] if depth_ticks else 0)
+    fig = Figure(figsize=(width, layout['height']), dpi=layout['dpi'])
+    FigureCanvasAgg(fig)
+    left = (layout['label_width'] if depth_ticks else 0.08) / width
+    right = 1 - 0.08 / width
+    bottom, top = layout['margins']['bottom'], layout['margins']['top']
+    ax = fig.add_axes([left, bottom, right - left, top - bottom])
+    striplog = None if tops_arrays is None else tops.striplog_from_tops(*tops_arrays)
+    plot_panel(ax, title, depth, gr, striplog, layout['legend'], depth_ticks=depth_ticks,
+               ymin=layout['ymin'], ymax=layout['ymax'], gr_range=layout['gr_range'])
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba()).copy()
+
+
+def _draw_panel_job(args):
+    return draw_panel(*args)
+
+
+class XSection:
+    """
+    Incremental cross-section renderer.
+
+    Each well panel is drawn on its own Agg canvas and kept as an RGBA
+    array in an LRU cache keyed by (UWI, tops version, depth window,
+    depth ticks). The section image is the panels stitched side by side,
+    so after a pick edit only the edited well's panel is redrawn.
+
+    With workers > 1 the panels that aren't cached are drawn in a pool of
+    worker processes, one panel per job: the parent reads the GR samples
+    in the depth window and the tops, the workers draw and send back the
+    RGBA arrays, and the parent stitches them. The panels are the same as
+    drawn in this process.
+
+    Args:
+        legend (Legend): striplog legend for the tops.
+        tops_version (callable): tops_version(well) returns a hashable
+            version of the well's tops, e.g. from the pick store.
+            Defaults to the tops content.
+        max_bytes (int): memory budget for cached panels.
+        gr_range (tuple): GR scale shared by every panel, e.g.
+            curve_stats.project_range(p, 'GR'); default each well's own.
+        workers (int): processes drawing panels; 1 draws them in this process.
+    """
+    panel_width = 1.0  # inches per well
+    label_width = 0.35  # extra inches for the depth labels on the first panel
+    height = 10
+    dpi = 100
+    margins = dict(bottom=0.04, top=0.88)  # room for rotated titles
+
+    def __init__(self, legend, ymin=3000, ymax=5500, tops_version=None, max_bytes=256 * 2**20,
+                 gr_range=None, workers=1):
+        self.legend = legend
+        self.ymin, self.ymax = ymin, ymax
+        self.gr_range = gr_range
+        self.tops_version = tops_version or tops_signature
+        self.panels = LRUCache(max_bytes)
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = Lock()
+
+    def layout(self):
+        """
+        What every panel is drawn with, as a dict for draw_panel.
+        """
+        return {'panel_width': self.panel_width, 'label_width': self.label_width,
+                'height': self.height, 'dpi': self.dpi, 'margins': self.margins,
+                'legend': self.legend, 'ymin': self.ymin, 'ymax': self.ymax,
+                'gr_range': self.gr_range}
+
+    def panel_data(self, w, depth_ticks=False, striplog=None):
+        """
+        draw_panel arguments for a well: the GR samples in the depth window
+        and the tops of striplog (default the well's own) as plain arrays.
+        """
+        depth, gr = curve_query.window(w, 'GR', self.ymin, self.ymax, margin=1)
+        striplog = w.data.get('tops') if striplog is None else striplog
+        tops_arrays = None if striplog is None else tops.tops_to_arrays(striplog)
+        layout = self.layout()
+        layout['gr_range'] = self.gr_range or curve_stats.display_range(w, 'GR')
+        # copies, not views of memory mapped curves, so they pickle as plain arrays
+        return (layout, w.header.uwi, np.array(depth), np.array(gr), tops_arrays, depth_ticks)
+
+    def render_panel(self, w, depth_ticks=False, striplog=None):
+        """
+        Draws one well panel and returns it as an RGBA uint8 array, with the
+        tops of striplog (default the well's own).
+        """
+        return draw_panel(*self.panel_data(w, depth_ticks, striplog))
+
+    def _striplog(self, w, picks):
+        return None if picks is None else tops.striplog_from_df(picks.get_well(w.uwi))
+
+    def panel_key(self, w, depth_ticks=False, picks=None):
+        if picks is None:
+            return (w.uwi, self.tops_version(w), self.ymin, self.ymax, depth_ticks)
+        # sessions that haven't changed this well share the store's version, and the panel
+        return (w.uwi, ('picks', picks.well_version(w.uwi)), self.ymin, self.ymax, depth_ticks)
+
+    def panel(self, w, depth_ticks=False, picks=None):
+        """
+        Returns the cached panel of a well, drawing it if its tops changed.
+        The tops come from picks (a PickStore or PickLayer) if given, else
+        from the well's striplog.
+        """
+        return self.panels.get_or_compute(self.panel_key(w, depth_ticks, picks), lambda: self.render_panel(
+            w, depth_ticks, self._striplog(w, picks)))
+
+    def start(self):
+        """
+        Starts the worker processes now rather than on the first section.
+        A process forked after that (e.g. a gunicorn worker) starts its own.
+        """
+        with self._pool_lock:
+            if self.workers > 1 and (self._pool is None or self._pool_pid != os.getpid()):
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pool_pid = os.getpid()
+                self._pool.submit(int).result()
+        return self
+
+    def _render_missing(self, wells, picks):
+        """
+        Draws the panels of wells that aren't cached across the worker
+        processes and caches them.
+        """
+        keys, jobs = [], []
+        for i, w in enumerate(wells):
+            key = self.panel_key(w, i == 0, picks)
+            if key not in self.panels and key not in keys:
+                keys.append(key)
+                jobs.append(self.panel_data(w, i == 0, self._striplog(w, picks)))
+        if len(jobs) < 2:
+            return
+        self.start()
+        try:
+            images = list(self._pool.map(_draw_panel_job, jobs))
+        except BrokenProcessPool:
+            # a worker died: start a new pool next time, panel() draws these here
+            with self._pool_lock:
+                self._pool = None
+            return
+        for key, image in zip(keys, images):
+            self.panels.put(key, image)
+
+    def image(self, p, sorted_well_list=None, picks=None):
+        """
+        Returns the whole section as one RGBA array.
+        """
+        if sorted_well_list:
+            p = sort_project(p, sorted_well_list)
+        wells = list(p)
+        if self.workers > 1:
+            self._render_missing(wells, picks)
+        return np.hstack([self.panel(w, depth_ticks=(i == 0), picks=picks) for i, w in enumerate(wells)])
+
+    def png(self, p, sorted_well_list=None, picks=None):
+        return encode_png(self.image(p, sorted_well_list, picks))
+
+    def invalidate(self, uwi=None):
+        """
+        Drops the cached panels of one well, or of all wells.
+        """
+        self.panels.invalidate(lambda key: uwi is None or key[0] == uwi)
+
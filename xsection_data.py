@@ -0,0 +1,90 @@
+"""
+Compact JSON for the interactive (browser drawn) cross-section.
+
+The image cross-section (xsection.py) is drawn by matplotlib on the server
+and sent again as a PNG after every pick edit. The interactive one is
+drawn by Plotly in the browser (assets/clientside.js) from two stores:
+
+    curves  the decimated GR of every well of the section, as base64
+            little-endian float32 arrays. Sent once per section.
+    tops    the picks of the wells whose pick version changed since the
+            versions the browser has, plus the versions it has now. After
+            an edit that's the picks of the edited well only.
+
+The browser keeps the picks it was sent and redraws the section itself,
+so pans and zooms don't go to the server at all.
+"""
+import base64
+
+import numpy as np
+
+import decimate
+
+
+def encode_array(a):
+    """
+    An array as base64 float32 (little-endian), the browser decodes it
+    into a Float32Array. NaN stays NaN, i.e. a gap in the line.
+    """
+    return base64.b64encode(np.asarray(a, dtype='<f4').tobytes()).decode()
+
+
+def decode_array(s):
+    return np.frombuffer(base64.b64decode(s), dtype='<f4')
+
+
+def well_curve(w, ymin, ymax, mnemonic='GR', pixels=2000):
+    """
+    {'uwi', 'depth', 'values'} of a well's decimated curve between ymin
+    and ymax, or None if the well doesn't have the curve.
+    """
+    if mnemonic not in w.data:
+        return None
+    depth, values = decimate.curve_window(w, mnemonic, ymin, ymax, pixels)
+    return {'uwi': w.uwi, 'depth': encode_array(depth), 'values': encode_array(values)}
+
+
+def section_curves(p, uwis, ymin, ymax, gr_range=None, mnemonic='GR', pixels=2000):
+    """
+    The curves store: the wells of uwis that are in p, in order, and what
+    they're drawn with. pixels is the decimation (about one min/max pair
+    per pixel); a few times the plot height leaves detail for zooming in.
+    """
+    wells = {w.uwi: w for w in p}
+    curves = [well_curve(wells[uwi], ymin, ymax, mnemonic, pixels) for uwi in uwis if uwi in wells]
+    return {'ymin': ymin, 'ymax': ymax,
+            'range': list(gr_range) if gr_range else None,
+            'curve': mnemonic,
+            'wells': [c for c in curves if c is not None]}
+
+
+def well_tops(picks, uwi):
+    """
+    [[name, md], ...] of one well's picks with a depth, by depth.
+    """
+    df = picks.get_well(uwi).dropna(subset=['MD'])
+    return [[name, round(float(md), 3)] for name, md in zip(df['PICK'], df['MD'])]
+
+
+def tops_delta(picks, uwis, known=None):
+    """
+    The tops store after the browser has the picks of known ({uwi:
+    version}): the picks of the wells of uwis whose version is different,
+    and the versions of every well the browser then has. None if nothing
+    changed.
+
+    Args:
+        picks (PickStore or PickLayer): the session's picks.
+        uwis (list): wells of the section.
+        known (dict): the 'versions' of the last tops store sent.
+    """
+    versions = dict(known or {})
+    changed = {}
+    for uwi in uwis:
+        version = str(picks.well_version(uwi))
+        if versions.get(uwi) != version:
+            versions[uwi] = version
+            changed[uwi] = well_tops(picks, uwi)
+    if not changed:
+        return None
+    return {'versions': versions, 'tops': changed}